@@ -1,8 +1,11 @@
+from inspect import isawaitable
 from typing import Any, Callable, TypeVar, Type, ParamSpec, Concatenate
 import json
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.http import HttpRequest, HttpResponseNotAllowed, HttpResponse
 from django.utils import timezone
+from django.utils.http import parse_etags
 from pydantic import BaseModel, ValidationError
 from rest_framework.response import Response
 from rest_framework.request import Request
@@ -61,6 +64,29 @@ def json_bad_request(message: str, errors: list) -> Response:
     return json_fail_response(message, errors, 400)
 
 
+def json_too_many_requests(message: str, retry_after: int, errors: list | None = None) -> Response:
+    """JSON Too Many Requests response with the Retry-After header"""
+    if errors is None:
+        errors = ['TooManyRequests']
+    response = json_fail_response(message, errors, 429, {'retry_after': retry_after})
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check the If-None-Match header of the request with the weak comparison"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+
+def not_modified_response(etag: str, cache_control: str = 'private, no-cache') -> Response:
+    """Not Modified response without body"""
+    return Response(status=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+
+
 def json_request(request_body: Type[D]):
     """
         Decorator to API method that contain JSON body.
@@ -68,15 +94,75 @@ def json_request(request_body: Type[D]):
         and converts to the request_body request data structure.
         The received data structure of the request passes the first arguments to the function.
         Arguments to the resulting function can only be passed as kvargs.
+        Coroutine methods stay coroutines.
+    """
+    def parse(request: Request) -> D | Response:
+        try:
+            return request_body.parse_obj(request.data)
+        except ValidationError as e:
+            return json_bad_request('JSON body validation error', e.errors())
+
+    return request_decorator(parse)
+
+
+def query_request(request_query: Type[D]):
+    """
+        Decorator to API method that contain query parameters.
+        Validates the query parameters according to request_query and converts to the request_query data structure,
+        which is passed to the function after the request. Coroutine methods stay coroutines.
     """
+    def parse(request: Request) -> D | Response:
+        try:
+            return request_query(**request.query_params.dict())
+        except ValidationError as e:
+            return json_bad_request('Query parameters validation error', e.errors())
+
+    return request_decorator(parse)
+
+
+def request_decorator(parse: Callable[[Request], D | Response]):
+    """Decorator passing the parsed request data to the API method, responses of parse are returned as is."""
     def decorator(
         func: Callable[Concatenate[APIView, Request, D, P], Response]
     ) -> Callable[Concatenate[APIView, Request, P], Response]:
+        if iscoroutinefunction(func):
+            async def async_wrapper(self: APIView, request: Request, *args, **kwargs) -> Response:
+                data = parse(request)
+                if isinstance(data, Response):
+                    return data
+                return await func(self, request, data, *args, **kwargs)
+            return async_wrapper
+
         def wrapper(self: APIView, request: Request, *args, **kwargs) -> Response:
-            try:
-                data = request_body(**request.data)
-            except ValidationError as e:
-                return json_bad_request('JSON body validation error', e.errors())
+            data = parse(request)
+            if isinstance(data, Response):
+                return data
             return func(self, request, data, *args, **kwargs)
         return wrapper
     return decorator
+
+
+class AsyncAPIView(APIView):
+    """
+        API view with coroutine handlers, Django runs it in the event loop under ASGI.
+        Authentication, permissions and throttling can query the DB, so they are run in a thread.
+    """
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> Response:
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
@@ -9,8 +9,35 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.urls import Resolver404, resolve
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'common.settings')
 
-application = get_asgi_application()
+
+class LongLivedASGIHandler(ASGIHandler):
+    """
+        ASGI handler that serves views with long_lived_response = True without a thread per response.
+        Django handles every request in a ThreadSensitiveContext, whose thread lives until the response is sent,
+        so every open stream of events would hold a thread. Requests of these views are handled
+        without the context, their short synchronous parts (middleware, authentication) run in the shared
+        thread of asgiref, and the views make their own queries in the shared executor.
+    """
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.is_long_lived(scope):
+            await self.handle(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+    @staticmethod
+    def is_long_lived(scope) -> bool:
+        try:
+            match = resolve(scope['path'].removeprefix(scope.get('root_path', '')))
+        except Resolver404:
+            return False
+        return getattr(getattr(match.func, 'view_class', None), 'long_lived_response', False)
+
+
+django.setup(set_prefix=False)
+application = LongLivedASGIHandler()
@@ -0,0 +1,60 @@
+from dataclasses import fields, is_dataclass
+from typing import Any
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class DataclassJSONEncoder(JSONEncoder):
+    """JSON encoder of DRF that also serializes dataclasses without copying them"""
+    def default(self, obj: Any) -> Any:
+        if is_dataclass(obj) and not isinstance(obj, type):
+            return {field.name: getattr(obj, field.name) for field in fields(obj)}
+        return super().default(obj)
+
+
+def encode_json(data: Any) -> bytes:
+    """Compact UTF-8 JSON of the data, dataclasses are serialized as objects"""
+    if orjson is not None:
+        return orjson.dumps(data, default=DataclassJSONEncoder().default, option=orjson.OPT_UTC_Z)
+    return json.dumps(data, cls=DataclassJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+        JSON renderer serializing dataclasses directly, with orjson if it is installed.
+        Indented JSON, for example of the browsable API, is rendered by the standard renderer.
+    """
+    encoder_class = DataclassJSONEncoder
+
+    def render(self, data: Any, accepted_media_type: str | None = None, renderer_context: dict | None = None) -> bytes:
+        if data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode_json(data)
+
+
+class FastJSONParser(JSONParser):
+    """JSON parser with orjson if it is installed"""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type: str | None = None, parser_context: dict | None = None) -> Any:
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+
+class EventStreamRenderer(FastJSONRenderer):
+    """Renderer accepting server-sent event requests, error responses of the stream are rendered as JSON"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
@@ -27,6 +27,43 @@ if os.environ.get('VARIABLES_INITIALIZED'):
     DB_PORT = os.environ.get('DB_PORT')
     MODELS_HOSTS: list[str] = json.loads(os.environ['MODELS_HOSTS'])
     WORKERS_BY_MODEL = int(os.environ.get('WORKERS_BY_MODEL'))
+    CALCULATION_ENGINE = os.environ.get('CALCULATION_ENGINE', 'thread')
+    CALCULATION_DB_THREADS = int(os.environ.get('CALCULATION_DB_THREADS', 4))
+    CALCULATION_POLL_INTERVAL = float(os.environ.get('CALCULATION_POLL_INTERVAL', 1))
+    CALCULATION_CLAIM_TIMEOUT = float(os.environ.get('CALCULATION_CLAIM_TIMEOUT', 60))
+    CALCULATION_HEARTBEAT_INTERVAL = float(os.environ.get('CALCULATION_HEARTBEAT_INTERVAL', 10))
+    CALCULATION_MAX_ATTEMPTS = int(os.environ.get('CALCULATION_MAX_ATTEMPTS', 3))
+    CALCULATION_USER_MAX_IN_PROCESS = int(os.environ.get('CALCULATION_USER_MAX_IN_PROCESS', 0))
+    MODEL_POOL_SIZE = int(os.environ.get('MODEL_POOL_SIZE', 0))
+    MODEL_CONNECT_TIMEOUT = float(os.environ.get('MODEL_CONNECT_TIMEOUT', 3))
+    MODEL_READ_TIMEOUT = float(os.environ.get('MODEL_READ_TIMEOUT', 120))
+    MODEL_RETRIES = int(os.environ.get('MODEL_RETRIES', 2))
+    MODEL_RETRY_BACKOFF = float(os.environ.get('MODEL_RETRY_BACKOFF', 0.2))
+    MODEL_REQUEST_COMPRESSION = bool(int(os.environ.get('MODEL_REQUEST_COMPRESSION', 0)))
+    MODEL_BATCH_SIZE = int(os.environ.get('MODEL_BATCH_SIZE', 0))
+    MODEL_BATCH_DELAY = float(os.environ.get('MODEL_BATCH_DELAY', 0.02))
+    MODEL_CHUNK_SIZE = int(os.environ.get('MODEL_CHUNK_SIZE', 0))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 0))
+    ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 0))
+    ADMISSION_RATE_WINDOW = float(os.environ.get('ADMISSION_RATE_WINDOW', 60))
+    ADMISSION_DEFAULT_DURATION = float(os.environ.get('ADMISSION_DEFAULT_DURATION', 30))
+    REPORT_RESULT_CACHE = bool(int(os.environ.get('REPORT_RESULT_CACHE', 1)))
+    REPORT_STREAM_INTERVAL = float(os.environ.get('REPORT_STREAM_INTERVAL', 1))
+    REPORT_STREAM_TIMEOUT = float(os.environ.get('REPORT_STREAM_TIMEOUT', 300))
+    REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 1000))
+    REPORT_CACHE_LOCATION = os.environ.get('REPORT_CACHE_LOCATION', '')
+    REPORT_COMPACT_RECOGNITIONS = bool(int(os.environ.get('REPORT_COMPACT_RECOGNITIONS', 0)))
+    SENTENCE_MEMO_SIZE = int(os.environ.get('SENTENCE_MEMO_SIZE', 0))
+    SENTENCE_MEMO_TTL = float(os.environ.get('SENTENCE_MEMO_TTL', 604800))
+    SENTENCE_MEMO_VERSION_TTL = float(os.environ.get('SENTENCE_MEMO_VERSION_TTL', 300))
+    MODEL_BALANCING = os.environ.get('MODEL_BALANCING', 'fifo')
+    MODEL_CONCURRENCY_MIN = int(os.environ.get('MODEL_CONCURRENCY_MIN', 1))
+    MODEL_CONCURRENCY_MAX = int(os.environ.get('MODEL_CONCURRENCY_MAX', 0))
+    MODEL_LATENCY_TARGET = float(os.environ.get('MODEL_LATENCY_TARGET', 0))
+    MODEL_FAILURE_THRESHOLD = int(os.environ.get('MODEL_FAILURE_THRESHOLD', 5))
+    MODEL_RESET_TIMEOUT = float(os.environ.get('MODEL_RESET_TIMEOUT', 30))
+    MODEL_HEALTH_INTERVAL = float(os.environ.get('MODEL_HEALTH_INTERVAL', 5))
+    MODEL_HEALTH_PATH = os.environ.get('MODEL_HEALTH_PATH', '')
 else:
     config = dotenv_values('.env.developer')
     DEBUG = bool(int(config.get('DEBUG', True)))
@@ -38,6 +75,43 @@ else:
     DB_PORT = config.get('DB_PORT')
     MODELS_HOSTS: list[str] = json.loads(config.get('MODELS_HOSTS'))
     WORKERS_BY_MODEL = int(config.get('WORKERS_BY_MODEL'))
+    CALCULATION_ENGINE = config.get('CALCULATION_ENGINE', 'thread')
+    CALCULATION_DB_THREADS = int(config.get('CALCULATION_DB_THREADS', 4))
+    CALCULATION_POLL_INTERVAL = float(config.get('CALCULATION_POLL_INTERVAL', 1))
+    CALCULATION_CLAIM_TIMEOUT = float(config.get('CALCULATION_CLAIM_TIMEOUT', 60))
+    CALCULATION_HEARTBEAT_INTERVAL = float(config.get('CALCULATION_HEARTBEAT_INTERVAL', 10))
+    CALCULATION_MAX_ATTEMPTS = int(config.get('CALCULATION_MAX_ATTEMPTS', 3))
+    CALCULATION_USER_MAX_IN_PROCESS = int(config.get('CALCULATION_USER_MAX_IN_PROCESS', 0))
+    MODEL_POOL_SIZE = int(config.get('MODEL_POOL_SIZE', 0))
+    MODEL_CONNECT_TIMEOUT = float(config.get('MODEL_CONNECT_TIMEOUT', 3))
+    MODEL_READ_TIMEOUT = float(config.get('MODEL_READ_TIMEOUT', 120))
+    MODEL_RETRIES = int(config.get('MODEL_RETRIES', 2))
+    MODEL_RETRY_BACKOFF = float(config.get('MODEL_RETRY_BACKOFF', 0.2))
+    MODEL_REQUEST_COMPRESSION = bool(int(config.get('MODEL_REQUEST_COMPRESSION', 0)))
+    MODEL_BATCH_SIZE = int(config.get('MODEL_BATCH_SIZE', 0))
+    MODEL_BATCH_DELAY = float(config.get('MODEL_BATCH_DELAY', 0.02))
+    MODEL_CHUNK_SIZE = int(config.get('MODEL_CHUNK_SIZE', 0))
+    ADMISSION_MAX_QUEUE = int(config.get('ADMISSION_MAX_QUEUE', 0))
+    ADMISSION_MAX_WAIT = float(config.get('ADMISSION_MAX_WAIT', 0))
+    ADMISSION_RATE_WINDOW = float(config.get('ADMISSION_RATE_WINDOW', 60))
+    ADMISSION_DEFAULT_DURATION = float(config.get('ADMISSION_DEFAULT_DURATION', 30))
+    REPORT_RESULT_CACHE = bool(int(config.get('REPORT_RESULT_CACHE', 1)))
+    REPORT_STREAM_INTERVAL = float(config.get('REPORT_STREAM_INTERVAL', 1))
+    REPORT_STREAM_TIMEOUT = float(config.get('REPORT_STREAM_TIMEOUT', 300))
+    REPORT_CACHE_SIZE = int(config.get('REPORT_CACHE_SIZE', 1000))
+    REPORT_CACHE_LOCATION = config.get('REPORT_CACHE_LOCATION', '')
+    REPORT_COMPACT_RECOGNITIONS = bool(int(config.get('REPORT_COMPACT_RECOGNITIONS', 0)))
+    SENTENCE_MEMO_SIZE = int(config.get('SENTENCE_MEMO_SIZE', 0))
+    SENTENCE_MEMO_TTL = float(config.get('SENTENCE_MEMO_TTL', 604800))
+    SENTENCE_MEMO_VERSION_TTL = float(config.get('SENTENCE_MEMO_VERSION_TTL', 300))
+    MODEL_BALANCING = config.get('MODEL_BALANCING', 'fifo')
+    MODEL_CONCURRENCY_MIN = int(config.get('MODEL_CONCURRENCY_MIN', 1))
+    MODEL_CONCURRENCY_MAX = int(config.get('MODEL_CONCURRENCY_MAX', 0))
+    MODEL_LATENCY_TARGET = float(config.get('MODEL_LATENCY_TARGET', 0))
+    MODEL_FAILURE_THRESHOLD = int(config.get('MODEL_FAILURE_THRESHOLD', 5))
+    MODEL_RESET_TIMEOUT = float(config.get('MODEL_RESET_TIMEOUT', 30))
+    MODEL_HEALTH_INTERVAL = float(config.get('MODEL_HEALTH_INTERVAL', 5))
+    MODEL_HEALTH_PATH = config.get('MODEL_HEALTH_PATH', '')
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -84,7 +158,16 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'common.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'common.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 OAUTH2_PROVIDER = {
@@ -127,6 +210,29 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Completed reports are cached in the reports cache, the least recently used ones are evicted.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': (
+            'django.core.cache.backends.dummy.DummyCache' if not REPORT_CACHE_SIZE
+            else 'django.core.cache.backends.filebased.FileBasedCache' if REPORT_CACHE_LOCATION
+            else 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': REPORT_CACHE_LOCATION or 'reports',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': REPORT_CACHE_SIZE,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
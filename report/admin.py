@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import CalculationShare
+
+
+@admin.register(CalculationShare)
+class CalculationShareAdmin(admin.ModelAdmin):
+    list_display = ('user', 'weight', 'priority', 'max_in_process')
+    search_fields = ('user__username',)
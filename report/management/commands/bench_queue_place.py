@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from report.models import Report
+from report.service.queue import ReportQueue
+
+
+class Rollback(Exception):
+    """Raised to roll back the benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Measure the queue place lookup time for different queue depths. All created data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--lookups', type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.__run(options['sizes'], options['lookups'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def __run(self, sizes: list[int], lookups: int) -> None:
+        user = User.objects.create_user(f'bench-{time.time_ns()}')
+        queued: list[int] = []
+        self.stdout.write(f'{"queued":>10} {"mean, ms":>10} {"max, ms":>10}')
+        for size in sorted(sizes):
+            reports = [
+                Report(text='', user=user, status=Report.ReportStatus.WAITING, create_dttm=timezone.now())
+                for _ in range(size - len(queued))
+            ]
+            ReportQueue.number(reports)
+            queued.extend(report.pk for report in Report.objects.bulk_create(reports, batch_size=5000))
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Report._meta.db_table}')
+            timings = []
+            for report_id in random.choices(queued, k=lookups):
+                start = time.perf_counter()
+                ReportQueue.get_place(report_id)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(
+                f'{size:>10} {sum(timings) / len(timings) * 1000:>10.3f} {max(timings) * 1000:>10.3f}'
+            )
@@ -0,0 +1,70 @@
+from dataclasses import asdict
+from io import BytesIO
+from typing import Callable
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from common.api_utils import json_success_response
+from common.renderers import DataclassJSONEncoder, FastJSONParser, FastJSONRenderer, orjson
+from report.service.report import RecognitionInfo, ReportInfo, ReportStatus, ReportUrls
+from report.views import ReportBulkCreateData
+
+
+class Command(BaseCommand):
+    help = 'Measure the encoding time of a report response and the decoding time of a bulk request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sentences', type=int, default=1000)
+        parser.add_argument('--repeats', type=int, default=200)
+
+    def handle(self, *args, **options):
+        sentences = options['sentences']
+        report_info = ReportInfo(
+            id=1,
+            text=' '.join(f'Sentence number {i} of the report.' for i in range(sentences)),
+            status=ReportStatus.COMPLETED,
+            user=1,
+            queue_place=None,
+            expected_start_dttm=None,
+            expected_end_dttm=None,
+            recognitions=[
+                RecognitionInfo(i, 1, f'Sentence number {i} of the report.', i / sentences, i)
+                for i in range(sentences)
+            ],
+            urls=ReportUrls('/report/1', '/api/v1/report/1'),
+        )
+        data = {'texts': [f'Text number {i} of the bulk request.' for i in range(sentences)]}
+        body = json.dumps(data).encode()
+        self.stdout.write(f'{sentences} sentences, {options["repeats"]} repeats')
+        self.stdout.write(f'{"path":<40} {"mean, ms":>10}')
+        cases: list[tuple[str, Callable[[], object]]] = [
+            ('response: asdict + JSONRenderer', lambda: JSONRenderer().render(
+                json_success_response(asdict(report_info)).data
+            )),
+            ('response: FastJSONRenderer, json', lambda: json.dumps(
+                json_success_response(report_info).data, cls=DataclassJSONEncoder, separators=(',', ':')
+            )),
+            ('request: JSONParser', lambda: JSONParser().parse(BytesIO(body))),
+            ('request: validation', lambda: ReportBulkCreateData.parse_obj(data)),
+        ]
+        if orjson is not None:
+            cases += [
+                ('response: FastJSONRenderer, orjson', lambda: FastJSONRenderer().render(
+                    json_success_response(report_info).data
+                )),
+                    ('request: FastJSONParser, orjson', lambda: FastJSONParser().parse(BytesIO(body))),
+            ]
+        for name, case in cases:
+            self.stdout.write(f'{name:<40} {self.__measure(case, options["repeats"]) * 1000:>10.3f}')
+
+    @staticmethod
+    def __measure(case: Callable[[], object], repeats: int) -> float:
+        case()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            case()
+        return (time.perf_counter() - start) / repeats
@@ -0,0 +1,291 @@
+from dataclasses import dataclass, field
+from math import ceil
+from queue import Empty, SimpleQueue
+from threading import Event, Thread
+from urllib.parse import urlsplit
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from common.settings import CALCULATION_ENGINE, MODELS_HOSTS, WORKERS_BY_MODEL
+from report.models import Report
+from report.service.report import ReportStatus
+from .stub_model import StubModelServer, add_stub_arguments, get_stub_options
+
+
+LOCAL_HOSTS = frozenset({'127.0.0.1', 'localhost'})
+FINAL_STATUSES = frozenset({ReportStatus.COMPLETED.value, ReportStatus.ERROR.value})
+METRICS = [
+    ('reports/sec', ('reports_per_second',)),
+    ('time to complete p50, s', ('time_to_complete', 'p50')),
+    ('time to complete p95, s', ('time_to_complete', 'p95')),
+    ('time to complete p99, s', ('time_to_complete', 'p99')),
+    ('create p50, ms', ('api', 'create', 'p50')),
+    ('create p99, ms', ('api', 'create', 'p99')),
+    ('progress p50, ms', ('api', 'progress', 'p50')),
+    ('progress p99, ms', ('api', 'progress', 'p99')),
+    ('result p50, ms', ('api', 'result', 'p50')),
+    ('result p99, ms', ('api', 'result', 'p99')),
+    ('max queue depth', ('max_queue_depth',)),
+]
+
+
+@dataclass()
+class ClientResult:
+    create: list[float] = field(default_factory=list)
+    progress: list[float] = field(default_factory=list)
+    result: list[float] = field(default_factory=list)
+    rejected: int = 0
+    failed_requests: int = 0
+    first_error: str | None = None
+
+    def fail(self, error: str) -> None:
+        self.failed_requests += 1
+        if self.first_error is None:
+            self.first_error = error
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of the sorted values."""
+    return values[max(0, ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize(values: list[float], scale: float = 1) -> dict:
+    values = sorted(value * scale for value in values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test of the report calculation through the API: each client creates reports one by one '
+        'and polls each of them until it is calculated. Measures reports per second, time to complete, '
+        'queue depth over time and API latency. Created users and reports are deleted after the run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, default=200)
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent clients, each with its own user')
+        parser.add_argument('--sentences', type=int, default=10, help='Sentences per report')
+        parser.add_argument('--poll-interval', type=float, default=0.2)
+        parser.add_argument('--sample-interval', type=float, default=0.5, help='Queue depth sampling interval')
+        parser.add_argument('--timeout', type=float, default=300, help='Max duration of the run, seconds')
+        parser.add_argument('--stub', action='store_true', help='Serve local MODELS_HOSTS with stub model services')
+        add_stub_arguments(parser)
+        parser.add_argument('--output', help='Save the results to the JSON file')
+        parser.add_argument('--baseline', help='Compare with the JSON results of a previous run')
+        parser.add_argument('--keep', action='store_true', help='Keep the created users and reports')
+
+    def handle(self, *args, **options):
+        servers = self.__start_stubs(options) if options['stub'] else []
+        run_id = time.time_ns()
+        users = [User.objects.create_user(f'bench-{run_id}-{i}') for i in range(options['clients'])]
+        try:
+            # The API is called in the process by the test client, its requests are made to the testserver host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = self.__run(run_id, users, options)
+        finally:
+            if not options['keep']:
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            for server in servers:
+                server.stop()
+        results['model'] = [{'url': server.url, **vars(server.get_stats())} for server in servers]
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+        self.__print(results, baseline)
+
+    def __start_stubs(self, options: dict) -> list[StubModelServer]:
+        servers = []
+        for url in MODELS_HOSTS:
+            parts = urlsplit(url)
+            if parts.hostname in LOCAL_HOSTS:
+                servers.append(StubModelServer(parts.hostname, parts.port or 80, get_stub_options(options)))
+                servers[-1].start()
+        return servers
+
+    def __run(self, run_id: int, users: list[User], options: dict) -> dict:
+        indexes = SimpleQueue()
+        for index in range(options['reports']):
+            indexes.put(index)
+        started = timezone.now()
+        start = time.perf_counter()
+        deadline = start + options['timeout']
+        client_results = [ClientResult() for _ in users]
+        clients = [
+            Thread(target=self.__run_client, args=(run_id, user, indexes, deadline, options, result))
+            for user, result in zip(users, client_results)
+        ]
+        samples: list[dict] = []
+        stop = Event()
+        sampler = Thread(target=self.__sample, args=(users, start, options['sample_interval'], stop, samples))
+        sampler.start()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        stop.set()
+        sampler.join()
+        reports = list(
+            Report.objects
+            .filter(user__in=users)
+            .values_list('status', 'create_dttm', 'calculation_end_dttm')
+        )
+        completed = [report for report in reports if report[0] == Report.ReportStatus.COMPLETED]
+        duration = (max(report[2] for report in completed) - started).total_seconds() if completed else None
+        return {
+            'started': started.isoformat(),
+            'options': {
+                name: options[name] for name in (
+                    'reports', 'clients', 'sentences', 'poll_interval', 'timeout', 'stub',
+                    'latency', 'jitter', 'error_rate', 'sentence_cost',
+                )
+            },
+            'settings': {
+                'engine': CALCULATION_ENGINE,
+                'models_hosts': MODELS_HOSTS,
+                'workers_by_model': WORKERS_BY_MODEL,
+                'database': connection.vendor,
+            },
+            'reports': {
+                'created': len(reports),
+                'completed': len(completed),
+                'error': sum(report[0] == Report.ReportStatus.ERROR for report in reports),
+                'unfinished': sum(
+                    report[0] in (Report.ReportStatus.WAITING, Report.ReportStatus.IN_PROCESS) for report in reports
+                ),
+                'rejected': sum(result.rejected for result in client_results),
+                'failed_requests': sum(result.failed_requests for result in client_results),
+                'first_error': next(
+                    (result.first_error for result in client_results if result.first_error is not None), None
+                ),
+            },
+            'duration': time.perf_counter() - start,
+            'reports_per_second': len(completed) / duration if duration else 0,
+            'time_to_complete': summarize([(end - create).total_seconds() for _, create, end in completed]),
+            'api': {
+                name: summarize([value for result in client_results for value in getattr(result, name)], 1000)
+                for name in ('create', 'progress', 'result')
+            },
+            'max_queue_depth': max((sample['waiting'] for sample in samples), default=0),
+            'queue_depth': samples,
+        }
+
+    @staticmethod
+    def __run_client(
+        run_id: int, user: User, indexes: SimpleQueue, deadline: float, options: dict, result: ClientResult
+    ) -> None:
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    index = indexes.get_nowait()
+                except Empty:
+                    break
+                text = ' '.join(
+                    f'Sentence {sentence} of the report {index} of the run {run_id}.'
+                    for sentence in range(options['sentences'])
+                )
+                try:
+                    Command.__run_report(client, text, deadline, options, result)
+                except Exception as e:
+                    result.fail(repr(e))
+        finally:
+            connection.close()
+
+    @staticmethod
+    def __run_report(client: APIClient, text: str, deadline: float, options: dict, result: ClientResult) -> None:
+        """Create the report and poll it until it is calculated."""
+        start = time.perf_counter()
+        response = client.post(reverse('report:list'), {'text': text}, format='json')
+        result.create.append(time.perf_counter() - start)
+        if response.status_code == 429:
+            result.rejected += 1
+            return
+        if response.status_code != 201:
+            result.fail(f'POST {reverse("report:list")}: {response.status_code} {response.content[:200]!r}')
+            return
+        url = reverse('report:detail', args=[response.json()['data']['id']])
+        status = response.json()['data']['status']
+        while status not in FINAL_STATUSES and time.perf_counter() < deadline:
+            time.sleep(options['poll_interval'])
+            start = time.perf_counter()
+            response = client.get(url, {'omit': 'text,recognitions'})
+            result.progress.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                result.fail(f'GET {url}: {response.status_code} {response.content[:200]!r}')
+                return
+            status = response.json()['data']['status']
+        if status in FINAL_STATUSES:
+            start = time.perf_counter()
+            response = client.get(url)
+            result.result.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                result.fail(f'GET {url}: {response.status_code} {response.content[:200]!r}')
+
+    @staticmethod
+    def __sample(users: list[User], start: float, interval: float, stop: Event, samples: list[dict]) -> None:
+        try:
+            while not stop.wait(interval):
+                counts = Report.objects.filter(user__in=users).aggregate(
+                    waiting=Count('id', filter=Q(status=Report.ReportStatus.WAITING)),
+                    in_process=Count('id', filter=Q(status=Report.ReportStatus.IN_PROCESS)),
+                    done=Count('id', filter=Q(status__in=[Report.ReportStatus.COMPLETED, Report.ReportStatus.ERROR])),
+                )
+                samples.append({'time': round(time.perf_counter() - start, 3), **counts})
+        finally:
+            connection.close()
+
+    def __print(self, results: dict, baseline: dict | None) -> None:
+        reports = results['reports']
+        self.stdout.write(
+            f'{reports["completed"]} of {reports["created"]} reports completed in {results["duration"]:.1f} s, '
+            f'{reports["error"]} errors, {reports["unfinished"]} unfinished, {reports["rejected"]} rejected, '
+            f'{reports["failed_requests"]} failed requests'
+        )
+        if reports['first_error'] is not None:
+            self.stdout.write(self.style.ERROR(f'First failed request: {reports["first_error"]}'))
+        header = f'{"metric":<28} {"value":>12}'
+        if baseline is not None:
+            header += f' {"baseline":>12} {"change":>8}'
+        self.stdout.write(header)
+        for name, path in METRICS:
+            value = self.__get_metric(results, path)
+            line = f'{name:<28} {self.__format(value):>12}'
+            if baseline is not None:
+                base = self.__get_metric(baseline, path)
+                change = f'{(value - base) / base * 100:+.1f}%' if value is not None and base else ''
+                line += f' {self.__format(base):>12} {change:>8}'
+            self.stdout.write(line)
+
+    @staticmethod
+    def __get_metric(results: dict, path: tuple[str, ...]) -> float | None:
+        for key in path:
+            results = results.get(key) if isinstance(results, dict) else None
+        return results
+
+    @staticmethod
+    def __format(value: float | None) -> str:
+        return '-' if value is None else f'{value:.3f}'
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from report.models import Report
+from report.service.recognition_store import recognition_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert recognitions of completed reports saved one row per sentence to the compact form. '
+        'Reports whose sentences are not found in their texts are left as rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        last_id, checked, compacted = 0, 0, 0
+        while True:
+            reports = list(
+                Report.objects
+                .filter(status=Report.ReportStatus.COMPLETED, result__isnull=True, id__gt=last_id)
+                .order_by('id')
+                .only('id', 'text')[:options['batch_size']]
+            )
+            if not reports:
+                break
+            compacted += recognition_store.compact(reports)
+            checked += len(reports)
+            last_id = reports[-1].pk
+            self.stdout.write(f'{compacted} of {checked} reports compacted')
+        self.stdout.write(self.style.SUCCESS(f'Done: {compacted} of {checked} reports compacted'))
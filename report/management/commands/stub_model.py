@@ -0,0 +1,170 @@
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import gzip
+import json
+import random
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from report.service.sentences import split_sentences
+
+
+@dataclass(frozen=True)
+class StubModelOptions:
+    latency: float = 0.05
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    sentence_cost: float = 0.0
+    version: str = 'stub'
+
+
+@dataclass()
+class StubModelStats:
+    requests: int = 0
+    errors: int = 0
+    sentences: int = 0
+
+
+class StubModelServer(ThreadingHTTPServer):
+    """
+        Local stub of the model service for load tests.
+        POST with text or sentences responds with a valid ModelResponse after
+        latency + uniform(0, jitter) + sentence_cost * sentences seconds,
+        a share of error_rate requests fails with 503. GET on any path is a successful health check.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, options: StubModelOptions) -> None:
+        super().__init__((host, port), StubModelHandler)
+        self.options = options
+        self.__stats = StubModelStats()
+        self.__lock = Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def get_stats(self) -> StubModelStats:
+        with self.__lock:
+            return StubModelStats(**asdict(self.__stats))
+
+    def count(self, sentences: int, error: bool) -> None:
+        with self.__lock:
+            self.__stats.requests += 1
+            self.__stats.errors += error
+            self.__stats.sentences += sentences
+
+    def handle_error(self, request, client_address) -> None:
+        """Clients closing their keep-alive connections are not errors of the stub."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> None:
+        """Serve in a daemon thread."""
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    server: StubModelServer
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.__respond(200, {})
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            data = json.loads(body)
+            if 'sentences' in data:
+                sentences = data['sentences']
+                text = ' '.join(sentences)
+            else:
+                text = data['text']
+                sentences = split_sentences(text)
+        except (OSError, ValueError, KeyError, TypeError):
+            self.__respond(400, {'message': 'Invalid request'})
+            return
+        options = self.server.options
+        delay = options.latency + random.uniform(0, options.jitter) + options.sentence_cost * len(sentences)
+        time.sleep(delay)
+        error = random.random() < options.error_rate
+        self.server.count(len(sentences), error)
+        if error:
+            self.__respond(503, {'message': 'Stub error'})
+            return
+        recognition = []
+        for sentence in sentences:
+            probability = random.random()
+            recognition.append({'sentence': sentence, 'is_paraphrase': probability >= 0.5, 'probability': probability})
+        self.__respond(200, {'data': {
+            'version': options.version,
+            'source_text': text,
+            'recognition': recognition,
+            'recognition_time': f'{delay:.3f}',
+        }})
+
+    def __respond(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_stub_arguments(parser) -> None:
+    parser.add_argument('--latency', type=float, default=0.05, help='Base response time, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Max random addition to the response time, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests failed with 503')
+    parser.add_argument('--sentence-cost', type=float, default=0.0, help='Response time per sentence, seconds')
+    parser.add_argument('--model-version', default='stub')
+
+
+def get_stub_options(options: dict) -> StubModelOptions:
+    return StubModelOptions(
+        latency=options['latency'],
+        jitter=options['jitter'],
+        error_rate=options['error_rate'],
+        sentence_cost=options['sentence_cost'],
+        version=options['model_version'],
+    )
+
+
+class Command(BaseCommand):
+    help = 'Run local stub model services for load tests until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--ports', type=int, nargs='+', default=[8081])
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        stub_options = get_stub_options(options)
+        servers = [StubModelServer(options['host'], port, stub_options) for port in options['ports']]
+        for server in servers:
+            server.start()
+            self.stdout.write(f'Stub model service on {server.url}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        for server in servers:
+            server.stop()
+            stats = server.get_stats()
+            self.stdout.write(
+                f'{server.url}: {stats.requests} requests, {stats.errors} errors, {stats.sentences} sentences'
+            )
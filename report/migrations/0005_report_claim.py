@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0004_reportrecognition_sentence_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='claim_dttm',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='claim_owner',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='report',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'P')), fields=('claim_owner',), name='report_unique_in_process_claim_owner'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 08:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0005_report_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='duplicate_of',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='report.report'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='text_hash',
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+    ]
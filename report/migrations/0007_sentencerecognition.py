@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0006_report_text_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SentenceRecognition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sentence_hash', models.CharField(max_length=64)),
+                ('model_version', models.CharField(max_length=16)),
+                ('is_paraphrase', models.BooleanField()),
+                ('probability', models.FloatField()),
+                ('create_dttm', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sentencerecognition',
+            constraint=models.UniqueConstraint(fields=('sentence_hash', 'model_version'), name='sentence_recognition_unique_hash_version'),
+        ),
+    ]
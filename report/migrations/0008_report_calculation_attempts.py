@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0007_sentencerecognition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='calculation_attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
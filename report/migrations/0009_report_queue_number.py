@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+def number_waiting_reports(apps, schema_editor):
+    Report = apps.get_model('report', 'Report')
+    ReportQueueCounter = apps.get_model('report', 'ReportQueueCounter')
+    waiting = Report.objects.filter(status='W', duplicate_of__isnull=True).order_by('create_dttm', 'id')
+    number = 0
+    for number, report_id in enumerate(waiting.values_list('id', flat=True).iterator(), start=1):
+        Report.objects.filter(pk=report_id).update(queue_number=number)
+    ReportQueueCounter.objects.create(value=number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0008_report_calculation_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportQueueCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='queue_number',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('duplicate_of__isnull', True), ('status', 'W')), fields=['queue_number'], name='report_waiting_queue_number'),
+        ),
+        migrations.RunPython(number_waiting_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-18 09:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+QUEUE_STEP = 1000
+
+
+def scale_queue_numbers(apps, schema_editor):
+    Report = apps.get_model('report', 'Report')
+    ReportQueueCounter = apps.get_model('report', 'ReportQueueCounter')
+    Report.objects.filter(queue_number__isnull=False).update(queue_number=models.F('queue_number') * QUEUE_STEP)
+    ReportQueueCounter.objects.update(value=models.F('value') * QUEUE_STEP)
+
+
+def unscale_queue_numbers(apps, schema_editor):
+    Report = apps.get_model('report', 'Report')
+    ReportQueueCounter = apps.get_model('report', 'ReportQueueCounter')
+    Report.objects.filter(queue_number__isnull=False).update(queue_number=models.F('queue_number') / QUEUE_STEP)
+    ReportQueueCounter.objects.update(value=models.F('value') / QUEUE_STEP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('report', '0009_report_queue_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationShare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField(default=1)),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('max_in_process', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('duplicate_of__isnull', True), ('status', 'W')), fields=['-priority', 'queue_number', 'id'], name='report_waiting_claim_order'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('duplicate_of__isnull', True), ('status', 'W')), fields=['user', 'queue_number'], name='report_waiting_user_number'),
+        ),
+        migrations.AddField(
+            model_name='calculationshare',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calculation_share', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(scale_queue_numbers, unscale_queue_numbers),
+    ]
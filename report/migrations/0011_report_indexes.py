@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 09:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('report', '0010_calculation_share'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['user', '-create_dttm', '-id'], name='report_user_create_dttm'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('duplicate_of__isnull', False)), fields=['duplicate_of'], name='report_duplicate_of'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('status', 'P')), fields=['claim_dttm'], name='report_in_process_claim_dttm'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('calculation_end_dttm__isnull', False)), fields=['-calculation_end_dttm'], name='report_calculation_end_dttm'),
+        ),
+        migrations.AddIndex(
+            model_name='reportrecognition',
+            index=models.Index(fields=['report', 'sentence_number'], name='report_recognition_number'),
+        ),
+        migrations.AlterField(
+            model_name='report',
+            name='duplicate_of',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='report.report'),
+        ),
+        migrations.AlterField(
+            model_name='report',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='reportrecognition',
+            name='report',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='report.report'),
+        ),
+    ]
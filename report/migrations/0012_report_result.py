@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 09:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0011_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportResult',
+            fields=[
+                ('report', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result', serialize=False, to='report.report')),
+                ('sentence_offsets', models.BinaryField()),
+                ('probabilities', models.BinaryField()),
+                ('paraphrases', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report', '0012_report_result'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sentencerecognition',
+            index=models.Index(fields=['create_dttm'], name='sentence_recognition_create'),
+        ),
+    ]
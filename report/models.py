@@ -13,23 +13,131 @@ class Report(models.Model):
     id = models.AutoField
     text = models.TextField()
     status = models.CharField(max_length=3, choices=ReportStatus.choices)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     create_dttm = models.DateTimeField()
     calculation_start_dttm = models.DateTimeField(null=True)
     calculation_end_dttm = models.DateTimeField(null=True)
     model_version = models.CharField(max_length=16, null=True)
+    claim_owner = models.CharField(max_length=255, null=True)
+    claim_dttm = models.DateTimeField(null=True)
+    calculation_attempts = models.IntegerField(default=0)
+    queue_number = models.BigIntegerField(null=True)
+    priority = models.SmallIntegerField(default=0)
+    text_hash = models.CharField(max_length=64, null=True, db_index=True)
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, related_name='duplicates', db_index=False
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['claim_owner'],
+                condition=models.Q(status='P'),
+                name='report_unique_in_process_claim_owner',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['queue_number'],
+                condition=models.Q(status='W', duplicate_of__isnull=True),
+                name='report_waiting_queue_number',
+            ),
+            models.Index(
+                fields=['-priority', 'queue_number', 'id'],
+                condition=models.Q(status='W', duplicate_of__isnull=True),
+                name='report_waiting_claim_order',
+            ),
+            models.Index(
+                fields=['user', 'queue_number'],
+                condition=models.Q(status='W', duplicate_of__isnull=True),
+                name='report_waiting_user_number',
+            ),
+            models.Index(fields=['user', '-create_dttm', '-id'], name='report_user_create_dttm'),
+            models.Index(
+                fields=['duplicate_of'],
+                condition=models.Q(duplicate_of__isnull=False),
+                name='report_duplicate_of',
+            ),
+            models.Index(
+                fields=['claim_dttm'],
+                condition=models.Q(status='P'),
+                name='report_in_process_claim_dttm',
+            ),
+            models.Index(
+                fields=['-calculation_end_dttm'],
+                condition=models.Q(calculation_end_dttm__isnull=False),
+                name='report_calculation_end_dttm',
+            ),
+        ]
+
+
+class ReportQueueCounter(models.Model):
+    """Single row with the last queue number given to a report."""
+    id = models.AutoField
+    value = models.BigIntegerField(default=0)
+
+
+class CalculationShare(models.Model):
+    """
+        Share of the calculation queue given to the user.
+        Users with a greater weight get more reports calculated in the same time,
+        reports of users with a greater priority are calculated first,
+        max_in_process limits the number of reports of the user calculated at once (0 is the default limit).
+    """
+    id = models.AutoField
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calculation_share')
+    weight = models.FloatField(default=1)
+    priority = models.SmallIntegerField(default=0)
+    max_in_process = models.IntegerField(default=0)
 
 
 class ReportRecognition(models.Model):
     id = models.AutoField
-    report = models.ForeignKey(Report, on_delete=models.CASCADE)
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, db_index=False)
     sentence = models.TextField()
     is_paraphrase = models.BooleanField()
     probability = models.FloatField()
     sentence_number = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['report', 'sentence_number'], name='report_recognition_number'),
+        ]
+
+
+class ReportResult(models.Model):
+    """
+        Recognitions of a completed report in one row.
+        Sentences are (start, end) offsets in the report text packed as little-endian uint32,
+        probabilities are packed as little-endian float32, paraphrase flags are one byte per sentence.
+    """
+    report = models.OneToOneField(Report, on_delete=models.CASCADE, primary_key=True, related_name='result')
+    sentence_offsets = models.BinaryField()
+    probabilities = models.BinaryField()
+    paraphrases = models.BinaryField()
+
 
 class ReportLog(models.Model):
     id = models.AutoField
     report = models.ForeignKey(Report, on_delete=models.CASCADE)
     error = models.TextField()
+
+
+class SentenceRecognition(models.Model):
+    id = models.AutoField
+    sentence_hash = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=16)
+    is_paraphrase = models.BooleanField()
+    probability = models.FloatField()
+    create_dttm = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sentence_hash', 'model_version'],
+                name='sentence_recognition_unique_hash_version',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['create_dttm'], name='sentence_recognition_create'),
+        ]
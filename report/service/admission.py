@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from threading import Lock
+import math
+import time
+
+from django.utils import timezone
+
+from common.settings import (
+    ADMISSION_DEFAULT_DURATION,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_RATE_WINDOW,
+    MODELS_HOSTS,
+    WORKERS_BY_MODEL,
+)
+from ..models import Report
+from .exceptions import ReportQueueOverloaded
+
+
+@dataclass()
+class QueueLoad:
+    """Number of reports waiting for calculation and the number of reports calculated per second."""
+    depth: int
+    drain_rate: float
+
+    @property
+    def wait(self) -> float | None:
+        """Estimated wait of a new report in seconds, None if nothing has been calculated recently."""
+        return self.depth / self.drain_rate if self.drain_rate else None
+
+
+class AdmissionController:
+    """
+        Rejects new reports when the calculation queue is longer than max_queue reports
+        or a new report would wait longer than max_wait seconds, 0 disables the limit.
+        The drain rate is the number of reports calculated by all processes in the last rate_window seconds,
+        until a report is calculated it is assumed to be slots reports in default_duration seconds.
+        The queue load is read from DB at most once in refresh_interval seconds.
+    """
+    def __init__(
+        self,
+        max_queue: int,
+        max_wait: float,
+        rate_window: float,
+        slots: int,
+        default_duration: float,
+        refresh_interval: float = 1,
+    ) -> None:
+        self.__max_queue = max_queue
+        self.__max_wait = max_wait
+        self.__rate_window = rate_window
+        self.__default_rate = slots / default_duration
+        self.__refresh_interval = refresh_interval
+        self.__lock = Lock()
+        self.__load: QueueLoad | None = None
+        self.__load_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.__max_queue or self.__max_wait)
+
+    def check(self, count: int = 1) -> None:
+        """
+            Admit count new reports to the queue, more reports than the limit are admitted to the empty queue.
+            Raises ReportQueueOverloaded with the time after which the reports may be accepted.
+        """
+        if not self.enabled:
+            return
+        with self.__lock:
+            load = self.__refresh()
+            limit = self.__get_limit(load)
+            if limit is not None:
+                limit = max(limit, count)
+            if limit is None or load.depth + count <= limit:
+                load.depth += count
+                return
+        retry_after = math.ceil((load.depth + count - limit) / (load.drain_rate or self.__default_rate))
+        raise ReportQueueOverloaded(
+            f'The calculation queue has {load.depth} reports, retry after {retry_after} seconds', max(retry_after, 1)
+        )
+
+    def get_load(self) -> QueueLoad:
+        """Current queue load, reports admitted by this process since the last read are counted as waiting."""
+        with self.__lock:
+            load = self.__refresh()
+            return QueueLoad(load.depth, load.drain_rate)
+
+    def __refresh(self) -> QueueLoad:
+        if self.__load is None or time.monotonic() - self.__load_time >= self.__refresh_interval:
+            self.__load = self.__read_load()
+            self.__load_time = time.monotonic()
+        return self.__load
+
+    def __get_limit(self, load: QueueLoad) -> int | None:
+        """Maximum number of waiting reports, None if there is no limit."""
+        limits = []
+        if self.__max_queue:
+            limits.append(self.__max_queue)
+        if self.__max_wait:
+            limits.append(math.floor(self.__max_wait * (load.drain_rate or self.__default_rate)))
+        return min(limits) if limits else None
+
+    def __read_load(self) -> QueueLoad:
+        depth = Report.objects.filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True).count()
+        calculated = Report.objects.filter(
+            status__in=[Report.ReportStatus.COMPLETED, Report.ReportStatus.ERROR],
+            claim_owner__isnull=False,
+            calculation_end_dttm__gte=timezone.now() - timedelta(seconds=self.__rate_window),
+        ).count()
+        return QueueLoad(depth, calculated / self.__rate_window)
+
+
+admission_controller = AdmissionController(
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_RATE_WINDOW,
+    len(MODELS_HOSTS) * WORKERS_BY_MODEL,
+    ADMISSION_DEFAULT_DURATION,
+)
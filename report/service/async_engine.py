@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+import asyncio
+import logging
+
+import aiohttp
+
+from ..models import Report
+from .calculation_manager import Worker, ReportCalculationManager
+from .model_client import ModelHostClient, ModelClientOptions, ModelResponse, RETRY_STATUSES
+from .queue import ReportQueue
+from .hosts import ModelHost
+from .sentence_memo import SentenceMemo
+from .sentences import split_sentences
+from .chunking import TextChunker
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncModelHostClient(ModelHostClient):
+    """
+        Asynchronous HTTP client of one model service host.
+        The aiohttp session is created on the first call, inside the event loop of the manager.
+    """
+    def __init__(self, url: str, options: ModelClientOptions) -> None:
+        super().__init__(url, options)
+        self.__session: aiohttp.ClientSession | None = None
+
+    async def recognize_async(self, text: str) -> ModelResponse:
+        """Get the model prediction for the text."""
+        return await self.__post({'text': text})
+
+    async def recognize_batch_async(self, sentences: list[str]) -> ModelResponse:
+        """Get the model prediction for the list of sentences in one call."""
+        return self.check_batch_response(sentences, await self.__post({'sentences': sentences}))
+
+    async def __post(self, data: dict) -> ModelResponse:
+        session = self.__get_session()
+        body, headers = self.encode_request(data)
+        attempt = 0
+        while True:
+            try:
+                async with session.post(self.url, data=body, headers=headers) as response:
+                    if response.status not in RETRY_STATUSES or attempt >= self.options.retries:
+                        response.raise_for_status()
+                        return ModelResponse(**(await response.json())['data'])
+            except asyncio.TimeoutError:
+                raise
+            except aiohttp.ClientConnectionError as e:
+                if attempt >= self.options.retries:
+                    raise ConnectionError(str(e)) from e
+            await asyncio.sleep(self.get_retry_delay(attempt))
+            attempt += 1
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.options.pool_size),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.options.connect_timeout,
+                    sock_read=self.options.read_timeout,
+                ),
+            )
+        return self.__session
+
+
+class AsyncWorker(Worker):
+    """
+        Worker that calls the model service as a coroutine.
+        Blocking DB writes are made in the executor of the manager.
+    """
+    async def start_async(self, report: Report, executor: ThreadPoolExecutor) -> None:
+        """Generates a report claimed by the worker and saves the results in DB."""
+        loop = asyncio.get_running_loop()
+        try:
+            response = await self.recognize_async(report.text, executor)
+            await loop.run_in_executor(executor, self.save_response, report, response)
+        except Exception as e:
+            logger.exception('Failed to calculate report %s', report.pk)
+            await loop.run_in_executor(executor, self.save_error, report, e)
+        finally:
+            self.host.stats.release()
+            self.release()
+
+    async def recognize_async(self, text: str, executor: ThreadPoolExecutor) -> ModelResponse:
+        """Same as recognize, memo queries are made in the executor."""
+        response = None
+        if self.chunker is not None:
+            response = await self.chunker.recognize_async(
+                self.host, text, lambda host, chunk: self.recognize_on_async(host, chunk, executor)
+            )
+        return response if response is not None else await self.recognize_on_async(self.host, text, executor)
+
+    async def recognize_on_async(self, host: ModelHost, text: str, executor: ThreadPoolExecutor) -> ModelResponse:
+        """Same as recognize_on, memo queries are made in the executor."""
+        sentences = split_sentences(text) if host.batcher is not None or self.memo is not None else []
+        if not sentences:
+            with host.stats.measure(len(text)):
+                return await host.client.recognize_async(text)
+        if self.memo is None:
+            return await self.__recognize_sentences(host, sentences)
+        loop = asyncio.get_running_loop()
+        lookup = await loop.run_in_executor(executor, self.memo.lookup, text, sentences)
+        if not lookup.missed:
+            return lookup.build_response()
+        response = await self.__recognize_sentences(host, lookup.missed)
+        await loop.run_in_executor(executor, self.memo.store, response.version, lookup.missed, response.recognition)
+        if lookup.merge(response):
+            return lookup.build_response()
+        response = await self.__recognize_sentences(host, sentences)
+        await loop.run_in_executor(executor, self.memo.store, response.version, sentences, response.recognition)
+        return response
+
+    @staticmethod
+    async def __recognize_sentences(host: ModelHost, sentences: list[str]) -> ModelResponse:
+        with host.stats.measure(sum(len(sentence) for sentence in sentences)):
+            if host.batcher is None:
+                return await host.client.recognize_batch_async(sentences)
+            return await host.batcher.recognize_sentences_async(sentences)
+
+
+class AsyncReportCalculationManager(ReportCalculationManager):
+    """
+        Report calculation manager that runs all model calls on a single asyncio event loop.
+        The number of threads does not depend on the number of reports in process:
+        the dispatcher thread, the event loop thread and a bounded executor for DB writes.
+    """
+    def __init__(self, *args, db_threads: int, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.__loop = asyncio.new_event_loop()
+        self.__loop_thread: Thread | None = None
+        self.__loop_lock = Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix='report-db')
+
+    def _start_worker(self, worker: AsyncWorker, report: Report) -> None:
+        self.__start_loop()
+        asyncio.run_coroutine_threadsafe(worker.start_async(report, self.__executor), self.__loop)
+
+    def _build_client(self, host: str, options: ModelClientOptions) -> ModelHostClient:
+        return AsyncModelHostClient(host, options)
+
+    def _build_worker(
+        self, worker_id: str, host: ModelHost, queue: ReportQueue, memo: SentenceMemo | None, chunker: TextChunker | None
+    ) -> Worker:
+        return AsyncWorker(worker_id, host, queue, self._release_work, memo, chunker)
+
+    def __start_loop(self) -> None:
+        with self.__loop_lock:
+            if self.__loop_thread is None:
+                self.__loop_thread = Thread(target=self.__run_loop, daemon=True)
+                self.__loop_thread.start()
+
+    def __run_loop(self) -> None:
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
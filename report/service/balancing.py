@@ -0,0 +1,43 @@
+from typing import Callable
+import random
+
+from .hosts import HostStats
+
+
+Balancer = Callable[[list[HostStats]], HostStats]
+
+
+def get_ewma_score(stats: HostStats) -> float:
+    """Expected time to serve one more report on the host, penalized by the error rate."""
+    latency = stats.latency or 0.0
+    return latency * (stats.outstanding + 1) / max(1 - stats.error_rate, 0.01)
+
+
+def choose_first(hosts: list[HostStats]) -> HostStats:
+    """First host in the order of MODELS_HOSTS."""
+    return hosts[0]
+
+
+def choose_least_outstanding(hosts: list[HostStats]) -> HostStats:
+    """Host with the fewest reports in process."""
+    return min(random.sample(hosts, len(hosts)), key=lambda stats: stats.outstanding)
+
+
+def choose_ewma(hosts: list[HostStats]) -> HostStats:
+    """Host with the lowest EWMA latency score, hosts without statistics are tried first."""
+    return min(random.sample(hosts, len(hosts)), key=get_ewma_score)
+
+
+def choose_power_of_two(hosts: list[HostStats]) -> HostStats:
+    """Best of two random hosts by the EWMA latency score."""
+    if len(hosts) < 2:
+        return hosts[0]
+    return min(random.sample(hosts, 2), key=get_ewma_score)
+
+
+BALANCERS: dict[str, Balancer] = {
+    'fifo': choose_first,
+    'least_outstanding': choose_least_outstanding,
+    'ewma': choose_ewma,
+    'p2c': choose_power_of_two,
+}
@@ -0,0 +1,90 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from threading import Thread, Condition
+import asyncio
+import logging
+import time
+
+from .model_client import ModelHostClient, ModelResponse, Recognition
+
+
+logger = logging.getLogger(__name__)
+
+
+class SentenceBatcher:
+    """
+        Batching stage in front of one model service host.
+        Sentences of all reports calculated on the host are collected into micro-batches,
+        a batch is sent when it has max_size sentences or when its first sentence
+        has waited max_delay seconds. Batches are sent in parallel by the pool of the host client.
+    """
+    def __init__(self, client: ModelHostClient, max_size: int, max_delay: float) -> None:
+        self.__client = client
+        self.__max_size = max_size
+        self.__max_delay = max_delay
+        self.__pending: deque[tuple[str, float, Future]] = deque()
+        self.__condition = Condition()
+        self.__executor = ThreadPoolExecutor(max_workers=client.options.pool_size, thread_name_prefix='model-batch')
+        self.__collector: Thread | None = None
+
+    def recognize_sentences(self, sentences: list[str]) -> ModelResponse:
+        """Get the model prediction for the sentences, they are sent together with sentences of other reports."""
+        response = self.__build_response(sentences, [future.result() for future in self.submit(sentences)])
+        if response is None:
+            return self.__client.recognize_batch(sentences)
+        return response
+
+    async def recognize_sentences_async(self, sentences: list[str]) -> ModelResponse:
+        """Same as recognize_sentences, but waits for the batches without blocking the event loop."""
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in self.submit(sentences)))
+        response = self.__build_response(sentences, list(results))
+        if response is None:
+            return await asyncio.wrap_future(self.__executor.submit(self.__client.recognize_batch, sentences))
+        return response
+
+    def submit(self, sentences: list[str]) -> list[Future]:
+        """Add sentences to the batch. Each future is resolved with the model version and the recognition."""
+        futures = [Future() for _ in sentences]
+        with self.__condition:
+            if self.__collector is None:
+                self.__collector = Thread(target=self.__collect, daemon=True)
+                self.__collector.start()
+            now = time.monotonic()
+            self.__pending.extend((sentence, now, future) for sentence, future in zip(sentences, futures))
+            self.__condition.notify()
+        return futures
+
+    def __collect(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__pending:
+                    self.__condition.wait()
+                deadline = self.__pending[0][1] + self.__max_delay
+                while len(self.__pending) < self.__max_size and (timeout := deadline - time.monotonic()) > 0:
+                    self.__condition.wait(timeout)
+                batch = [self.__pending.popleft() for _ in range(min(self.__max_size, len(self.__pending)))]
+            self.__executor.submit(self.__send, batch)
+
+    def __send(self, batch: list[tuple[str, float, Future]]) -> None:
+        try:
+            response = self.__client.recognize_batch([sentence for sentence, _, _ in batch])
+        except Exception as e:
+            logger.warning('Batch of %s sentences failed on %s: %s', len(batch), self.__client.url, e)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), recognition in zip(batch, response.recognition):
+            future.set_result((response.version, recognition))
+
+    @staticmethod
+    def __build_response(sentences: list[str], results: list[tuple[str, Recognition]]) -> ModelResponse | None:
+        """Response for the sentences, None if they are recognized by different model versions."""
+        if len({version for version, _ in results}) > 1:
+            logger.info('Sentences of a report are recognized by different model versions, sending them again')
+            return None
+        return ModelResponse(
+            version=results[0][0],
+            source_text=' '.join(sentences),
+            recognition=[recognition for _, recognition in results],
+            recognition_time='',
+        )
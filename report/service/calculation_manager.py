@@ -1,116 +1,494 @@
+from datetime import timedelta
 from typing import Callable
-from threading import Thread
+from threading import Thread, Lock, Event
+from uuid import uuid4
+import logging
 
-import requests
-from pydantic import BaseModel
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models.functions import Length
 from django.utils import timezone
 
-from common.settings import MODELS_HOSTS, WORKERS_BY_MODEL
-from ..models import Report, ReportLog, ReportRecognition
-from .exceptions import ReportNotInCalculationQueue
+from common.settings import (
+    MODELS_HOSTS,
+    WORKERS_BY_MODEL,
+    CALCULATION_ENGINE,
+    CALCULATION_DB_THREADS,
+    CALCULATION_POLL_INTERVAL,
+    CALCULATION_CLAIM_TIMEOUT,
+    CALCULATION_HEARTBEAT_INTERVAL,
+    MODEL_POOL_SIZE,
+    MODEL_CONNECT_TIMEOUT,
+    MODEL_READ_TIMEOUT,
+    MODEL_RETRIES,
+    MODEL_RETRY_BACKOFF,
+    MODEL_REQUEST_COMPRESSION,
+    MODEL_BATCH_SIZE,
+    MODEL_BATCH_DELAY,
+    SENTENCE_MEMO_SIZE,
+    SENTENCE_MEMO_TTL,
+    SENTENCE_MEMO_VERSION_TTL,
+    MODEL_BALANCING,
+    MODEL_CONCURRENCY_MIN,
+    MODEL_CONCURRENCY_MAX,
+    MODEL_LATENCY_TARGET,
+    MODEL_FAILURE_THRESHOLD,
+    MODEL_RESET_TIMEOUT,
+    MODEL_HEALTH_INTERVAL,
+    MODEL_HEALTH_PATH,
+    CALCULATION_MAX_ATTEMPTS,
+    CALCULATION_USER_MAX_IN_PROCESS,
+    MODEL_CHUNK_SIZE,
+)
+from ..models import Report, ReportLog
+from .queue import ReportQueue
+from .model_client import ModelHostClient, ModelClientOptions, ModelResponse
+from .batching import SentenceBatcher
+from .result_cache import report_result_cache
+from .report_cache import completed_report_cache
+from .recognition_store import StoredRecognition, recognition_store
+from .sentence_memo import SentenceMemo
+from .chunking import TextChunker
+from .sentences import split_sentences
+from .hosts import CircuitBreaker, CircuitState, ConcurrencyLimit, HostInfo, HostStats, ModelHost, is_host_error
+from .balancing import BALANCERS, Balancer, choose_first
+from .estimator import CompletionEstimate
 
 
-class Recognition(BaseModel):
-    """Prediction body for one sentence"""
-    sentence: str
-    is_paraphrase: bool
-    probability: float
+logger = logging.getLogger(__name__)
 
-
-class ModelResponse(BaseModel):
-    """Response from the model service"""
-    version: str
-    source_text: str
-    recognition: list[Recognition]
-    recognition_time: str
+DURATION_HISTORY = 500
 
 
 class Worker:
     """
         Class for generating a report.
-        Contains the URL of the host of the service model on which the report will be calculated.
+        Contains the host of the service model on which the report will be calculated.
+        The worker id is the name of the worker slot in this process,
+        it is used as the owner of the claimed reports.
     """
-    def __init__(self, worker_id: int, url: str, finish_callback: Callable[[int], None]):
+    def __init__(
+        self,
+        worker_id: str,
+        host: ModelHost,
+        queue: ReportQueue,
+        finish_callback: Callable[[str], None],
+        memo: SentenceMemo | None = None,
+        chunker: TextChunker | None = None,
+    ):
         self.__worker_id = worker_id
-        self.__url = url
+        self.__host = host
+        self.__queue = queue
         self.__finish_callback = finish_callback
+        self.__memo = memo
+        self.__chunker = chunker
 
     @property
-    def id(self) -> int:
+    def id(self) -> str:
         return self.__worker_id
 
+    @property
+    def host(self) -> ModelHost:
+        return self.__host
+
+    @property
+    def memo(self) -> SentenceMemo | None:
+        return self.__memo
+
+    @property
+    def chunker(self) -> TextChunker | None:
+        return self.__chunker
+
     def start(self, report: Report) -> None:
-        """Generates a report and saves the results in DB."""
-        report.calculation_start_dttm = timezone.now()
-        report.status = Report.ReportStatus.IN_PROCESS
-        report.save()
+        """Generates a report claimed by the worker and saves the results in DB."""
         try:
-            response = ModelResponse(**requests.post(self.__url, json={'text': report.text}).json()['data'])
-            ReportRecognition.objects.bulk_create([
-                ReportRecognition(
-                    report=report,
-                    sentence=recognition.sentence,
-                    is_paraphrase=recognition.is_paraphrase,
-                    probability=recognition.probability,
-                    sentence_number=index,
-                )
-                for index, recognition in enumerate(response.recognition)
-            ])
-            report.model_version = response.version
-            report.status = Report.ReportStatus.COMPLETED
+            response = self.recognize(report.text)
+            self.save_response(report, response)
         except Exception as e:
-            report.status = Report.ReportStatus.ERROR
-            ReportLog.objects.create(report=report, error=str(e))
+            self.save_error(report, e)
             raise e
         finally:
-            report.calculation_end_dttm = timezone.now()
-            report.save()
-            self.__finish_callback(self.id)
+            self.__host.stats.release()
+            self.release()
+
+    def recognize(self, text: str) -> ModelResponse:
+        """
+            Get the model prediction for the text.
+            A long text is split into chunks recognized in parallel on several hosts if other hosts are free,
+            otherwise or if the chunks got different model versions it is recognized on the host of the worker.
+        """
+        response = self.__chunker.recognize(self.__host, text, self.recognize_on) if self.__chunker else None
+        return response if response is not None else self.recognize_on(self.__host, text)
+
+    def recognize_on(self, host: ModelHost, text: str) -> ModelResponse:
+        """
+            Get the model prediction for the text from the host.
+            With batching or memo the text is split into sentences, only sentences missed in the memo
+            are sent to the model service. Only the model calls are measured in the statistics of the host.
+        """
+        sentences = split_sentences(text) if host.batcher is not None or self.__memo is not None else []
+        if not sentences:
+            with host.stats.measure(len(text)):
+                return host.client.recognize(text)
+        if self.__memo is None:
+            return self.__recognize_sentences(host, sentences)
+        lookup = self.__memo.lookup(text, sentences)
+        if not lookup.missed:
+            return lookup.build_response()
+        response = self.__recognize_sentences(host, lookup.missed)
+        self.__memo.store(response.version, lookup.missed, response.recognition)
+        if lookup.merge(response):
+            return lookup.build_response()
+        response = self.__recognize_sentences(host, sentences)
+        self.__memo.store(response.version, sentences, response.recognition)
+        return response
+
+    def save_response(self, report: Report, response: ModelResponse) -> None:
+        """Saves the model response as the report result."""
+        with transaction.atomic():
+            if not self.__queue.finish(report, self.id, Report.ReportStatus.COMPLETED, model_version=response.version):
+                return
+            [recognitions] = recognition_store.save([(report, [
+                StoredRecognition(None, recognition.sentence, recognition.is_paraphrase, recognition.probability, index)
+                for index, recognition in enumerate(response.recognition)
+            ])])
+            report_result_cache.complete_duplicates(report, recognitions)
+        completed_report_cache.store(report, recognitions)
+
+    def save_error(self, report: Report, error: Exception) -> None:
+        """
+            Marks the report as failed and logs the error.
+            If the host failed, the report is returned to the queue while it has attempts left.
+        """
+        if is_host_error(error) and self.__queue.requeue(report, self.id):
+            logger.warning('Report %s is requeued after the failure of %s: %s', report.pk, self.__host.url, error)
+            return
+        if self.__queue.finish(report, self.id, Report.ReportStatus.ERROR):
+            ReportLog.objects.create(report=report, error=str(error))
+            report_result_cache.release_duplicates(report)
+
+    def release(self) -> None:
+        """Returns the worker to the manager."""
+        self.__finish_callback(self.id)
+
+    @staticmethod
+    def __recognize_sentences(host: ModelHost, sentences: list[str]) -> ModelResponse:
+        with host.stats.measure(sum(len(sentence) for sentence in sentences)):
+            if host.batcher is None:
+                return host.client.recognize_batch(sentences)
+            return host.batcher.recognize_sentences(sentences)
 
 
 class ReportCalculationManager:
     """
         Report calculation manager. Allows you to calculate several reports in parallel
-        on several services of the model, and also forms a queue waiting for reports to be generated.
+        on several services of the model. Waiting reports are stored in the DB queue,
+        so the queue survives restarts and is shared by all processes.
+        The dispatcher thread hands out queued reports to free workers. It is woken up
+        when a report is added or a worker is released, and also polls the queue to pick up
+        reports added by other processes.
+        Worker ids carry the instance id of the process, the claims of busy workers are refreshed
+        every heartbeat_interval seconds, so claims left by a killed process expire after claim_timeout.
     """
-    def __init__(self, models_hosts: list, workers_by_model: int) -> None:
-        self.__workers = self.__build_workers(models_hosts, workers_by_model)
-        self.__queue: list[Report] = []
+    def __init__(
+        self,
+        models_hosts: list,
+        workers_by_model: int,
+        poll_interval: float,
+        claim_timeout: float,
+        client_options: ModelClientOptions,
+        batch_size: int = 0,
+        batch_delay: float = 0,
+        sentence_memo: SentenceMemo | None = None,
+        balancer: Balancer = choose_first,
+        concurrency_min: int = 1,
+        concurrency_max: int = 0,
+        latency_target: float = 0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        health_interval: float = 0,
+        health_path: str = '',
+        max_attempts: int = 1,
+        user_max_in_process: int = 0,
+        chunk_size: int = 0,
+        heartbeat_interval: float = 0,
+    ) -> None:
+        self.__queue = ReportQueue(claim_timeout, max_attempts, user_max_in_process)
+        self.__instance_id = uuid4().hex[:12]
+        self.__heartbeat_interval = heartbeat_interval
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__health_interval = health_interval
+        self.__health_path = health_path
+        self.__batch_size = batch_size
+        self.__batch_delay = batch_delay
+        self.__sentence_memo = sentence_memo
+        self.__balancer = balancer
+        concurrency_max = max(concurrency_max, workers_by_model)
+        self.__chunker = TextChunker(
+            chunk_size, self.__get_chunk_hosts, len(models_hosts) * concurrency_max
+        ) if chunk_size else None
+        self.__hosts = {
+            url: self.__build_host(
+                url, client_options, ConcurrencyLimit(workers_by_model, concurrency_min, concurrency_max, latency_target)
+            )
+            for url in models_hosts
+        }
+        self.__worker_slots: dict[str, int] = {}
+        self.__workers = self.__build_workers(concurrency_max)
         self.__free_workers = list(self.__workers.values())
+        self.__poll_interval = poll_interval
+        self.__lock = Lock()
+        self.__wakeup = Event()
+        self.__stopped = Event()
+        self.__dispatcher: Thread | None = None
 
     def calculate(self, report: Report) -> None:
-        """Add a report to the queue for generation."""
-        try:
-            worker = self.__free_workers.pop(0)
-        except IndexError:
-            self.__queue.append(report)
-            return
-        Thread(target=worker.start, args=(report,)).start()
+        """Notify the manager that the report has been added to the queue for generation."""
+        self.__start_dispatcher()
+        self.__wakeup.set()
+
+    def stop(self) -> None:
+        """Stop assigning reports to the workers, the reports in process are finished by them."""
+        self.__stopped.set()
+        self.__wakeup.set()
 
     def get_queue_place(self, report_id: int) -> int:
         """Get a report place in the queue"""
-        queue: list[int] = [report.pk for report in self.__queue.copy()]
-        try:
-            return queue.index(report_id) + 1
-        except ValueError:
-            raise ReportNotInCalculationQueue(f'Report {report_id} is not in calculation queue')
+        self.__start_dispatcher()
+        return self.__queue.get_place(report_id)
 
-    def _release_work(self, worker_id: int) -> None:
-        self.__free_workers.append(self.__workers[worker_id])
+    async def aget_queue_place(self, report_id: int) -> int:
+        """Same as get_queue_place, for async views."""
+        self.__start_dispatcher()
+        return await self.__queue.aget_place(report_id)
+
+    def estimate_completion(self, report: Report, queue_place: int | None) -> CompletionEstimate:
+        """
+            Expected start and finish of the calculation of the waiting or in process report.
+            Durations are predicted by the duration models of the hosts, the wait in the queue
+            is the queue place divided by the number of reports the hosts calculate per second.
+        """
+        hosts = [host for host in self.__hosts.values() if host.stats.duration.observed]
+        available = [host for host in hosts if host.stats.breaker.is_available()] or hosts
+        if not available:
+            return CompletionEstimate(None, None)
+        length = len(report.text)
+        duration = sum(host.stats.duration.predict(length) for host in available) / len(available)
+        now = timezone.now()
+        if report.status == Report.ReportStatus.IN_PROCESS:
+            host = self.__hosts.get((report.claim_owner or '').rpartition('#')[0])
+            if host is not None and host.stats.duration.observed:
+                duration = host.stats.duration.predict(length)
+            start = report.calculation_start_dttm or now
+            return CompletionEstimate(start, max(start + timedelta(seconds=duration), now))
+        throughput = sum(host.stats.limit / max(host.stats.duration.mean, 0.001) for host in available)
+        busy = sum(host.stats.outstanding for host in available) >= sum(host.stats.limit for host in available)
+        ahead = (queue_place or 1) - (0 if busy else 1)
+        start = now + timedelta(seconds=ahead / throughput)
+        return CompletionEstimate(start, start + timedelta(seconds=duration))
+
+    def get_hosts_info(self) -> list[HostInfo]:
+        """Current statistics and concurrency limits of the model hosts in this process."""
+        return [host.stats.get_info() for host in self.__hosts.values()]
+
+    def _release_work(self, worker_id: str) -> None:
+        with self.__lock:
+            self.__free_workers.append(self.__workers[worker_id])
+        self.__wakeup.set()
+
+    def __start_dispatcher(self) -> None:
+        with self.__lock:
+            if self.__dispatcher is None:
+                self.__dispatcher = Thread(target=self.__dispatch, daemon=True)
+                self.__dispatcher.start()
+                if self.__health_interval:
+                    Thread(target=self.__check_health, daemon=True).start()
+                if self.__heartbeat_interval:
+                    Thread(target=self.__send_heartbeats, daemon=True).start()
+
+    def __dispatch(self) -> None:
         try:
-            text = self.__queue.pop(0)
-        except IndexError:
+            self.__load_durations()
+        except Exception:
+            logger.exception('Failed to load calculation durations')
+        while True:
+            self.__wakeup.wait(self.__poll_interval)
+            self.__wakeup.clear()
+            if self.__stopped.is_set():
+                connection.close()
+                return
+            try:
+                self.__queue.requeue_stale()
+                self.__assign_reports()
+            except Exception:
+                logger.exception('Failed to assign reports to workers')
+                connection.close()
+
+    def __load_durations(self) -> None:
+        """Train the duration models of the hosts on the last calculated reports."""
+        recent = (
+            Report.objects
+            .filter(
+                status=Report.ReportStatus.COMPLETED,
+                claim_owner__isnull=False,
+                calculation_start_dttm__isnull=False,
+                calculation_end_dttm__isnull=False,
+            )
+            .annotate(length=Length('text'))
+            .order_by('-calculation_end_dttm')
+            .values_list('claim_owner', 'length', 'calculation_start_dttm', 'calculation_end_dttm')
+        )[:DURATION_HISTORY]
+        for owner, length, start, end in reversed(list(recent)):
+            host = self.__hosts.get(owner.rpartition('#')[0])
+            if host is not None:
+                host.stats.duration.observe(length, (end - start).total_seconds())
+
+    def __send_heartbeats(self) -> None:
+        while not self.__stopped.wait(self.__heartbeat_interval):
+            with self.__lock:
+                busy = [worker.id for worker in self.__workers.values() if worker not in self.__free_workers]
+            if not busy:
+                continue
+            try:
+                self.__queue.heartbeat(busy)
+            except Exception:
+                logger.exception('Failed to refresh the claims of the workers')
+                connection.close()
+        connection.close()
+
+    def __check_health(self) -> None:
+        while not self.__stopped.wait(self.__health_interval):
+            for host in self.__hosts.values():
+                if host.stats.breaker.state == CircuitState.OPEN and host.client.check_health(self.__health_path):
+                    logger.info('Health check of %s succeeded, circuit is half-open', host.url)
+                    host.stats.breaker.half_open()
+                    self.__wakeup.set()
+
+    def __assign_reports(self) -> None:
+        with self.__lock:
+            free_workers = list(self.__free_workers)
+        if not free_workers:
             return
-        self.calculate(text)
-
-    def __build_workers(self, models_hosts: list, workers_by_model: int) -> dict[int, Worker]:
-        workers: dict[int, Worker] = {}
-        worker_id = 0
-        for host in models_hosts:
-            for _ in range(workers_by_model):
-                workers.update({worker_id: Worker(worker_id, host, self._release_work)})
-                worker_id += 1
+        busy_owners = self.__queue.get_busy_owners([worker.id for worker in free_workers])
+        free_by_host: dict[str, list[Worker]] = {url: [] for url in self.__hosts}
+        for worker in free_workers:
+            if (
+                worker.id not in busy_owners
+                and self.__worker_slots[worker.id] < worker.host.stats.limit
+                and worker.host.stats.breaker.is_available()
+            ):
+                free_by_host[worker.host.url].append(worker)
+        free_by_host = {url: workers for url, workers in free_by_host.items() if workers}
+        while free_by_host:
+            url = self.__balancer([self.__hosts[url].stats for url in free_by_host]).url
+            worker = free_by_host[url].pop(0)
+            if not free_by_host[url]:
+                del free_by_host[url]
+            report = self.__queue.claim(worker.id)
+            if report is None:
+                return
+            with self.__lock:
+                self.__free_workers.remove(worker)
+            worker.host.stats.acquire()
+            if not worker.host.stats.breaker.is_available():
+                free_by_host.pop(url, None)
+            self._start_worker(worker, report)
+
+    def _start_worker(self, worker: Worker, report: Report) -> None:
+        """Start the calculation of the claimed report by the worker in a separate thread."""
+        Thread(target=self.__run_worker, args=(worker, report)).start()
+
+    def _build_client(self, host: str, options: ModelClientOptions) -> ModelHostClient:
+        return ModelHostClient(host, options)
+
+    def _build_worker(
+        self, worker_id: str, host: ModelHost, queue: ReportQueue, memo: SentenceMemo | None, chunker: TextChunker | None
+    ) -> Worker:
+        return Worker(worker_id, host, queue, self._release_work, memo, chunker)
+
+    def __get_chunk_hosts(self, host: ModelHost, count: int) -> list[ModelHost]:
+        """
+            Up to count request slots on hosts besides the host, in the order of the balancer.
+            A host gets as many slots as it has free capacity, the slots are acquired.
+        """
+        candidates = {url: other_host.stats for url, other_host in self.__hosts.items() if other_host is not host}
+        hosts: list[ModelHost] = []
+        while candidates and len(hosts) < count:
+            url = self.__balancer(list(candidates.values())).url
+            if self.__hosts[url].stats.try_acquire():
+                hosts.append(self.__hosts[url])
+            else:
+                del candidates[url]
+        return hosts
+
+    @staticmethod
+    def __run_worker(worker: Worker, report: Report) -> None:
+        try:
+            worker.start(report)
+        finally:
+            connection.close()
+
+    def __build_host(self, url: str, client_options: ModelClientOptions, limit: ConcurrencyLimit) -> ModelHost:
+        client = self._build_client(url, client_options)
+        batcher = SentenceBatcher(client, self.__batch_size, self.__batch_delay) if self.__batch_size else None
+        breaker = CircuitBreaker(url, self.__failure_threshold, self.__reset_timeout)
+        return ModelHost(url, client, HostStats(url, limit, breaker), batcher)
+
+    def __build_workers(self, workers_by_host: int) -> dict[str, Worker]:
+        workers: dict[str, Worker] = {}
+        for host in self.__hosts.values():
+            for slot in range(workers_by_host):
+                worker_id = f'{host.url}#{slot}@{self.__instance_id}'
+                self.__worker_slots[worker_id] = slot
+                workers.update({worker_id: self._build_worker(
+                    worker_id, host, self.__queue, self.__sentence_memo, self.__chunker
+                )})
         return workers
 
 
-calculation_manager = ReportCalculationManager(MODELS_HOSTS, WORKERS_BY_MODEL)
+def build_calculation_manager() -> ReportCalculationManager:
+    """Create the calculation manager with the engine selected in the settings."""
+    if MODEL_BALANCING not in BALANCERS:
+        raise ImproperlyConfigured(f'Unknown model balancing strategy {MODEL_BALANCING}')
+    if not 0 < CALCULATION_HEARTBEAT_INTERVAL < CALCULATION_CLAIM_TIMEOUT:
+        raise ImproperlyConfigured(
+            'CALCULATION_HEARTBEAT_INTERVAL must be positive and less than CALCULATION_CLAIM_TIMEOUT'
+        )
+    client_options = ModelClientOptions(
+        pool_size=MODEL_POOL_SIZE or WORKERS_BY_MODEL,
+        connect_timeout=MODEL_CONNECT_TIMEOUT,
+        read_timeout=MODEL_READ_TIMEOUT,
+        retries=MODEL_RETRIES,
+        retry_backoff=MODEL_RETRY_BACKOFF,
+        compression=MODEL_REQUEST_COMPRESSION,
+    )
+    args = (MODELS_HOSTS, WORKERS_BY_MODEL, CALCULATION_POLL_INTERVAL, CALCULATION_CLAIM_TIMEOUT, client_options)
+    kwargs = {
+        'batch_size': MODEL_BATCH_SIZE,
+        'batch_delay': MODEL_BATCH_DELAY,
+        'sentence_memo': (
+            SentenceMemo(SENTENCE_MEMO_SIZE, SENTENCE_MEMO_TTL, SENTENCE_MEMO_VERSION_TTL) if SENTENCE_MEMO_SIZE else None
+        ),
+        'balancer': BALANCERS[MODEL_BALANCING],
+        'concurrency_min': MODEL_CONCURRENCY_MIN,
+        'concurrency_max': MODEL_CONCURRENCY_MAX,
+        'latency_target': MODEL_LATENCY_TARGET,
+        'failure_threshold': MODEL_FAILURE_THRESHOLD,
+        'reset_timeout': MODEL_RESET_TIMEOUT,
+        'health_interval': MODEL_HEALTH_INTERVAL,
+        'health_path': MODEL_HEALTH_PATH,
+        'max_attempts': CALCULATION_MAX_ATTEMPTS,
+        'user_max_in_process': CALCULATION_USER_MAX_IN_PROCESS,
+        'chunk_size': MODEL_CHUNK_SIZE,
+        'heartbeat_interval': CALCULATION_HEARTBEAT_INTERVAL,
+    }
+    if CALCULATION_ENGINE == 'thread':
+        return ReportCalculationManager(*args, **kwargs)
+    if CALCULATION_ENGINE == 'asyncio':
+        from .async_engine import AsyncReportCalculationManager
+        return AsyncReportCalculationManager(*args, db_threads=CALCULATION_DB_THREADS, **kwargs)
+    raise ImproperlyConfigured(f'Unknown calculation engine {CALCULATION_ENGINE}')
+
+
+calculation_manager = build_calculation_manager()
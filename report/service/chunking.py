@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+import asyncio
+import logging
+
+from .hosts import ModelHost
+from .model_client import ModelResponse
+from .sentences import join_chunks, split_chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+def merge_responses(text: str, responses: list[ModelResponse]) -> ModelResponse | None:
+    """
+        Join the model responses for the chunks of the text in their order.
+        Returns None if the chunks are recognized by different model versions.
+    """
+    if len({response.version for response in responses}) > 1:
+        return None
+    return ModelResponse(
+        version=responses[0].version,
+        source_text=text,
+        recognition=[recognition for response in responses for recognition in response.recognition],
+        recognition_time='',
+    )
+
+
+class TextChunker:
+    """
+        Splits texts longer than chunk_size into chunks of whole sentences when other hosts have free capacity
+        and sends the chunks to them in parallel, each of them gets as many chunks as its free slots.
+        The chunks are joined to one per acquired slot, the last of them is recognized on the host of the worker
+        in its slot of the claim. Without free hosts the text is sent to the host of the worker in one request.
+        A chunk failed on another host is recognized again on the host of the worker.
+    """
+    def __init__(self, chunk_size: int, get_hosts: Callable[[ModelHost, int], list[ModelHost]], threads: int) -> None:
+        self.__chunk_size = chunk_size
+        self.__get_hosts = get_hosts
+        self.__executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='model-chunk')
+
+    def recognize(
+        self, host: ModelHost, text: str, recognize: Callable[[ModelHost, str], ModelResponse]
+    ) -> ModelResponse | None:
+        """
+            Get the model prediction for the text recognized in chunks, recognize is called with the host and the chunk.
+            Returns None if the text is to be sent to the host in one request: it is short, no other host is free
+            or the chunks are recognized by different model versions.
+        """
+        chunks, chunk_hosts = self.__split(host, text)
+        if not chunks:
+            return None
+        futures = [
+            self.__executor.submit(self.__recognize_chunk, chunk_host, chunk, recognize)
+            for chunk_host, chunk in zip(chunk_hosts, chunks)
+        ]
+        own_response = recognize(host, chunks[-1])
+        responses = [future.result() for future in futures] + [own_response]
+        return merge_responses(text, [
+            response if response is not None else recognize(host, chunk)
+            for chunk, response in zip(chunks, responses)
+        ])
+
+    async def recognize_async(
+        self, host: ModelHost, text: str, recognize: Callable[[ModelHost, str], Awaitable[ModelResponse]]
+    ) -> ModelResponse | None:
+        """Same as recognize, but the chunks are recognized by coroutines."""
+        chunks, chunk_hosts = self.__split(host, text)
+        if not chunks:
+            return None
+        own_response, *responses = await asyncio.gather(
+            recognize(host, chunks[-1]),
+            *(
+                self.__recognize_chunk_async(chunk_host, chunk, recognize)
+                for chunk_host, chunk in zip(chunk_hosts, chunks)
+            ),
+        )
+        return merge_responses(text, [
+            response if response is not None else await recognize(host, chunk)
+            for chunk, response in zip(chunks, responses + [own_response])
+        ])
+
+    def __split(self, host: ModelHost, text: str) -> tuple[list[str], list[ModelHost]]:
+        """
+            Chunks of the text and the acquired hosts of all chunks but the last one.
+            No chunks if the text is short or no other host is free.
+        """
+        if len(text) <= self.__chunk_size:
+            return [], []
+        chunks = split_chunks(text, self.__chunk_size)
+        chunk_hosts = self.__get_hosts(host, len(chunks) - 1) if len(chunks) > 1 else []
+        if not chunk_hosts:
+            return [], []
+        return join_chunks(chunks, len(chunk_hosts) + 1), chunk_hosts
+
+    @staticmethod
+    def __recognize_chunk(
+        chunk_host: ModelHost, chunk: str, recognize: Callable[[ModelHost, str], ModelResponse]
+    ) -> ModelResponse | None:
+        """Response for the chunk on the acquired host, None if it failed."""
+        try:
+            return recognize(chunk_host, chunk)
+        except Exception as e:
+            logger.warning('Chunk failed on %s, it is recognized on the host of the worker: %s', chunk_host.url, e)
+        finally:
+            chunk_host.stats.release()
+        return None
+
+    @staticmethod
+    async def __recognize_chunk_async(
+        chunk_host: ModelHost, chunk: str, recognize: Callable[[ModelHost, str], Awaitable[ModelResponse]]
+    ) -> ModelResponse | None:
+        try:
+            return await recognize(chunk_host, chunk)
+        except Exception as e:
+            logger.warning('Chunk failed on %s, it is recognized on the host of the worker: %s', chunk_host.url, e)
+        finally:
+            chunk_host.stats.release()
+        return None
@@ -0,0 +1,58 @@
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+
+
+@dataclass()
+class CompletionEstimate:
+    """Expected start and finish of the report calculation."""
+    start_dttm: datetime | None
+    end_dttm: datetime | None
+
+
+class DurationModel:
+    """
+        Streaming linear regression of the calculation duration on the text length.
+        Old observations are forgotten exponentially with the decay factor, so the model follows
+        changes of the host performance. Until the lengths differ enough the model predicts the mean duration.
+    """
+    def __init__(self, decay: float = 0.02) -> None:
+        self.__decay = decay
+        self.__lock = Lock()
+        self.__weight = 0.0
+        self.__x = 0.0
+        self.__y = 0.0
+        self.__xx = 0.0
+        self.__xy = 0.0
+
+    @property
+    def observed(self) -> bool:
+        return self.__weight > 0
+
+    @property
+    def mean(self) -> float | None:
+        """Mean duration in seconds."""
+        with self.__lock:
+            return self.__y / self.__weight if self.__weight else None
+
+    def observe(self, length: int, duration: float) -> None:
+        keep = 1 - self.__decay
+        with self.__lock:
+            self.__weight = keep * self.__weight + 1
+            self.__x = keep * self.__x + length
+            self.__y = keep * self.__y + duration
+            self.__xx = keep * self.__xx + length * length
+            self.__xy = keep * self.__xy + length * duration
+
+    def predict(self, length: int) -> float | None:
+        """Expected duration in seconds of the calculation of a text of the length."""
+        with self.__lock:
+            if not self.__weight:
+                return None
+            mean_x = self.__x / self.__weight
+            mean_y = self.__y / self.__weight
+            variance = self.__xx / self.__weight - mean_x * mean_x
+            if variance <= max(mean_x * mean_x, 1) * 1e-6:
+                return mean_y
+            slope = (self.__xy / self.__weight - mean_x * mean_y) / variance
+            return max(mean_y + slope * (length - mean_x), 0.0)
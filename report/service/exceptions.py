@@ -7,3 +7,14 @@ class ReportDoesNotExist(ObjectDoesNotExist):
 
 class ReportNotInCalculationQueue(Exception):
     """The report is not in the calculation queue"""
+
+
+class InvalidReportCursor(ValueError):
+    """The cursor of the reports list is invalid"""
+
+
+class ReportQueueOverloaded(Exception):
+    """The calculation queue is too long to accept a new report"""
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,274 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from threading import Lock
+from typing import Iterator
+import logging
+import time
+
+import requests
+
+from .model_client import ModelHostClient
+from .batching import SentenceBatcher
+from .estimator import DurationModel
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+
+@dataclass()
+class HostInfo:
+    url: str
+    state: CircuitState
+    limit: int
+    outstanding: int
+    latency: float | None
+    error_rate: float
+    requests: int
+    errors: int
+
+
+def is_overload_error(error: Exception) -> bool:
+    """The model call failed because the host is overloaded or unreachable."""
+    return isinstance(error, (requests.Timeout, requests.ConnectionError, TimeoutError, ConnectionError))
+
+
+def is_host_error(error: Exception) -> bool:
+    """The model call failed because of the host, not because of the report."""
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status', None)
+    return is_overload_error(error) or (isinstance(status, int) and status >= 500)
+
+
+class CircuitBreaker:
+    """
+        Circuit breaker of one host.
+        CLOSED: reports are calculated on the host. After failure_threshold host errors in a row the circuit opens.
+        OPEN: the host is out of rotation. After reset_timeout or a successful health check the circuit half-opens.
+        HALF_OPEN: one trial report is calculated on the host, the result of its model call closes or opens
+        the circuit again.
+    """
+    def __init__(self, url: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.__url = url
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__state = CircuitState.CLOSED
+        self.__failures = 0
+        self.__open_time = 0.0
+        self.__trial = False
+        self.__lock = Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        with self.__lock:
+            if self.__state == CircuitState.OPEN and time.monotonic() - self.__open_time >= self.__reset_timeout:
+                self.__state = CircuitState.HALF_OPEN
+            return self.__state
+
+    def is_available(self) -> bool:
+        """A report can be assigned to the host."""
+        state = self.state
+        return state == CircuitState.CLOSED or (state == CircuitState.HALF_OPEN and not self.__trial)
+
+    def acquire(self) -> None:
+        """Count a report assigned to the host, in the HALF_OPEN state it is the trial report."""
+        with self.__lock:
+            if self.__state == CircuitState.HALF_OPEN:
+                self.__trial = True
+
+    def release(self) -> None:
+        """Finish the assigned report, in the HALF_OPEN state the trial report found no model call to make."""
+        with self.__lock:
+            if self.__state == CircuitState.HALF_OPEN:
+                self.__trial = False
+
+    def record(self, error: Exception | None) -> None:
+        """Update the circuit with the result of the model call."""
+        with self.__lock:
+            self.__trial = False
+            if error is None or not is_host_error(error):
+                self.__failures = 0
+                self.__state = CircuitState.CLOSED
+                return
+            self.__failures += 1
+            if self.__state == CircuitState.HALF_OPEN or self.__failures >= self.__failure_threshold:
+                if self.__state != CircuitState.OPEN:
+                    logger.warning('Circuit of %s is open after %s failures: %s', self.__url, self.__failures, error)
+                self.__state = CircuitState.OPEN
+                self.__open_time = time.monotonic()
+
+    def half_open(self) -> None:
+        """Let a trial report to the open host, for example after a successful health check."""
+        with self.__lock:
+            if self.__state == CircuitState.OPEN:
+                self.__state = CircuitState.HALF_OPEN
+
+
+class ConcurrencyLimit:
+    """
+        Adaptive limit of reports calculated on one host at the same time (AIMD).
+        The limit grows by one for every limit calls that finish under the latency target
+        and is halved on a timeout or a call slower than the target, at most once per target interval.
+        Without the latency target the limit is fixed.
+    """
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float, decrease: float = 0.5) -> None:
+        self.__limit = float(initial)
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__latency_target = latency_target
+        self.__decrease = decrease
+        self.__decrease_time = 0.0
+        self.__lock = Lock()
+
+    @property
+    def value(self) -> int:
+        return int(self.__limit)
+
+    def update(self, url: str, latency: float, error: Exception | None) -> None:
+        """Adapt the limit to the finished model call."""
+        if not self.__latency_target:
+            return
+        with self.__lock:
+            previous = self.value
+            if latency > self.__latency_target or (error is not None and is_overload_error(error)):
+                if time.monotonic() - self.__decrease_time < self.__latency_target:
+                    return
+                self.__decrease_time = time.monotonic()
+                self.__limit = max(float(self.__minimum), self.__limit * self.__decrease)
+            elif error is None:
+                self.__limit = min(float(self.__maximum), self.__limit + 1 / self.__limit)
+            if self.value != previous:
+                logger.info('Concurrency limit of %s changed from %s to %s', url, previous, self.value)
+
+
+class HostStats:
+    """
+        Statistics of one host collected by its workers: reports and chunks in process,
+        exponentially weighted moving averages of latency and error rate of the model calls.
+        Finished calls also update the concurrency limit and the circuit breaker of the host,
+        successful calls of a known text length update the duration model of the host.
+        Texts answered from the sentence memo make no model calls and do not count.
+    """
+    def __init__(self, url: str, limit: ConcurrencyLimit, breaker: CircuitBreaker, decay: float = 0.2) -> None:
+        self.__url = url
+        self.__limit = limit
+        self.__breaker = breaker
+        self.__decay = decay
+        self.__lock = Lock()
+        self.__outstanding = 0
+        self.__latency: float | None = None
+        self.__error_rate = 0.0
+        self.__requests = 0
+        self.__errors = 0
+        self.__duration = DurationModel()
+
+    @property
+    def url(self) -> str:
+        return self.__url
+
+    @property
+    def limit(self) -> int:
+        """Current number of reports that can be calculated on the host at the same time."""
+        return self.__limit.value
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self.__breaker
+
+    @property
+    def duration(self) -> DurationModel:
+        return self.__duration
+
+    @property
+    def outstanding(self) -> int:
+        return self.__outstanding
+
+    @property
+    def latency(self) -> float | None:
+        return self.__latency
+
+    @property
+    def error_rate(self) -> float:
+        return self.__error_rate
+
+    @property
+    def requests(self) -> int:
+        return self.__requests
+
+    @property
+    def errors(self) -> int:
+        return self.__errors
+
+    def acquire(self) -> None:
+        """Count a report assigned to the host."""
+        self.__breaker.acquire()
+        with self.__lock:
+            self.__outstanding += 1
+
+    def release(self) -> None:
+        """Count a report or request assigned to the host as finished."""
+        self.__breaker.release()
+        with self.__lock:
+            self.__outstanding -= 1
+
+    def try_acquire(self) -> bool:
+        """Count a request assigned to the host if the host has free capacity and its circuit lets it."""
+        with self.__lock:
+            if self.__outstanding >= self.limit or not self.__breaker.is_available():
+                return False
+            self.__breaker.acquire()
+            self.__outstanding += 1
+        return True
+
+    @contextmanager
+    def measure(self, length: int = 0) -> Iterator[None]:
+        """Measure the model call for a text of the length, the call fails if an exception is raised."""
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.__record(time.monotonic() - start, e)
+            raise
+        self.__record(time.monotonic() - start, None)
+        if length:
+            self.__duration.observe(length, time.monotonic() - start)
+
+    def get_info(self) -> HostInfo:
+        return HostInfo(
+            url=self.__url,
+            state=self.__breaker.state,
+            limit=self.limit,
+            outstanding=self.__outstanding,
+            latency=self.__latency,
+            error_rate=self.__error_rate,
+            requests=self.__requests,
+            errors=self.__errors,
+        )
+
+    def __record(self, latency: float, error: Exception | None) -> None:
+        success = error is None
+        self.__limit.update(self.__url, latency, error)
+        self.__breaker.record(error)
+        with self.__lock:
+            self.__requests += 1
+            if success:
+                self.__latency = latency if self.__latency is None else (
+                    self.__decay * latency + (1 - self.__decay) * self.__latency
+                )
+            else:
+                self.__errors += 1
+            self.__error_rate = self.__decay * (not success) + (1 - self.__decay) * self.__error_rate
+
+
+@dataclass()
+class ModelHost:
+    """Model service host with the objects shared by its workers."""
+    url: str
+    client: ModelHostClient
+    stats: HostStats
+    batcher: SentenceBatcher | None = None
@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+import gzip
+import json
+import random
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pydantic import BaseModel
+
+
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+class Recognition(BaseModel):
+    """Prediction body for one sentence"""
+    sentence: str
+    is_paraphrase: bool
+    probability: float
+
+
+class ModelResponse(BaseModel):
+    """Response from the model service"""
+    version: str
+    source_text: str
+    recognition: list[Recognition]
+    recognition_time: str
+
+
+@dataclass(frozen=True)
+class ModelClientOptions:
+    pool_size: int
+    connect_timeout: float
+    read_timeout: float
+    retries: int
+    retry_backoff: float
+    compression: bool
+
+
+class ModelHostClient:
+    """
+        HTTP client of one model service host.
+        Keeps a pool of keep-alive connections shared by all workers of the host.
+        Connection errors and 502/503/504 responses are retried with a jittered backoff,
+        the model call is idempotent. Read timeouts are not retried.
+    """
+    def __init__(self, url: str, options: ModelClientOptions) -> None:
+        self.__url = url
+        self.__options = options
+        self.__session = requests.Session()
+        self.__session.mount(self.__url, HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=options.pool_size,
+            max_retries=Retry(
+                total=options.retries,
+                read=0,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset({'POST'}),
+                backoff_factor=options.retry_backoff,
+                backoff_jitter=options.retry_backoff,
+                raise_on_status=False,
+            ),
+        ))
+
+    @property
+    def url(self) -> str:
+        return self.__url
+
+    @property
+    def options(self) -> ModelClientOptions:
+        return self.__options
+
+    def recognize(self, text: str) -> ModelResponse:
+        """Get the model prediction for the text."""
+        return self.__post({'text': text})
+
+    def recognize_batch(self, sentences: list[str]) -> ModelResponse:
+        """
+            Get the model prediction for the list of sentences in one call.
+            Recognitions in the response are in the order of the sentences.
+        """
+        return self.check_batch_response(sentences, self.__post({'sentences': sentences}))
+
+    def check_health(self, path: str) -> bool:
+        """The host responds to the health check request without a server error."""
+        try:
+            response = self.__session.get(
+                urljoin(self.__url, path), timeout=(self.__options.connect_timeout, self.__options.connect_timeout)
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code < 500
+
+    @staticmethod
+    def check_batch_response(sentences: list[str], response: ModelResponse) -> ModelResponse:
+        if len(response.recognition) != len(sentences):
+            raise ValueError(f'Model returned {len(response.recognition)} recognitions for {len(sentences)} sentences')
+        return response
+
+    def encode_request(self, data: dict) -> tuple[bytes, dict[str, str]]:
+        """Encode the request body, compressed if it is enabled in the options."""
+        body = json.dumps(data).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.__options.compression:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        return body, headers
+
+    def get_retry_delay(self, attempt: int) -> float:
+        """Delay before the retry with the number attempt, with the same backoff as the sync session."""
+        return self.__options.retry_backoff * 2 ** attempt + random.uniform(0, self.__options.retry_backoff)
+
+    def __post(self, data: dict) -> ModelResponse:
+        body, headers = self.encode_request(data)
+        response = self.__session.post(
+            self.__url,
+            data=body,
+            headers=headers,
+            timeout=(self.__options.connect_timeout, self.__options.read_timeout),
+        )
+        response.raise_for_status()
+        return ModelResponse(**response.json()['data'])
@@ -0,0 +1,86 @@
+from typing import AsyncIterator, Callable
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+
+from common.renderers import encode_json
+from common.settings import REPORT_STREAM_INTERVAL, REPORT_STREAM_TIMEOUT
+from .report import ReportManager, ReportStatus
+
+
+KEEPALIVE_INTERVAL = 15
+
+
+def encode_event(name: str, data) -> str:
+    """Server-sent event with the JSON data."""
+    return f'event: {name}\ndata: {encode_json(data).decode()}\n\n'
+
+
+class ReportProgressStream:
+    """
+        Server-sent events about the progress of the report calculation.
+        The first event is the full report info, then the report is checked every interval seconds
+        and a status event with the estimates is sent when the status or the queue place change.
+        The recognitions are sent when the report is completed, then the stream ends.
+        The stream is closed after timeout seconds, the browser reconnects to it.
+        Events are produced by an async iterator. The DB queries of a check are made in the shared executor,
+        not in the thread of the request, so an open stream holds a thread only while the report is checked.
+    """
+    def __init__(
+        self,
+        report_id: int,
+        user: User,
+        interval: float = REPORT_STREAM_INTERVAL,
+        timeout: float = REPORT_STREAM_TIMEOUT,
+    ) -> None:
+        self.__report_id = report_id
+        self.__user = user
+        self.__interval = interval
+        self.__timeout = timeout
+        self.__progress: tuple[ReportStatus, int | None] | None = None
+        self.__finished = False
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        deadline = time.monotonic() + self.__timeout
+        last_event = time.monotonic()
+        yield await self.__run(self.__start)
+        while not self.__finished and time.monotonic() < deadline:
+            await asyncio.sleep(self.__interval)
+            events = await self.__run(self.__poll)
+            if events or time.monotonic() - last_event >= KEEPALIVE_INTERVAL:
+                last_event = time.monotonic()
+                yield events or ': keepalive\n\n'
+
+    @staticmethod
+    async def __run(check: Callable[[], str]) -> str:
+        """
+            Make the check in the shared executor. Thread sensitive calls would go to the one thread
+            shared by all streams, see common.asgi, so the checks of different streams would wait for each other.
+        """
+        def run() -> str:
+            close_old_connections()
+            return check()
+        return await sync_to_async(run, thread_sensitive=False)()
+
+    def __start(self) -> str:
+        report_info = ReportManager.load(self.__report_id, self.__user).get_report_info()
+        self.__progress = (report_info.status, report_info.queue_place)
+        self.__finished = report_info.status in (ReportStatus.COMPLETED, ReportStatus.ERROR)
+        return encode_event('report', report_info) + (encode_event('end', None) if self.__finished else '')
+
+    def __poll(self) -> str:
+        report_manager = ReportManager.load(self.__report_id, self.__user)
+        progress = report_manager.get_progress_info()
+        if (progress.status, progress.queue_place) == self.__progress:
+            return ''
+        self.__progress = (progress.status, progress.queue_place)
+        events = encode_event('status', progress)
+        if progress.status == ReportStatus.COMPLETED:
+            events += encode_event('recognitions', report_manager.get_recognitions())
+        if progress.status in (ReportStatus.COMPLETED, ReportStatus.ERROR):
+            self.__finished = True
+            events += encode_event('end', None)
+        return events
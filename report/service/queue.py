@@ -0,0 +1,231 @@
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.utils import IntegrityError
+from django.utils import timezone
+
+from ..models import Report, ReportQueueCounter, CalculationShare
+from .exceptions import ReportNotInCalculationQueue
+
+
+QUEUE_COUNTER_ID = 1
+QUEUE_STEP = 1000
+
+
+def get_source_field(field: str) -> Subquery:
+    """Field of the source report, duplicates released from it take its place in the queue."""
+    return Subquery(Report.objects.filter(pk=OuterRef('duplicate_of')).values(field)[:1])
+
+
+class ReportQueue:
+    """
+        Queue of reports waiting for calculation stored in the Report table.
+        A report is WAITING while it is in the queue and becomes IN_PROCESS when a worker claims it.
+        Duplicates of other reports wait for their source report and are never claimed.
+        The queue is fair between users: queue numbers are virtual finish times of weighted fair queuing.
+        A report of a user is numbered QUEUE_STEP / weight after the last queued report of the user
+        or after the queue head, so a user with many queued reports does not delay other users.
+        Reports are claimed by priority, then by queue number, reports of users having max_in_process
+        reports in process are skipped.
+        Claims are taken through SELECT ... FOR UPDATE SKIP LOCKED, so any number of processes
+        can share the queue. The claim owner is a worker slot name with the instance id of the process,
+        and only one IN_PROCESS report can have the same owner. Running workers refresh their claims
+        with heartbeats, a claim not refreshed for claim_timeout seconds is returned to the queue,
+        so reports of a killed process are calculated again soon after.
+    """
+    def __init__(self, claim_timeout: float, max_attempts: int = 1, max_in_process: int = 0) -> None:
+        self.__claim_timeout = timedelta(seconds=claim_timeout)
+        self.__max_attempts = max_attempts
+        self.__max_in_process = max_in_process
+
+    def claim(self, owner: str) -> Report | None:
+        """
+            Take the first waiting report for calculation by the owner.
+            Returns None if the queue is empty or the owner already has a report in process.
+        """
+        try:
+            with transaction.atomic():
+                report = (
+                    Report.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True)
+                    .exclude(user_id__in=self.__get_saturated_users())
+                    .order_by('-priority', 'queue_number', 'id')
+                    .first()
+                )
+                if report is None:
+                    return None
+                report.status = Report.ReportStatus.IN_PROCESS
+                report.claim_owner = owner
+                report.claim_dttm = report.calculation_start_dttm = timezone.now()
+                report.calculation_attempts += 1
+                report.save(update_fields=[
+                    'status', 'claim_owner', 'claim_dttm', 'calculation_start_dttm', 'calculation_attempts'
+                ])
+                return report
+        except IntegrityError:
+            return None
+
+    def finish(self, report: Report, owner: str, status: Report.ReportStatus, **fields) -> bool:
+        """
+            Complete the calculation of the claimed report with the status.
+            Returns False if the report is no longer claimed by the owner, in this case nothing is changed.
+        """
+        fields.update(status=status, calculation_end_dttm=timezone.now())
+        updated = Report.objects.filter(
+            pk=report.pk, status=Report.ReportStatus.IN_PROCESS, claim_owner=owner
+        ).update(**fields)
+        if not updated:
+            return False
+        for field, value in fields.items():
+            setattr(report, field, value)
+        return True
+
+    def requeue(self, report: Report, owner: str) -> bool:
+        """
+            Return the claimed report to the queue to calculate it on another host.
+            Returns False if the report has no attempts left or is no longer claimed by the owner.
+        """
+        if report.calculation_attempts >= self.__max_attempts:
+            return False
+        updated = Report.objects.filter(
+            pk=report.pk, status=Report.ReportStatus.IN_PROCESS, claim_owner=owner
+        ).update(status=Report.ReportStatus.WAITING, claim_owner=None, claim_dttm=None, calculation_start_dttm=None)
+        if not updated:
+            return False
+        report.status = Report.ReportStatus.WAITING
+        report.claim_owner = report.claim_dttm = report.calculation_start_dttm = None
+        return True
+
+    def heartbeat(self, owners: list[str]) -> int:
+        """Refresh the claims of the owners that are still calculating their reports."""
+        return Report.objects.filter(
+            status=Report.ReportStatus.IN_PROCESS, claim_owner__in=owners
+        ).update(claim_dttm=timezone.now())
+
+    def requeue_stale(self) -> int:
+        """
+            Return to the queue reports whose claim has expired, for example after a process was killed,
+            and duplicates whose source report has finished without them.
+        """
+        Report.objects.filter(
+            status=Report.ReportStatus.WAITING,
+            duplicate_of__status__in=[Report.ReportStatus.COMPLETED, Report.ReportStatus.ERROR],
+        ).update(
+            duplicate_of=None, queue_number=get_source_field('queue_number'), priority=get_source_field('priority')
+        )
+        return Report.objects.filter(
+            status=Report.ReportStatus.IN_PROCESS,
+            claim_dttm__lt=timezone.now() - self.__claim_timeout,
+        ).update(
+            status=Report.ReportStatus.WAITING,
+            claim_owner=None,
+            claim_dttm=None,
+            calculation_start_dttm=None,
+        )
+
+    @staticmethod
+    def number(reports: list[Report]) -> None:
+        """Give queue numbers and priorities to the new reports, must be called in the transaction saving them."""
+        if not reports:
+            return
+        counter = ReportQueueCounter.objects.filter(pk=QUEUE_COUNTER_ID)
+        # The empty update locks the counter row before anything is read, numbering is serialized by the lock
+        if not counter.update(value=F('value')):
+            ReportQueueCounter.objects.get_or_create(pk=QUEUE_COUNTER_ID)
+        counter = counter.get()
+        head = ReportQueue.__get_head()
+        if head is None:
+            head = counter.value
+        user_ids = {report.user_id for report in reports}
+        shares = {share.user_id: share for share in CalculationShare.objects.filter(user_id__in=user_ids)}
+        last_numbers = dict(
+            Report.objects
+            .filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True, user_id__in=user_ids)
+            .values('user_id')
+            .annotate(last=Max('queue_number'))
+            .values_list('user_id', 'last')
+        )
+        for report in reports:
+            share = shares.get(report.user_id)
+            weight = share.weight if share is not None else 1
+            step = max(1, round(QUEUE_STEP / weight)) if weight > 0 else QUEUE_STEP
+            report.queue_number = max(head, last_numbers.get(report.user_id) or head) + step
+            report.priority = share.priority if share is not None else 0
+            last_numbers[report.user_id] = report.queue_number
+        counter.value = max(counter.value, *last_numbers.values())
+        counter.save(update_fields=['value'])
+
+    @staticmethod
+    def get_busy_owners(owners: list[str]) -> set[str]:
+        """Get owners from the list that already have a report in process."""
+        return set(
+            Report.objects
+            .filter(status=Report.ReportStatus.IN_PROCESS, claim_owner__in=owners)
+            .values_list('claim_owner', flat=True)
+        )
+
+    @staticmethod
+    def get_place(report_id: int) -> int:
+        """
+            Get a report place in the queue, it is the number of waiting reports claimed before it.
+            The place is an estimate: reports of other users added later can be claimed earlier.
+            Reports ahead are counted in the claim order index, queue numbers of different users
+            grow by different steps, so they are counted exactly rather than estimated from the numbers.
+        """
+        report = (
+            Report.objects
+            .filter(pk=report_id, status=Report.ReportStatus.WAITING)
+            .values('id', 'queue_number', 'priority', 'duplicate_of')
+            .first()
+        )
+        if report is not None and report['duplicate_of'] is not None:
+            return ReportQueue.get_place(report['duplicate_of'])
+        if report is None or report['queue_number'] is None:
+            raise ReportNotInCalculationQueue(f'Report {report_id} is not in calculation queue')
+        priority, number = report['priority'], report['queue_number']
+        return Report.objects.filter(
+            Q(priority__gt=priority)
+            | Q(priority=priority, queue_number__lt=number)
+            | Q(priority=priority, queue_number=number, id__lt=report_id),
+            status=Report.ReportStatus.WAITING,
+            duplicate_of__isnull=True,
+        ).count() + 1
+
+    @staticmethod
+    async def aget_place(report_id: int) -> int:
+        """Same as get_place, the queries are made in one thread."""
+        return await sync_to_async(ReportQueue.get_place)(report_id)
+
+    @staticmethod
+    def __get_head() -> int | None:
+        return (
+            Report.objects
+            .filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True)
+            .order_by('queue_number')
+            .values_list('queue_number', flat=True)
+            .first()
+        )
+
+    def __get_saturated_users(self) -> list[int]:
+        """Users having the maximum number of reports in process."""
+        in_process = dict(
+            Report.objects
+            .filter(status=Report.ReportStatus.IN_PROCESS)
+            .values('user_id')
+            .annotate(count=Count('id'))
+            .values_list('user_id', 'count')
+        )
+        if not in_process:
+            return []
+        limits = dict(
+            CalculationShare.objects
+            .filter(user_id__in=list(in_process), max_in_process__gt=0)
+            .values_list('user_id', 'max_in_process')
+        )
+        return [
+            user_id for user_id, count in in_process.items()
+            if 0 < limits.get(user_id, self.__max_in_process) <= count
+        ]
@@ -0,0 +1,220 @@
+from array import array
+from dataclasses import dataclass
+from itertools import islice
+import sys
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import QuerySet
+
+from common.settings import REPORT_COMPACT_RECOGNITIONS
+from ..models import Report, ReportRecognition, ReportResult
+
+
+@dataclass()
+class StoredRecognition:
+    id: int | None
+    sentence: str | None
+    is_paraphrase: bool
+    probability: float
+    sentence_number: int
+
+
+def pack(typecode: str, values) -> bytes:
+    """Little-endian bytes of the values."""
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(typecode: str, data: bytes | memoryview) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_result(report: Report, recognitions: list[StoredRecognition]) -> ReportResult | None:
+    """Compact result of the report, None if the sentences are not found in the report text in their order."""
+    offsets: list[int] = []
+    position = 0
+    for recognition in recognitions:
+        start = report.text.find(recognition.sentence, position)
+        if start < 0:
+            return None
+        position = start + len(recognition.sentence)
+        offsets += (start, position)
+    return ReportResult(
+        report=report,
+        sentence_offsets=pack('I', offsets),
+        probabilities=pack('f', [recognition.probability for recognition in recognitions]),
+        paraphrases=bytes(recognition.is_paraphrase for recognition in recognitions),
+    )
+
+
+def decode_result(text: str, result: ReportResult) -> list[StoredRecognition]:
+    """Recognitions of the compact result, the sentences are sliced from the report text."""
+    offsets = unpack('I', result.sentence_offsets)
+    return [
+        StoredRecognition(None, text[start:end], bool(paraphrase), probability, number)
+        for number, (start, end, probability, paraphrase) in enumerate(zip(
+            offsets[::2], offsets[1::2], unpack('f', result.probabilities), bytes(result.paraphrases)
+        ))
+    ]
+
+
+class RecognitionStore:
+    """
+        Storage of the report recognitions.
+        In the compact mode the recognitions of a report are saved in one ReportResult row,
+        a report whose sentences are not found in its text is saved as ReportRecognition rows, one per sentence.
+        Both forms are read in any mode.
+    """
+    def __init__(self, compact: bool) -> None:
+        self.__compact = compact
+
+    def save(self, items: list[tuple[Report, list[StoredRecognition]]]) -> list[list[StoredRecognition]]:
+        """Save the recognitions of the reports with batched queries, returns the saved recognitions."""
+        results: list[ReportResult] = []
+        rows: list[ReportRecognition] = []
+        for report, recognitions in items:
+            result = encode_result(report, recognitions) if self.__compact else None
+            if result is not None:
+                results.append(result)
+            else:
+                rows += [
+                    ReportRecognition(
+                        report=report,
+                        sentence=recognition.sentence,
+                        is_paraphrase=recognition.is_paraphrase,
+                        probability=recognition.probability,
+                        sentence_number=recognition.sentence_number,
+                    )
+                    for recognition in recognitions
+                ]
+        ReportResult.objects.bulk_create(results)
+        saved: dict[int, list[StoredRecognition]] = {}
+        for row in ReportRecognition.objects.bulk_create(rows):
+            saved.setdefault(row.report_id, []).append(self.__from_row(row))
+        return [saved.get(report.pk, recognitions) for report, recognitions in items]
+
+    def load(self, report: Report) -> list[StoredRecognition]:
+        """Recognitions of the report in the order of sentences, the result is read with the report if selected."""
+        try:
+            return decode_result(report.text, report.result)
+        except ObjectDoesNotExist:
+            pass
+        return [
+            self.__from_row(row)
+            for row in ReportRecognition.objects.filter(report=report).order_by('sentence_number')
+        ]
+
+    async def aload(self, report: Report) -> list[StoredRecognition]:
+        """Same as load with the async ORM."""
+        if Report.result.is_cached(report):
+            result = getattr(report, 'result', None)
+        else:
+            result = await ReportResult.objects.filter(report=report).afirst()
+        if result is not None:
+            return decode_result(report.text, result)
+        return [
+            self.__from_row(row)
+            async for row in ReportRecognition.objects.filter(report=report).order_by('sentence_number')
+        ]
+
+    def load_part(
+        self, report: Report, since_sentence: int, limit: int | None, with_sentences: bool
+    ) -> list[StoredRecognition]:
+        """
+            Recognitions of sentences after since_sentence, at most limit of them.
+            Recognitions saved as rows are filtered and sliced in SQL, sentences are not read if they are not needed.
+        """
+        if Report.result.is_cached(report):
+            result = getattr(report, 'result', None)
+        else:
+            result = ReportResult.objects.filter(report=report).first()
+        if result is not None:
+            return self.__slice(decode_result(report.text, result), since_sentence, limit)
+        return [
+            self.__from_row(row, with_sentences)
+            for row in self.select_rows(report, since_sentence, limit, with_sentences)
+        ]
+
+    async def aload_part(
+        self, report: Report, since_sentence: int, limit: int | None, with_sentences: bool
+    ) -> list[StoredRecognition]:
+        """Same as load_part with the async ORM."""
+        if Report.result.is_cached(report):
+            result = getattr(report, 'result', None)
+        else:
+            result = await ReportResult.objects.filter(report=report).afirst()
+        if result is not None:
+            return self.__slice(decode_result(report.text, result), since_sentence, limit)
+        return [
+            self.__from_row(row, with_sentences)
+            async for row in self.select_rows(report, since_sentence, limit, with_sentences)
+        ]
+
+    @staticmethod
+    def is_result_loaded(report: Report) -> bool:
+        """The compact result is read with the report, its recognitions are decoded without queries."""
+        return Report.result.is_cached(report) and getattr(report, 'result', None) is not None
+
+    @staticmethod
+    def select_rows(report: Report, since_sentence: int, limit: int | None, with_sentences: bool) -> QuerySet:
+        """Recognition rows of sentences after since_sentence, at most limit of them."""
+        rows = (
+            ReportRecognition.objects
+            .filter(report=report, sentence_number__gt=since_sentence)
+            .order_by('sentence_number')
+        )
+        if not with_sentences:
+            rows = rows.defer('sentence')
+        return rows[:limit] if limit is not None else rows
+
+    def load_many(self, reports: list[Report]) -> dict[int, list[StoredRecognition]]:
+        """Recognitions of the reports by their ids with two queries."""
+        texts = {report.pk: report.text for report in reports}
+        loaded = {
+            result.pk: decode_result(texts[result.pk], result)
+            for result in ReportResult.objects.filter(report__in=list(texts))
+        }
+        rows = (
+            ReportRecognition.objects
+            .filter(report__in=[report_id for report_id in texts if report_id not in loaded])
+            .order_by('report', 'sentence_number')
+        )
+        for row in rows:
+            loaded.setdefault(row.report_id, []).append(self.__from_row(row))
+        return loaded
+
+    def compact(self, reports: list[Report]) -> int:
+        """Convert the recognitions of the reports saved as rows to the compact form, returns the number of reports."""
+        loaded = self.load_many(reports)
+        results = [
+            result for result in (
+                encode_result(report, loaded[report.pk]) for report in reports if report.pk in loaded
+            )
+            if result is not None
+        ]
+        with transaction.atomic():
+            ReportResult.objects.bulk_create(results, ignore_conflicts=True)
+            ReportRecognition.objects.filter(report__in=[result.pk for result in results]).delete()
+        return len(results)
+
+    @staticmethod
+    def __slice(
+        recognitions: list[StoredRecognition], since_sentence: int, limit: int | None
+    ) -> list[StoredRecognition]:
+        return list(islice((r for r in recognitions if r.sentence_number > since_sentence), limit))
+
+    @staticmethod
+    def __from_row(row: ReportRecognition, with_sentence: bool = True) -> StoredRecognition:
+        return StoredRecognition(
+            row.pk, row.sentence if with_sentence else None, row.is_paraphrase, row.probability, row.sentence_number
+        )
+
+
+recognition_store = RecognitionStore(REPORT_COMPACT_RECOGNITIONS)
@@ -1,15 +1,30 @@
-from typing import Self
+from typing import Iterable, Self
 from enum import Enum
 from dataclasses import dataclass
+from datetime import datetime
+from hashlib import sha1
+from itertools import islice
+import base64
+import binascii
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from django.shortcuts import reverse
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q
+from django.db.models.functions import Substr
 from django.utils import timezone
 
-from ..models import Report, ReportRecognition
-from .exceptions import ReportDoesNotExist, ReportNotInCalculationQueue
+from ..models import Report
+from .exceptions import ReportDoesNotExist, ReportNotInCalculationQueue, InvalidReportCursor
 from .calculation_manager import calculation_manager
+from .result_cache import report_result_cache
+from .estimator import CompletionEstimate
+from .report_cache import completed_report_cache
+from .recognition_store import StoredRecognition, recognition_store
+
+
+PREVIEW_LENGTH = 100
 
 
 class ReportStatus(str, Enum):
@@ -19,6 +34,14 @@ class ReportStatus(str, Enum):
     ERROR = 'ERROR'
 
 
+REPORT_STATUSES = {
+    'W': ReportStatus.WAITING,
+    'P': ReportStatus.IN_PROCESS,
+    'C': ReportStatus.COMPLETED,
+    'E': ReportStatus.ERROR,
+}
+
+
 @dataclass()
 class ReportUrls:
     page: str
@@ -27,58 +50,166 @@ class ReportUrls:
 
 @dataclass()
 class RecognitionInfo:
-    id: int
+    id: int | None
     report_id: int
-    sentence: str
+    sentence: str | None
     probability: float
     sentence_number: int
 
 
 @dataclass()
-class ReportInfo:
+class ReportCreatedInfo:
+    id: int
+    status: ReportStatus
+    urls: ReportUrls
+
+
+@dataclass()
+class ReportListItem:
     id: int
     text: str
     status: ReportStatus
+    create_dttm: datetime
+    urls: ReportUrls
+
+
+@dataclass()
+class ReportPage:
+    reports: list[ReportListItem]
+    next_cursor: str | None
+
+
+@dataclass()
+class ReportProgressInfo:
+    id: int
+    status: ReportStatus
+    queue_place: int | None
+    expected_start_dttm: datetime | None
+    expected_end_dttm: datetime | None
+
+
+@dataclass()
+class ReportInfo:
+    id: int
+    text: str | None
+    status: ReportStatus
     user: int
     queue_place: int | None
+    expected_start_dttm: datetime | None
+    expected_end_dttm: datetime | None
     recognitions: list[RecognitionInfo]
     urls: ReportUrls
 
 
 class ReportManager:
-    def __init__(self, report: Report) -> None:
+    def __init__(self, report: Report, recognitions: list[StoredRecognition] | None = None) -> None:
         self.report = report
+        self.__recognitions = recognitions
 
     @classmethod
     def load(cls, report_id: int, user: User | None = None) -> Self:
+        """Load the report, completed reports are taken from the cache without DB queries."""
         try:
-            report_manager = ReportManager(Report.objects.get(pk=report_id))
-            if user is not None and report_manager.report.user.pk != user.pk:
-                raise ObjectDoesNotExist()
-            return report_manager
+            cached_report = completed_report_cache.get(report_id)
+            if cached_report is not None:
+                report_manager = ReportManager(cached_report.report, cached_report.recognitions)
+            else:
+                report_manager = ReportManager(Report.objects.select_related('result').get(pk=report_id))
         except ObjectDoesNotExist:
             raise ReportDoesNotExist(f'The report {report_id} does not exist')
+        return report_manager.__check_owner(user)
+
+    @classmethod
+    async def aload(cls, report_id: int, user: User | None = None) -> Self:
+        """Same as load with the async ORM."""
+        try:
+            cached_report = await completed_report_cache.aget(report_id)
+            if cached_report is not None:
+                report_manager = ReportManager(cached_report.report, cached_report.recognitions)
+            else:
+                report_manager = ReportManager(await Report.objects.select_related('result').aget(pk=report_id))
+        except ObjectDoesNotExist:
+            raise ReportDoesNotExist(f'The report {report_id} does not exist')
+        return report_manager.__check_owner(user)
 
     @classmethod
     def create(cls, text: str, user: User) -> Self:
         report = Report(text=text, user=user, status=Report.ReportStatus.WAITING, create_dttm=timezone.now())
-        report.save()
+        report_result_cache.save_report(report)
         return ReportManager(report)
 
+    @classmethod
+    async def acreate(cls, text: str, user: User) -> Self:
+        """Same as create for async views, the report is saved in a thread because it needs a transaction."""
+        return await sync_to_async(cls.create)(text, user)
+
+    @classmethod
+    def create_many(cls, texts: list[str], user: User) -> list[Self]:
+        """Create reports for the texts with batched queries."""
+        create_dttm = timezone.now()
+        reports = [
+            Report(text=text, user=user, status=Report.ReportStatus.WAITING, create_dttm=create_dttm) for text in texts
+        ]
+        report_result_cache.save_reports(reports)
+        return [ReportManager(report) for report in reports]
+
+    @classmethod
+    def get_page(
+        cls,
+        user: User,
+        cursor: str | None = None,
+        limit: int = 50,
+        status: ReportStatus | None = None,
+        created_from: datetime | None = None,
+        created_to: datetime | None = None,
+    ) -> ReportPage:
+        """
+            Page of the user reports from the newest, the next page starts after the cursor of the previous one.
+            Only the beginning of the text is read from DB.
+        """
+        reports = Report.objects.filter(user=user)
+        if status is not None:
+            reports = reports.filter(status={value: key for key, value in REPORT_STATUSES.items()}[status])
+        if created_from is not None:
+            reports = reports.filter(create_dttm__gte=created_from)
+        if created_to is not None:
+            reports = reports.filter(create_dttm__lt=created_to)
+        if cursor is not None:
+            cursor_dttm, cursor_id = decode_cursor(cursor)
+            reports = reports.filter(Q(create_dttm__lt=cursor_dttm) | Q(create_dttm=cursor_dttm, id__lt=cursor_id))
+        rows = list(
+            reports
+            .order_by('-create_dttm', '-id')
+            .annotate(preview=Substr('text', 1, PREVIEW_LENGTH))
+            .values('id', 'preview', 'status', 'create_dttm')[:limit + 1]
+        )
+        items = [
+            ReportListItem(
+                id=row['id'],
+                text=row['preview'] if len(row['preview']) < PREVIEW_LENGTH else f'{row["preview"][:-2]}...',
+                status=REPORT_STATUSES[row['status']],
+                create_dttm=row['create_dttm'],
+                urls=get_report_urls(row['id']),
+            )
+            for row in rows[:limit]
+        ]
+        next_cursor = encode_cursor(items[-1].create_dttm, items[-1].id) if len(rows) > limit else None
+        return ReportPage(items, next_cursor)
+
     @property
     def report_status(self) -> ReportStatus:
-        statuses = {
-            'W': 'WAITING',
-            'P': 'IN_PROCESS',
-            'C': 'COMPLETED',
-            'E': 'ERROR',
-        }
-        return ReportStatus[statuses[self.report.status]]
+        return REPORT_STATUSES[self.report.status]
 
     def calculate(self) -> None:
-        calculation_manager.calculate(self.report)
+        if self.report.status == Report.ReportStatus.WAITING:
+            calculation_manager.calculate(self.report)
+
+    def get_created_info(self) -> ReportCreatedInfo:
+        """Short report info without DB queries."""
+        return ReportCreatedInfo(id=self.report.pk, status=self.report_status, urls=self.__get_urls())
 
-    def get_report_info(self) -> ReportInfo:
+    def get_progress_info(self) -> ReportProgressInfo:
+        """Report status and the place in the queue without recognitions."""
         if self.report.status == Report.ReportStatus.WAITING:
             try:
                 queue_place = calculation_manager.get_queue_place(self.report.pk)
@@ -87,19 +218,183 @@ class ReportManager:
                 self.report.refresh_from_db()
         else:
             queue_place = None
-        report_recognitions = [
-            RecognitionInfo(r.pk, self.report.pk, r.sentence, r.probability, r.sentence_number)
-            for r in ReportRecognition.objects.filter(report=self.report).order_by("sentence_number")
-        ]
-        return ReportInfo(
+        return self.__build_progress_info(queue_place)
+
+    async def aget_progress_info(self) -> ReportProgressInfo:
+        """Same as get_progress_info with the async ORM."""
+        if self.report.status == Report.ReportStatus.WAITING:
+            try:
+                queue_place = await calculation_manager.aget_queue_place(self.report.pk)
+            except ReportNotInCalculationQueue:
+                queue_place = 1
+                await self.report.arefresh_from_db()
+        else:
+            queue_place = None
+        return self.__build_progress_info(queue_place)
+
+    def __build_progress_info(self, queue_place: int | None) -> ReportProgressInfo:
+        if self.report.status in (Report.ReportStatus.WAITING, Report.ReportStatus.IN_PROCESS):
+            estimate = calculation_manager.estimate_completion(self.report, queue_place)
+        else:
+            estimate = CompletionEstimate(None, None)
+        return ReportProgressInfo(
             id=self.report.pk,
-            text=self.report.text,
             status=self.report_status,
-            user=self.report.user.pk,
             queue_place=queue_place,
-            recognitions=report_recognitions,
-            urls=ReportUrls(
-                reverse('web_app:report', kwargs={'report_id': self.report.pk}),
-                reverse('report:detail', kwargs={'report_id': self.report.pk}),
-            ),
+            expected_start_dttm=estimate.start_dttm,
+            expected_end_dttm=estimate.end_dttm,
         )
+
+    def get_recognitions(
+        self, since_sentence: int = -1, limit: int | None = None, with_sentences: bool = True
+    ) -> list[RecognitionInfo]:
+        """
+            Recognitions of sentences after since_sentence in the order of sentences, sentences may be omitted.
+            Only completed reports have recognitions. All recognitions are read once and cached when they
+            are requested whole or the compact result is read with the report, otherwise the requested part
+            is read with a query filtered and sliced in SQL.
+        """
+        if self.report.status != Report.ReportStatus.COMPLETED:
+            return []
+        if self.__recognitions is None:
+            if not self.__reads_all(since_sentence, limit, with_sentences):
+                return self.__build_recognitions(
+                    recognition_store.load_part(self.report, since_sentence, limit, with_sentences), with_sentences
+                )
+            self.__recognitions = recognition_store.load(self.report)
+            completed_report_cache.store(self.report, self.__recognitions)
+        return self.__select_recognitions(since_sentence, limit, with_sentences)
+
+    async def aget_recognitions(
+        self, since_sentence: int = -1, limit: int | None = None, with_sentences: bool = True
+    ) -> list[RecognitionInfo]:
+        """Same as get_recognitions with the async ORM."""
+        if self.report.status != Report.ReportStatus.COMPLETED:
+            return []
+        if self.__recognitions is None:
+            if not self.__reads_all(since_sentence, limit, with_sentences):
+                return self.__build_recognitions(
+                    await recognition_store.aload_part(self.report, since_sentence, limit, with_sentences),
+                    with_sentences,
+                )
+            self.__recognitions = await recognition_store.aload(self.report)
+            await completed_report_cache.astore(self.report, self.__recognitions)
+        return self.__select_recognitions(since_sentence, limit, with_sentences)
+
+    def __reads_all(self, since_sentence: int, limit: int | None, with_sentences: bool) -> bool:
+        """All recognitions are read to answer the request."""
+        return (
+            since_sentence < 0 and limit is None and with_sentences
+        ) or recognition_store.is_result_loaded(self.report)
+
+    def __select_recognitions(
+        self, since_sentence: int, limit: int | None, with_sentences: bool
+    ) -> list[RecognitionInfo]:
+        recognitions = (r for r in self.__recognitions if r.sentence_number > since_sentence)
+        return self.__build_recognitions(islice(recognitions, limit), with_sentences)
+
+    def __build_recognitions(
+        self, recognitions: Iterable[StoredRecognition], with_sentences: bool
+    ) -> list[RecognitionInfo]:
+        return [
+            RecognitionInfo(
+                r.id, self.report.pk, r.sentence if with_sentences else None, r.probability, r.sentence_number
+            )
+            for r in recognitions
+        ]
+
+    def get_etag(self, progress: ReportProgressInfo, variant: str = '') -> str:
+        """
+            Weak entity tag of the report info, it changes with the status, the queue place and the recognitions.
+            Recognitions are written once, when the report is finished, so the finish time is their version.
+            The variant distinguishes different representations of the report, for example parts of recognitions.
+        """
+        end_dttm = self.report.calculation_end_dttm.isoformat() if self.report.calculation_end_dttm else ''
+        tag = f'{self.report.pk}-{progress.status.value}-{progress.queue_place or 0}-{end_dttm}'
+        if variant:
+            tag = f'{tag}-{sha1(variant.encode()).hexdigest()[:16]}'
+        return f'W/"{tag}"'
+
+    def get_report_info(
+        self,
+        progress: ReportProgressInfo | None = None,
+        since_sentence: int = -1,
+        limit: int | None = None,
+        omit: set[str] | None = None,
+    ) -> ReportInfo:
+        """
+            Full report info. Recognitions can be fetched in parts with the since_sentence cursor and limit,
+            the text, sentences of recognitions and recognitions themselves can be omitted.
+        """
+        omit = omit or set()
+        if progress is None:
+            progress = self.get_progress_info()
+        if 'recognitions' in omit:
+            recognitions = []
+        else:
+            recognitions = self.get_recognitions(since_sentence, limit, 'sentence' not in omit)
+        return self.__build_report_info(progress, recognitions, omit)
+
+    async def aget_report_info(
+        self,
+        progress: ReportProgressInfo | None = None,
+        since_sentence: int = -1,
+        limit: int | None = None,
+        omit: set[str] | None = None,
+    ) -> ReportInfo:
+        """Same as get_report_info with the async ORM."""
+        omit = omit or set()
+        if progress is None:
+            progress = await self.aget_progress_info()
+        if 'recognitions' in omit:
+            recognitions = []
+        else:
+            recognitions = await self.aget_recognitions(since_sentence, limit, 'sentence' not in omit)
+        return self.__build_report_info(progress, recognitions, omit)
+
+    def __build_report_info(
+        self, progress: ReportProgressInfo, recognitions: list[RecognitionInfo], omit: set[str]
+    ) -> ReportInfo:
+        return ReportInfo(
+            id=self.report.pk,
+            text=None if 'text' in omit else self.report.text,
+            status=progress.status,
+            user=self.report.user_id,
+            queue_place=progress.queue_place,
+            expected_start_dttm=progress.expected_start_dttm,
+            expected_end_dttm=progress.expected_end_dttm,
+            recognitions=recognitions,
+            urls=self.__get_urls(),
+        )
+
+    def __check_owner(self, user: User | None) -> Self:
+        if user is not None and self.report.user_id != user.pk:
+            raise ReportDoesNotExist(f'The report {self.report.pk} does not exist')
+        return self
+
+    def __get_urls(self) -> ReportUrls:
+        return get_report_urls(self.report.pk)
+
+
+def get_report_urls(report_id: int) -> ReportUrls:
+    return ReportUrls(
+        reverse('web_app:report', kwargs={'report_id': report_id}),
+        reverse('report:detail', kwargs={'report_id': report_id}),
+    )
+
+
+def encode_cursor(create_dttm: datetime, report_id: int) -> str:
+    """Opaque cursor of the position in the list of reports."""
+    return base64.urlsafe_b64encode(f'{create_dttm.isoformat()}|{report_id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Position of the cursor, the cursor is invalid if it is not made by encode_cursor."""
+    try:
+        create_dttm, report_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        position = datetime.fromisoformat(create_dttm), int(report_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidReportCursor(f'Invalid cursor {cursor}')
+    if timezone.is_naive(position[0]):
+        raise InvalidReportCursor(f'Invalid cursor {cursor}')
+    return position
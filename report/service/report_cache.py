@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+
+from django.core.cache import BaseCache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from ..models import Report
+from .recognition_store import StoredRecognition
+
+
+@dataclass()
+class CachedReport:
+    report: Report
+    recognitions: list[StoredRecognition]
+
+
+class CompletedReportCache:
+    """
+        Cache of completed reports with their recognitions, a completed report never changes,
+        so entries are not invalidated. The least recently used reports are evicted by the cache backend.
+    """
+    def __init__(self, cache: BaseCache) -> None:
+        self.__cache = cache
+
+    def get(self, report_id: int) -> CachedReport | None:
+        return self.__cache.get(self.__get_key(report_id))
+
+    async def aget(self, report_id: int) -> CachedReport | None:
+        """Same as get, the local memory cache is read in the event loop without a thread."""
+        if isinstance(self.__cache, LocMemCache):
+            return self.get(report_id)
+        return await self.__cache.aget(self.__get_key(report_id))
+
+    def store(self, report: Report, recognitions: list[StoredRecognition]) -> None:
+        """Cache the completed report, other reports are ignored."""
+        if report.status == Report.ReportStatus.COMPLETED:
+            self.__cache.set(self.__get_key(report.pk), self.__build(report, recognitions))
+
+    async def astore(self, report: Report, recognitions: list[StoredRecognition]) -> None:
+        """Same as store, the local memory cache is written in the event loop without a thread."""
+        if report.status != Report.ReportStatus.COMPLETED:
+            return
+        if isinstance(self.__cache, LocMemCache):
+            self.store(report, recognitions)
+        else:
+            await self.__cache.aset(self.__get_key(report.pk), self.__build(report, recognitions))
+
+    @staticmethod
+    def __build(report: Report, recognitions: list[StoredRecognition]) -> CachedReport:
+        cached_report = Report.from_db(
+            report._state.db, None, [getattr(report, field.attname) for field in Report._meta.concrete_fields]
+        )
+        return CachedReport(cached_report, recognitions)
+
+    @staticmethod
+    def __get_key(report_id: int) -> str:
+        return f'report:{report_id}'
+
+
+completed_report_cache = CompletedReportCache(caches['reports'])
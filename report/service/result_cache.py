@@ -0,0 +1,151 @@
+from hashlib import sha256
+
+from django.db import transaction
+from django.utils import timezone
+
+from common.settings import REPORT_RESULT_CACHE
+from ..models import Report
+from .admission import admission_controller
+from .queue import ReportQueue
+from .recognition_store import StoredRecognition, recognition_store
+
+
+def normalize_text(text: str) -> str:
+    """Text with collapsed whitespaces, identical texts have the same normalized text."""
+    return ' '.join(text.split())
+
+
+def get_text_hash(text: str) -> str:
+    return sha256(normalize_text(text).encode()).hexdigest()
+
+
+def get_model_version() -> str | None:
+    """Model version of the last completed report."""
+    return (
+        Report.objects
+        .filter(status=Report.ReportStatus.COMPLETED, calculation_end_dttm__isnull=False)
+        .order_by('-calculation_end_dttm')
+        .values_list('model_version', flat=True)
+        .first()
+    )
+
+
+class ReportResultCache:
+    """
+        Cache of report results keyed on the normalized text hash and the model version.
+        A new report with the text of a completed report is completed immediately by copying its recognitions.
+        A new report with the text of a report in the queue or in process is attached to it as a duplicate,
+        the duplicates are not calculated and are completed together with the source report.
+    """
+    def __init__(self, enabled: bool) -> None:
+        self.__enabled = enabled
+
+    def save_report(self, report: Report) -> None:
+        """Save the new report, completing it from the cache or attaching it to the same report in process."""
+        self.save_reports([report])
+
+    def save_reports(self, reports: list[Report]) -> None:
+        """
+            Save the new reports with batched queries.
+            Reports with the same text in the list are attached to the first of them.
+            Reports going to the queue pass the admission control, nothing is saved if they are rejected.
+        """
+        for report in reports:
+            report.text_hash = get_text_hash(report.text)
+        hashes = {report.text_hash for report in reports}
+        completed = self.__get_completed(hashes) if self.__enabled else {}
+        in_flight = self.__get_in_flight(hashes) if self.__enabled else {}
+        sources: dict[str, Report] = {}
+        queued, attached, cached = [], [], []
+        now = timezone.now()
+        for report in reports:
+            source = completed.get(report.text_hash)
+            if source is not None:
+                report.status = Report.ReportStatus.COMPLETED
+                report.model_version = source.model_version
+                report.calculation_start_dttm = report.calculation_end_dttm = now
+                cached.append(report)
+            elif report.text_hash in in_flight:
+                report.duplicate_of_id = in_flight[report.text_hash]
+                cached.append(report)
+            elif self.__enabled and report.text_hash in sources:
+                attached.append(report)
+            else:
+                sources[report.text_hash] = report
+                queued.append(report)
+        if queued:
+            admission_controller.check(len(queued))
+        with transaction.atomic():
+            ReportQueue.number(queued)
+            Report.objects.bulk_create(queued + cached)
+            for report in attached:
+                report.duplicate_of = sources[report.text_hash]
+            Report.objects.bulk_create(attached)
+            self.__copy_cached(completed, [report for report in cached if report.duplicate_of_id is None])
+
+    def complete_duplicates(self, report: Report, recognitions: list[StoredRecognition]) -> None:
+        """Complete reports attached to the completed report with its recognitions."""
+        duplicates = list(
+            Report.objects.filter(duplicate_of=report, status=Report.ReportStatus.WAITING).only('id', 'text')
+        )
+        if not duplicates:
+            return
+        Report.objects.filter(pk__in=[duplicate.pk for duplicate in duplicates]).update(
+            status=Report.ReportStatus.COMPLETED,
+            model_version=report.model_version,
+            calculation_start_dttm=report.calculation_start_dttm,
+            calculation_end_dttm=report.calculation_end_dttm,
+        )
+        recognition_store.save([(duplicate, recognitions) for duplicate in duplicates])
+
+    @staticmethod
+    def release_duplicates(report: Report) -> None:
+        """Return to the queue reports attached to the failed report, they will be calculated separately."""
+        Report.objects.filter(duplicate_of=report, status=Report.ReportStatus.WAITING).update(
+            duplicate_of=None, queue_number=report.queue_number, priority=report.priority
+        )
+
+    @staticmethod
+    def __get_completed(hashes: set[str]) -> dict[str, Report]:
+        """Completed reports with the texts calculated by the current model version."""
+        model_version = get_model_version()
+        if model_version is None:
+            return {}
+        return {
+            report.text_hash: report
+            for report in (
+                Report.objects
+                .filter(text_hash__in=hashes, status=Report.ReportStatus.COMPLETED, model_version=model_version)
+                .order_by('-id')
+                .only('id', 'text', 'text_hash', 'model_version')
+            )
+        }
+
+    @staticmethod
+    def __get_in_flight(hashes: set[str]) -> dict[str, int]:
+        """First reports with the texts in the queue or in process."""
+        return {
+            text_hash: report_id
+            for text_hash, report_id in (
+                Report.objects
+                .filter(
+                    text_hash__in=hashes,
+                    status__in=[Report.ReportStatus.WAITING, Report.ReportStatus.IN_PROCESS],
+                    duplicate_of__isnull=True,
+                )
+                .order_by('-create_dttm', '-id')
+                .values_list('text_hash', 'id')
+            )
+        }
+
+    def __copy_cached(self, completed: dict[str, Report], reports: list[Report]) -> None:
+        """Copy the recognitions of the completed reports to the reports with the same texts."""
+        if not reports:
+            return
+        recognitions = recognition_store.load_many([completed[report.text_hash] for report in reports])
+        recognition_store.save([
+            (report, recognitions.get(completed[report.text_hash].pk, [])) for report in reports
+        ])
+
+
+report_result_cache = ReportResultCache(REPORT_RESULT_CACHE)
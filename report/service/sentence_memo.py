@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import timedelta
+from threading import Lock
+import time
+
+from django.utils import timezone
+
+from ..models import SentenceRecognition
+from .model_client import ModelResponse, Recognition
+from .result_cache import get_text_hash, get_model_version
+
+
+@dataclass()
+class SentenceLookup:
+    """Result of the memo lookup for the sentences of one text."""
+    text: str
+    sentences: list[str]
+    version: str | None
+    known: dict[int, Recognition] = field(default_factory=dict)
+
+    @property
+    def missed(self) -> list[str]:
+        return [sentence for index, sentence in enumerate(self.sentences) if index not in self.known]
+
+    def merge(self, response: ModelResponse) -> bool:
+        """
+            Add the model response for the missed sentences.
+            Returns False if the response is made by another model version than the known recognitions.
+        """
+        if self.known and response.version != self.version:
+            return False
+        missed = [index for index in range(len(self.sentences)) if index not in self.known]
+        self.known.update(zip(missed, response.recognition))
+        self.version = response.version
+        return True
+
+    def build_response(self) -> ModelResponse:
+        return ModelResponse(
+            version=self.version,
+            source_text=self.text,
+            recognition=[self.known[index] for index in range(len(self.sentences))],
+            recognition_time='',
+        )
+
+
+class SentenceMemo:
+    """
+        Store of sentence recognitions keyed on the sentence hash and the model version.
+        The in-process tier is an LRU of max_size entries, the DB tier is the SentenceRecognition table.
+        Entries of both tiers expire after ttl seconds.
+        The model version is trusted for version_ttl seconds after it is read or returned by the model,
+        then the next text is sent to the model to learn the current version.
+    """
+    def __init__(self, max_size: int, ttl: float, version_ttl: float) -> None:
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__version_ttl = version_ttl
+        self.__entries: OrderedDict[tuple[str, str], tuple[Recognition, float]] = OrderedDict()
+        self.__lock = Lock()
+        self.__version: str | None = None
+        self.__version_time: float | None = None
+        self.__evict_time = time.monotonic()
+
+    def lookup(self, text: str, sentences: list[str]) -> SentenceLookup:
+        """Find recognitions of the sentences made by the current model version."""
+        lookup = SentenceLookup(text, sentences, self.__get_version())
+        if lookup.version is None:
+            return lookup
+        hashes = [get_text_hash(sentence) for sentence in sentences]
+        missed: dict[str, list[int]] = {}
+        now = time.monotonic()
+        with self.__lock:
+            for index, sentence_hash in enumerate(hashes):
+                entry = self.__entries.get((sentence_hash, lookup.version))
+                if entry is not None and entry[1] > now:
+                    self.__entries.move_to_end((sentence_hash, lookup.version))
+                    lookup.known[index] = entry[0].copy(update={'sentence': sentences[index]})
+                else:
+                    missed.setdefault(sentence_hash, []).append(index)
+        if not missed:
+            return lookup
+        stored = SentenceRecognition.objects.filter(
+            sentence_hash__in=list(missed),
+            model_version=lookup.version,
+            create_dttm__gte=timezone.now() - timedelta(seconds=self.__ttl),
+        )
+        for stored_recognition in stored:
+            for index in missed[stored_recognition.sentence_hash]:
+                lookup.known[index] = Recognition(
+                    sentence=sentences[index],
+                    is_paraphrase=stored_recognition.is_paraphrase,
+                    probability=stored_recognition.probability,
+                )
+                self.__remember(stored_recognition.sentence_hash, lookup.version, lookup.known[index])
+        return lookup
+
+    def store(self, version: str, sentences: list[str], recognitions: list[Recognition]) -> None:
+        """Save the model recognitions of the sentences."""
+        self.__version = version
+        self.__version_time = time.monotonic()
+        hashes = [get_text_hash(sentence) for sentence in sentences]
+        for sentence_hash, recognition in zip(hashes, recognitions):
+            self.__remember(sentence_hash, version, recognition)
+        SentenceRecognition.objects.bulk_create(
+            [
+                SentenceRecognition(
+                    sentence_hash=sentence_hash,
+                    model_version=version,
+                    is_paraphrase=recognition.is_paraphrase,
+                    probability=recognition.probability,
+                    create_dttm=timezone.now(),
+                )
+                for sentence_hash, recognition in dict(zip(hashes, recognitions)).items()
+            ],
+            update_conflicts=True,
+            unique_fields=['sentence_hash', 'model_version'],
+            update_fields=['is_paraphrase', 'probability', 'create_dttm'],
+        )
+        self.__evict_expired()
+
+    def __get_version(self) -> str | None:
+        """Current model version, None once it is older than version_ttl."""
+        if self.__version_time is None:
+            self.__version = get_model_version()
+            self.__version_time = time.monotonic()
+        if time.monotonic() - self.__version_time > self.__version_ttl:
+            return None
+        return self.__version
+
+    def __remember(self, sentence_hash: str, version: str, recognition: Recognition) -> None:
+        with self.__lock:
+            self.__entries[(sentence_hash, version)] = (recognition, time.monotonic() + self.__ttl)
+            self.__entries.move_to_end((sentence_hash, version))
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def __evict_expired(self) -> None:
+        if time.monotonic() - self.__evict_time < min(self.__ttl, 3600):
+            return
+        self.__evict_time = time.monotonic()
+        SentenceRecognition.objects.filter(create_dttm__lt=timezone.now() - timedelta(seconds=self.__ttl)).delete()
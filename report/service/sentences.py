@@ -0,0 +1,39 @@
+from bisect import bisect_left
+import re
+
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split the text into sentences by the end punctuation."""
+    return [sentence for sentence in (s.strip() for s in SENTENCE_END.split(text)) if sentence]
+
+
+def split_chunks(text: str, max_size: int) -> list[str]:
+    """
+        Split the text into chunks of whole sentences of up to max_size characters,
+        a sentence longer than max_size is a chunk itself.
+    """
+    chunks: list[str] = []
+    for sentence in split_sentences(text):
+        if chunks and len(chunks[-1]) + len(sentence) + 1 <= max_size:
+            chunks[-1] = f'{chunks[-1]} {sentence}'
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+def join_chunks(chunks: list[str], count: int) -> list[str]:
+    """Join consecutive chunks into count chunks of about the same size, count is at most the number of chunks."""
+    total = sum(len(chunk) for chunk in chunks)
+    middles, start = [], 0
+    for chunk in chunks:
+        middles.append(start + len(chunk) / 2)
+        start += len(chunk)
+    bounds = [0]
+    for group in range(1, count):
+        index = bisect_left(middles, total * group / count)
+        bounds.append(min(max(index, bounds[-1] + 1), len(chunks) - count + group))
+    bounds.append(len(chunks))
+    return [' '.join(chunks[start:end]) for start, end in zip(bounds, bounds[1:])]
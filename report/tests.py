@@ -1,3 +1,1334 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+from uuid import UUID
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from common.api_utils import json_bad_request
+from common.asgi import LongLivedASGIHandler
+from common.renderers import FastJSONRenderer
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .management.commands.stub_model import StubModelOptions, StubModelServer
+from .models import CalculationShare, Report, ReportLog, ReportRecognition, ReportResult, SentenceRecognition
+from .service.admission import AdmissionController
+from .service.estimator import CompletionEstimate, DurationModel
+from .service.exceptions import InvalidReportCursor, ReportDoesNotExist, ReportQueueOverloaded
+from .service.async_engine import AsyncReportCalculationManager
+from .service.balancing import BALANCERS, Balancer, get_ewma_score
+from .service.batching import SentenceBatcher
+from .service.calculation_manager import ReportCalculationManager, Worker
+from .service.chunking import TextChunker, merge_responses
+from .service.hosts import CircuitBreaker, CircuitState, ConcurrencyLimit, HostStats, ModelHost
+from .service.model_client import ModelClientOptions, ModelHostClient, ModelResponse, Recognition
+from .service.progress import ReportProgressStream
+from .service.queue import ReportQueue
+from .service.recognition_store import RecognitionStore, StoredRecognition, recognition_store
+from .service.report import ReportManager, ReportStatus, decode_cursor, encode_cursor
+from .service.result_cache import ReportResultCache, get_model_version, get_text_hash
+from .service.sentence_memo import SentenceMemo
+from .service.sentences import join_chunks, split_chunks, split_sentences
+
+
+FULL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on "?report_report'),
+    'sqlite': re.compile(r'SCAN report_report(?!\w| USING)', re.MULTILINE),
+}
+SORT = {
+    'postgresql': re.compile(r'Sort\b'),
+    'sqlite': re.compile(r'TEMP B-TREE FOR ORDER BY'),
+}
+
+
+def create_reports(user: User, count: int, status: str = Report.ReportStatus.COMPLETED) -> list[Report]:
+    now = timezone.now()
+    return Report.objects.bulk_create([
+        Report(
+            text=f'Report {i}. ' * 20,
+            status=status,
+            user=user,
+            create_dttm=now - timedelta(minutes=i),
+            calculation_end_dttm=now if status == Report.ReportStatus.COMPLETED else None,
+            model_version='1',
+        )
+        for i in range(count)
+    ])
+
+
+def create_recognitions(report: Report, count: int) -> None:
+    ReportRecognition.objects.bulk_create([
+        ReportRecognition(report=report, sentence=f'Sentence {i}.', is_paraphrase=False, probability=0.1,
+                          sentence_number=i)
+        for i in range(count)
+    ])
+
+
+def enqueue_reports(user: User, count: int) -> list[Report]:
+    reports = [
+        Report(text=f'Queued report {i} of {user.username}.', user=user, status=Report.ReportStatus.WAITING,
+               create_dttm=timezone.now())
+        for i in range(count)
+    ]
+    with transaction.atomic():
+        ReportQueue.number(reports)
+        return Report.objects.bulk_create(reports)
+
+
+class ReportQueueTest(TestCase):
+    """Reports are claimed from the queue one per worker slot and returned to it on failures."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.reports = enqueue_reports(cls.user, 3)
+
+    def test_claim(self) -> None:
+        queue = ReportQueue(claim_timeout=60)
+        report = queue.claim('host#0')
+        self.assertEqual(report.pk, self.reports[0].pk)
+        self.assertIsNone(queue.claim('host#0'))
+        self.assertEqual(queue.claim('host#1').pk, self.reports[1].pk)
+        claimed = Report.objects.get(pk=report.pk)
+        self.assertEqual((claimed.status, claimed.claim_owner), (Report.ReportStatus.IN_PROCESS, 'host#0'))
+        self.assertEqual(ReportQueue.get_busy_owners(['host#0', 'host#2']), {'host#0'})
+
+    def test_finish(self) -> None:
+        queue = ReportQueue(claim_timeout=60)
+        report = queue.claim('host#0')
+        self.assertFalse(queue.finish(report, 'host#1', Report.ReportStatus.COMPLETED))
+        self.assertTrue(queue.finish(report, 'host#0', Report.ReportStatus.COMPLETED, model_version='1'))
+        finished = Report.objects.get(pk=report.pk)
+        self.assertEqual((finished.status, finished.model_version), (Report.ReportStatus.COMPLETED, '1'))
+        self.assertIsNotNone(finished.calculation_end_dttm)
+        self.assertEqual(queue.claim('host#0').pk, self.reports[1].pk)
+
+    def test_requeue(self) -> None:
+        queue = ReportQueue(claim_timeout=60, max_attempts=2)
+        report = queue.claim('host#0')
+        self.assertFalse(queue.requeue(report, 'host#1'))
+        self.assertTrue(queue.requeue(report, 'host#0'))
+        self.assertEqual(Report.objects.get(pk=report.pk).status, Report.ReportStatus.WAITING)
+        report = queue.claim('host#1')
+        self.assertEqual((report.pk, report.calculation_attempts), (self.reports[0].pk, 2))
+        self.assertFalse(queue.requeue(report, 'host#1'))
+        self.assertEqual(Report.objects.get(pk=report.pk).status, Report.ReportStatus.IN_PROCESS)
+
+    def test_requeue_stale(self) -> None:
+        queue = ReportQueue(claim_timeout=60)
+        stale, fresh = queue.claim('host#0'), queue.claim('host#1')
+        Report.objects.filter(pk=stale.pk).update(claim_dttm=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(queue.requeue_stale(), 1)
+        self.assertEqual(
+            list(Report.objects.filter(pk__in=[stale.pk, fresh.pk]).order_by('id').values_list('status', 'claim_owner')),
+            [(Report.ReportStatus.WAITING, None), (Report.ReportStatus.IN_PROCESS, 'host#1')],
+        )
+        self.assertEqual(queue.claim('host#0').pk, stale.pk)
+
+    def test_dead_owner(self) -> None:
+        queue = ReportQueue(claim_timeout=60)
+        dead, live = queue.claim('host#0@dead'), queue.claim('host#0@live')
+        Report.objects.filter(pk__in=[dead.pk, live.pk]).update(claim_dttm=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(queue.heartbeat(['host#0@live', 'host#1@live']), 1)
+        self.assertEqual(queue.requeue_stale(), 1)
+        self.assertEqual(Report.objects.get(pk=live.pk).claim_owner, 'host#0@live')
+        self.assertEqual(queue.claim('host#0@restarted').pk, dead.pk)
+
+
+class ReportResultCacheTest(TestCase):
+    """Reports with the text of another report are completed from its results instead of being calculated."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.other_user = User.objects.create_user('other', password='password')
+        cls.recognitions = [StoredRecognition(None, f'Sentence {i}.', i % 2 == 0, 0.5, i) for i in range(3)]
+
+    def setUp(self) -> None:
+        caches['reports'].clear()
+        self.cache = ReportResultCache(enabled=True)
+
+    def save(self, user: User, *texts: str) -> list[Report]:
+        reports = [
+            Report(text=text, user=user, status=Report.ReportStatus.WAITING, create_dttm=timezone.now())
+            for text in texts
+        ]
+        self.cache.save_reports(reports)
+        return reports
+
+    def complete(self, report: Report, model_version: str = '1') -> None:
+        report.status, report.model_version = Report.ReportStatus.COMPLETED, model_version
+        report.calculation_start_dttm = report.calculation_end_dttm = timezone.now()
+        report.save()
+        recognition_store.save([(report, self.recognitions)])
+
+    @staticmethod
+    def get_sentences(report: Report) -> list[str]:
+        return [recognition.sentence for recognition in recognition_store.load(report)]
+
+    def test_attach(self) -> None:
+        source, same = self.save(self.user, 'Same text.', 'Same  text. ')
+        duplicate = self.save(self.other_user, ' Same text.')[0]
+        self.assertIsNotNone(source.queue_number)
+        self.assertEqual((same.duplicate_of_id, duplicate.duplicate_of_id), (source.pk, source.pk))
+        self.assertEqual(ReportQueue.get_place(duplicate.pk), ReportQueue.get_place(source.pk))
+        self.assertEqual(ReportQueue(claim_timeout=60).claim('host#0').pk, source.pk)
+        self.assertIsNone(ReportQueue(claim_timeout=60).claim('host#1'))
+
+    def test_copy_completed(self) -> None:
+        self.complete(self.save(self.user, 'Same text.')[0])
+        report = Report.objects.get(pk=self.save(self.other_user, 'Same text.')[0].pk)
+        self.assertEqual((report.status, report.model_version), (Report.ReportStatus.COMPLETED, '1'))
+        self.assertIsNone(report.duplicate_of_id)
+        self.assertEqual(self.get_sentences(report), ['Sentence 0.', 'Sentence 1.', 'Sentence 2.'])
+
+    def test_model_version(self) -> None:
+        self.complete(self.save(self.user, 'Same text.')[0], model_version='1')
+        self.complete(self.save(self.user, 'Other text.')[0], model_version='2')
+        report = Report.objects.get(pk=self.save(self.other_user, 'Same text.')[0].pk)
+        self.assertEqual(report.status, Report.ReportStatus.WAITING)
+        self.assertIsNone(report.duplicate_of_id)
+        self.assertIsNotNone(report.queue_number)
+
+    def test_complete_duplicates(self) -> None:
+        source, duplicate = self.save(self.user, 'Same text.', 'Same text.')
+        self.complete(source)
+        self.cache.complete_duplicates(source, self.recognitions)
+        duplicate = Report.objects.get(pk=duplicate.pk)
+        self.assertEqual((duplicate.status, duplicate.model_version), (Report.ReportStatus.COMPLETED, '1'))
+        self.assertEqual(duplicate.calculation_end_dttm, source.calculation_end_dttm)
+        self.assertEqual(self.get_sentences(duplicate), ['Sentence 0.', 'Sentence 1.', 'Sentence 2.'])
+
+    def test_release_duplicates(self) -> None:
+        self.save(self.user, 'First text.')
+        source, duplicate = self.save(self.user, 'Same text.', 'Same text.')
+        Report.objects.filter(pk=source.pk).update(status=Report.ReportStatus.ERROR)
+        self.cache.release_duplicates(source)
+        duplicate = Report.objects.get(pk=duplicate.pk)
+        self.assertEqual((duplicate.status, duplicate.duplicate_of_id), (Report.ReportStatus.WAITING, None))
+        self.assertEqual((duplicate.queue_number, duplicate.priority), (source.queue_number, source.priority))
+        self.assertEqual(ReportQueue.get_place(duplicate.pk), 2)
+
+    def test_requeue_stale(self) -> None:
+        source, duplicate = self.save(self.user, 'Same text.', 'Same text.')
+        Report.objects.filter(pk=source.pk).update(status=Report.ReportStatus.COMPLETED)
+        ReportQueue(claim_timeout=60).requeue_stale()
+        duplicate = Report.objects.get(pk=duplicate.pk)
+        self.assertEqual((duplicate.duplicate_of_id, duplicate.queue_number), (None, source.queue_number))
+        self.assertEqual(ReportQueue(claim_timeout=60).claim('host#0').pk, duplicate.pk)
+
+
+class FairQueueTest(TestCase):
+    """Reports of users are interleaved by weighted fair queuing, priority users go first."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.first_user = User.objects.create_user('first', password='password')
+        cls.second_user = User.objects.create_user('second', password='password')
+        cls.first_reports = enqueue_reports(cls.first_user, 4)
+        cls.second_reports = enqueue_reports(cls.second_user, 2)
+        first, second = cls.first_reports, cls.second_reports
+        cls.order = [first[0].pk, first[1].pk, second[0].pk, first[2].pk, second[1].pk, first[3].pk]
+
+    @staticmethod
+    def claim_all(queue: ReportQueue) -> list[int]:
+        claimed = []
+        while (report := queue.claim(f'host#{len(claimed)}')) is not None:
+            claimed.append(report.pk)
+        return claimed
+
+    def test_order(self) -> None:
+        self.assertEqual(
+            [ReportQueue.get_place(report_id) for report_id in self.order], list(range(1, len(self.order) + 1))
+        )
+        self.assertEqual(self.claim_all(ReportQueue(claim_timeout=60)), self.order)
+
+    def test_weight(self) -> None:
+        user = User.objects.create_user('weighted', password='password')
+        CalculationShare.objects.create(user=user, weight=2)
+        reports = enqueue_reports(user, 2)
+        self.assertEqual([report.queue_number for report in reports], [1500, 2000])
+        self.assertEqual(
+            self.claim_all(ReportQueue(claim_timeout=60)),
+            [self.order[0], reports[0].pk, *self.order[1:3], reports[1].pk, *self.order[3:]],
+        )
+
+    def test_priority(self) -> None:
+        user = User.objects.create_user('priority', password='password')
+        CalculationShare.objects.create(user=user, priority=1)
+        report = enqueue_reports(user, 1)[0]
+        self.assertEqual(ReportQueue.get_place(report.pk), 1)
+        self.assertEqual(ReportQueue.get_place(self.order[0]), 2)
+        self.assertEqual(self.claim_all(ReportQueue(claim_timeout=60)), [report.pk, *self.order])
+
+    def test_place_skewed(self) -> None:
+        """Places are exact in a queue longer than one index page with a bulk user and many small users."""
+        enqueue_reports(User.objects.create_user('bulk', password='password'), 250)
+        for i in range(10):
+            enqueue_reports(User.objects.create_user(f'small-{i}', password='password'), 30)
+        order = list(
+            Report.objects
+            .filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True)
+            .order_by('-priority', 'queue_number', 'id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(len(order), 556)
+        for place in (1, 201, 301, 401, 501, 556):
+            self.assertEqual(ReportQueue.get_place(order[place - 1]), place)
+
+    def test_max_in_process(self) -> None:
+        queue = ReportQueue(claim_timeout=60, max_in_process=1)
+        self.assertEqual(self.claim_all(queue), [self.first_reports[0].pk, self.second_reports[0].pk])
+        CalculationShare.objects.create(user=self.first_user, max_in_process=2)
+        self.assertEqual(queue.claim('host#2').pk, self.first_reports[1].pk)
+        self.assertIsNone(queue.claim('host#3'))
+        queue.finish(Report.objects.get(pk=self.second_reports[0].pk), 'host#1', Report.ReportStatus.COMPLETED)
+        self.assertEqual(queue.claim('host#1').pk, self.second_reports[1].pk)
+
+
+class AdmissionTest(TestCase):
+    """New reports are rejected with the time to retry when the queue would wait longer than the limit."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.reports = enqueue_reports(cls.user, 2)
+        Report.objects.filter(pk=cls.reports[0].pk).update(text_hash=get_text_hash(cls.reports[0].text))
+
+    @staticmethod
+    def create_controller(max_queue: int = 0, max_wait: float = 60) -> AdmissionController:
+        return AdmissionController(max_queue, max_wait, rate_window=60, slots=1, default_duration=30)
+
+    def test_default_rate(self) -> None:
+        controller = self.create_controller()
+        with self.assertRaises(ReportQueueOverloaded) as context:
+            controller.check()
+        self.assertEqual(context.exception.retry_after, 30)
+
+    def test_drain_rate(self) -> None:
+        Report.objects.bulk_create([
+            Report(text=f'Calculated report {i}.', user=self.user, status=Report.ReportStatus.COMPLETED,
+                   create_dttm=timezone.now(), claim_owner=f'host#{i}', calculation_end_dttm=timezone.now())
+            for i in range(6)
+        ])
+        controller = self.create_controller()
+        controller.check(4)
+        with self.assertRaises(ReportQueueOverloaded) as context:
+            controller.check()
+        self.assertEqual(context.exception.retry_after, 10)
+        self.assertEqual(controller.get_load().depth, 6)
+
+    def test_empty_queue(self) -> None:
+        Report.objects.filter(pk__in=[report.pk for report in self.reports]).update(status=Report.ReportStatus.ERROR)
+        self.create_controller(max_queue=1).check(3)
+
+    def test_too_many_requests(self) -> None:
+        self.client.force_login(self.user)
+        with mock.patch('report.service.result_cache.admission_controller', self.create_controller(max_queue=2)):
+            response = self.client.post(reverse('report:list'), {'text': 'A new report.'}, 'application/json')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertEqual(response.json()['data']['retry_after'], 30)
+            self.assertFalse(Report.objects.filter(text='A new report.').exists())
+            report = ReportManager.create(self.reports[0].text, self.user).report
+            self.assertEqual(report.duplicate_of_id, self.reports[0].pk)
+
+
+class ReportBulkTest(TestCase):
+    """Reports are created in bulk in the order of the texts, the whole batch is rejected by the admission control."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+        patcher = mock.patch('report.service.report.calculation_manager')
+        self.calculation_manager = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data) -> HttpResponse:
+        return self.client.post(reverse('report:bulk'), data, 'application/json')
+
+    def test_created(self) -> None:
+        texts = ['Second text.', 'First text.', 'Second  text.', 'Third text.']
+        response = self.post({'texts': texts})
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['data']
+        reports = Report.objects.in_bulk([item['id'] for item in created])
+        self.assertEqual([reports[item['id']].text for item in created], texts)
+        self.assertEqual({item['status'] for item in created}, {ReportStatus.WAITING})
+        self.assertEqual(created[0]['urls']['api'], reverse('report:detail', args=[created[0]['id']]))
+        self.assertEqual(reports[created[2]['id']].duplicate_of_id, created[0]['id'])
+        self.assertEqual(self.calculation_manager.calculate.call_count, 4)
+
+    def test_bad_request(self) -> None:
+        for data in [['First text.'], json.dumps('First text.'), {}, {'texts': []}, {'texts': [1, 'A' * 10001]}]:
+            with self.subTest(data=data):
+                response = self.post(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['message'], 'JSON body validation error')
+        self.assertEqual(self.post('{"texts": [').status_code, 400)
+        self.assertFalse(Report.objects.exists())
+        self.calculation_manager.calculate.assert_not_called()
+
+    def test_too_many_requests(self) -> None:
+        enqueue_reports(self.user, 2)
+        controller = AdmissionController(2, 0, rate_window=60, slots=1, default_duration=30)
+        with mock.patch('report.service.result_cache.admission_controller', controller):
+            response = self.post({'texts': ['First text.', 'Second text.', 'Third text.']})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(Report.objects.count(), 2)
+        self.calculation_manager.calculate.assert_not_called()
+
+
+class AsyncReportViewTest(TestCase):
+    """Async report views answer in the event loop with the same authentication and error responses."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.other_user = User.objects.create_user('other', password='password')
+        cls.reports = create_reports(cls.user, 3)
+        create_recognitions(cls.reports[0], 3)
+
+    def setUp(self) -> None:
+        caches['reports'].clear()
+        patcher = mock.patch('report.service.report.calculation_manager', mock.Mock(
+            aget_queue_place=mock.AsyncMock(return_value=1),
+            estimate_completion=mock.Mock(return_value=CompletionEstimate(None, None)),
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def login(self, user: User) -> None:
+        await sync_to_async(self.async_client.force_login)(user)
+
+    async def test_detail(self) -> None:
+        await self.login(self.user)
+        url = reverse('report:detail', args=[self.reports[0].pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual((data['id'], data['status'], len(data['recognitions'])), (self.reports[0].pk, 'COMPLETED', 3))
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(url, {'since_sentence': 1})
+        self.assertEqual([r['sentence'] for r in response.json()['data']['recognitions']], ['Sentence 2.'])
+
+    async def test_detail_errors(self) -> None:
+        url = reverse('report:detail', args=[self.reports[0].pk])
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        await self.login(self.other_user)
+        response = await self.async_client.get(url)
+        self.assertEqual((response.status_code, response.json()['errors']), (404, ['DoesNotExist']))
+        await self.login(self.user)
+        self.assertEqual((await self.async_client.get(url, {'limit': 0})).status_code, 400)
+        self.assertEqual((await self.async_client.get(reverse('report:detail', args=[0]))).status_code, 404)
+        self.assertEqual((await self.async_client.put(url)).status_code, 405)
+
+    async def test_list(self) -> None:
+        url = reverse('report:list')
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        await self.login(self.user)
+        response = await self.async_client.get(url, {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()['data']
+        self.assertEqual([report['id'] for report in page['reports']], [report.pk for report in self.reports[:2]])
+        response = await self.async_client.get(url, {'limit': 2, 'cursor': page['next_cursor']})
+        self.assertEqual([report['id'] for report in response.json()['data']['reports']], [self.reports[2].pk])
+        response = await self.async_client.get(url, {'status': 'UNKNOWN'})
+        self.assertEqual(response.json()['message'], 'Query parameters validation error')
+
+    async def test_create(self) -> None:
+        url = reverse('report:list')
+        self.assertEqual((await self.async_client.post(url, {'text': 'New report.'})).status_code, 403)
+        await self.login(self.user)
+        response = await self.async_client.post(url, {'text': 'New report.'}, 'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['status'], 'WAITING')
+        self.assertTrue(await Report.objects.filter(pk=response.json()['data']['id'], text='New report.').aexists())
+        response = await self.async_client.post(url, {'text': 'A' * 10001}, 'application/json')
+        self.assertEqual(response.json()['message'], 'JSON body validation error')
+        controller = AdmissionController(1, 0, rate_window=60, slots=1, default_duration=30)
+        with mock.patch('report.service.result_cache.admission_controller', controller):
+            response = await self.async_client.post(url, {'text': 'Rejected report.'}, 'application/json')
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+
+
+class ReportStreamTest(TransactionTestCase):
+    """Progress events of a report until it is finished, the checks are made outside the test transaction."""
+    def setUp(self) -> None:
+        caches['reports'].clear()
+        self.user = User.objects.create_user('user', password='password')
+        self.report = create_reports(self.user, 1, Report.ReportStatus.IN_PROCESS)[0]
+        Report.objects.filter(pk=self.report.pk).update(claim_owner='host#0')
+        self.url = reverse('report:stream', args=[self.report.pk])
+
+    async def read_events(self, stream: ReportProgressStream, finish: Report.ReportStatus | None) -> list[str]:
+        """Names of the events, the report is finished with the status after the first event."""
+        events = []
+        async for chunk in stream:
+            events += re.findall(r'^event: (\w+)$', chunk, re.MULTILINE)
+            if finish is not None and events == ['report']:
+                await Report.objects.filter(pk=self.report.pk).aupdate(status=finish, calculation_end_dttm=timezone.now())
+        return events
+
+    async def test_completed(self) -> None:
+        await sync_to_async(create_recognitions)(self.report, 3)
+        stream = ReportProgressStream(self.report.pk, self.user, interval=0.01, timeout=5)
+        events = await self.read_events(stream, Report.ReportStatus.COMPLETED)
+        self.assertEqual(events, ['report', 'status', 'recognitions', 'end'])
+
+    async def test_error(self) -> None:
+        stream = ReportProgressStream(self.report.pk, self.user, interval=0.01, timeout=5)
+        self.assertEqual(await self.read_events(stream, Report.ReportStatus.ERROR), ['report', 'status', 'end'])
+
+    async def test_finished(self) -> None:
+        await Report.objects.filter(pk=self.report.pk).aupdate(status=Report.ReportStatus.COMPLETED)
+        stream = ReportProgressStream(self.report.pk, self.user, interval=0.01, timeout=5)
+        self.assertEqual(await self.read_events(stream, None), ['report', 'end'])
+
+    async def test_timeout(self) -> None:
+        stream = ReportProgressStream(self.report.pk, self.user, interval=0.01, timeout=0.1)
+        self.assertEqual(await self.read_events(stream, None), ['report'])
+
+    async def test_asgi(self) -> None:
+        await Report.objects.filter(pk=self.report.pk).aupdate(status=Report.ReportStatus.COMPLETED)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(re.findall(r'^event: (\w+)$', content, re.MULTILINE), ['report', 'end'])
+
+    def test_wsgi(self) -> None:
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(json.loads(response.content)['errors'], ['StreamUnavailable'])
+
+    def test_long_lived(self) -> None:
+        self.assertTrue(LongLivedASGIHandler.is_long_lived({'path': self.url}))
+        self.assertTrue(LongLivedASGIHandler.is_long_lived({'path': '/api' + self.url, 'root_path': '/api'}))
+        self.assertFalse(LongLivedASGIHandler.is_long_lived({'path': reverse('report:list')}))
+        self.assertFalse(LongLivedASGIHandler.is_long_lived({'path': '/unknown/'}))
+
+
+class ReportETagTest(TestCase):
+    """Polling clients get 304 Not Modified until the report changes."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.report = create_reports(cls.user, 1)[0]
+        create_recognitions(cls.report, 10)
+        cls.url = reverse('report:detail', args=[cls.report.pk])
+
+    def setUp(self) -> None:
+        caches['reports'].clear()
+        self.client.force_login(self.user)
+
+    def test_not_modified(self) -> None:
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag.removeprefix('W/'))
+        self.assertEqual(response.status_code, 304)
+
+    def test_variant(self) -> None:
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, {'limit': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['data']['recognitions']), 5)
+        response = self.client.get(self.url, {'limit': 5}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified(self) -> None:
+        Report.objects.filter(pk=self.report.pk).update(
+            status=Report.ReportStatus.IN_PROCESS, calculation_end_dttm=None, claim_owner='host#0'
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['data']['status'], ReportStatus.IN_PROCESS)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Report.objects.filter(pk=self.report.pk).update(
+            status=Report.ReportStatus.COMPLETED, calculation_end_dttm=timezone.now()
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['data']['status'], ReportStatus.COMPLETED)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """The breaker takes the host out of rotation after host errors in a row and lets one trial report back."""
+    url = 'http://model:8080/'
+
+    def record_failure(self, breaker: CircuitBreaker) -> None:
+        with self.assertLogs('report.service.hosts', 'WARNING'):
+            breaker.record(requests.ConnectionError())
+
+    def test_open(self) -> None:
+        breaker = CircuitBreaker(self.url, failure_threshold=2, reset_timeout=60)
+        breaker.record(requests.ConnectionError())
+        breaker.record(None)
+        breaker.record(requests.ConnectionError())
+        breaker.record(ValueError('Invalid report'))
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        breaker.record(requests.ConnectionError())
+        self.record_failure(breaker)
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        self.assertFalse(breaker.is_available())
+
+    def test_half_open(self) -> None:
+        breaker = CircuitBreaker(self.url, failure_threshold=1, reset_timeout=0)
+        self.record_failure(breaker)
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        self.assertTrue(breaker.is_available())
+        breaker.acquire()
+        self.assertFalse(breaker.is_available())
+        breaker.record(None)
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        self.assertTrue(breaker.is_available())
+
+    def test_trial_without_call(self) -> None:
+        breaker = CircuitBreaker(self.url, failure_threshold=1, reset_timeout=0)
+        self.record_failure(breaker)
+        self.assertTrue(breaker.is_available())
+        breaker.acquire()
+        self.assertFalse(breaker.is_available())
+        breaker.release()
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        self.assertTrue(breaker.is_available())
+
+    def test_failed_trial(self) -> None:
+        breaker = CircuitBreaker(self.url, failure_threshold=3, reset_timeout=60)
+        for _ in range(2):
+            breaker.record(requests.ConnectionError())
+        self.record_failure(breaker)
+        breaker.half_open()
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        breaker.acquire()
+        self.record_failure(breaker)
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        self.assertFalse(breaker.is_available())
+
+
+class ConcurrencyLimitTest(SimpleTestCase):
+    """The concurrency limit of a host grows by one per limit fast calls and is halved on slow or overloaded calls."""
+    def setUp(self) -> None:
+        self.now = 100.0
+        patcher = mock.patch('report.service.hosts.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, limit: ConcurrencyLimit, count: int, latency: float, error: Exception | None = None) -> None:
+        for _ in range(count):
+            limit.update('host', latency, error)
+
+    def test_increase(self) -> None:
+        limit = ConcurrencyLimit(2, minimum=1, maximum=4, latency_target=1)
+        self.update(limit, 2, 0.5)
+        self.assertEqual(limit.value, 2)
+        self.update(limit, 1, 0.5)
+        self.assertEqual(limit.value, 3)
+        self.update(limit, 3, 0.5)
+        self.assertEqual(limit.value, 4)
+        self.update(limit, 20, 0.5)
+        self.assertEqual(limit.value, 4)
+
+    def test_decrease(self) -> None:
+        limit = ConcurrencyLimit(8, minimum=2, maximum=8, latency_target=1)
+        self.update(limit, 1, 1.5)
+        self.assertEqual(limit.value, 4)
+        self.update(limit, 3, 1.5)
+        self.assertEqual(limit.value, 4)
+        self.now += 1
+        self.update(limit, 1, 0.1, requests.Timeout())
+        self.assertEqual(limit.value, 2)
+        self.now += 1
+        self.update(limit, 1, 0.1, ConnectionError())
+        self.assertEqual(limit.value, 2)
+        self.update(limit, 5, 0.1, ValueError('Invalid report'))
+        self.assertEqual(limit.value, 2)
+
+    def test_fixed(self) -> None:
+        limit = ConcurrencyLimit(3, minimum=1, maximum=10, latency_target=0)
+        self.update(limit, 10, 0.1)
+        self.update(limit, 10, 100, requests.Timeout())
+        self.assertEqual(limit.value, 3)
+
+    def test_try_acquire(self) -> None:
+        limit = ConcurrencyLimit(2, minimum=1, maximum=2, latency_target=1)
+        stats = HostStats('host', limit, CircuitBreaker('host', 3, 60))
+        self.assertEqual([stats.try_acquire() for _ in range(3)], [True, True, False])
+        self.update(limit, 1, 1.5)
+        stats.release()
+        self.assertFalse(stats.try_acquire())
+        stats.release()
+        self.assertTrue(stats.try_acquire())
+        self.assertEqual((stats.limit, stats.outstanding), (1, 1))
+
+
+class BalancerTest(SimpleTestCase):
+    """Balancers pick the host by the reports in process and the latency and error rate of its model calls."""
+    def create_stats(self, url: str, outstanding: int = 0, latency: float | None = None, errors: int = 0) -> HostStats:
+        stats = HostStats(url, ConcurrencyLimit(10, 1, 10, latency_target=0), CircuitBreaker(url, 100, 60))
+        if latency is not None:
+            with mock.patch('report.service.hosts.time.monotonic', side_effect=[0.0, latency]), stats.measure():
+                pass
+        for _ in range(errors):
+            with self.assertRaises(ConnectionError), stats.measure():
+                raise ConnectionError()
+        for _ in range(outstanding):
+            stats.acquire()
+        return stats
+
+    @staticmethod
+    def choose(balancer: Balancer, hosts: list[HostStats], seed: int = 0) -> str:
+        with mock.patch('report.service.balancing.random', random.Random(seed)):
+            return balancer(hosts).url
+
+    def test_fifo(self) -> None:
+        hosts = [self.create_stats('a', outstanding=5, latency=3), self.create_stats('b')]
+        self.assertEqual(self.choose(BALANCERS['fifo'], hosts), 'a')
+
+    def test_least_outstanding(self) -> None:
+        hosts = [self.create_stats('a', outstanding=2), self.create_stats('b'), self.create_stats('c', outstanding=1)]
+        self.assertEqual(self.choose(BALANCERS['least_outstanding'], hosts), 'b')
+        hosts[1].acquire()
+        hosts[1].acquire()
+        self.assertEqual({self.choose(BALANCERS['least_outstanding'], hosts, seed) for seed in range(10)}, {'c'})
+        hosts[2].acquire()
+        ties = {self.choose(BALANCERS['least_outstanding'], hosts, seed) for seed in range(20)}
+        self.assertEqual(ties, {'a', 'b', 'c'})
+
+    def test_ewma(self) -> None:
+        hosts = [
+            self.create_stats('slow', latency=1.0),
+            self.create_stats('busy', outstanding=3, latency=0.2),
+            self.create_stats('failing', latency=0.3, errors=3),
+        ]
+        self.assertEqual([round(get_ewma_score(stats), 3) for stats in hosts], [1.0, 0.8, 0.586])
+        self.assertEqual(self.choose(BALANCERS['ewma'], hosts), 'failing')
+        hosts[2].acquire()
+        self.assertEqual(self.choose(BALANCERS['ewma'], hosts), 'busy')
+        self.assertEqual(self.choose(BALANCERS['ewma'], hosts + [self.create_stats('new')]), 'new')
+
+    def test_power_of_two(self) -> None:
+        hosts = [self.create_stats('a', latency=0.1), self.create_stats('b', latency=0.2),
+                 self.create_stats('c', latency=0.3)]
+        choices = [self.choose(BALANCERS['p2c'], hosts, seed) for seed in range(30)]
+        self.assertEqual(choices, [self.choose(BALANCERS['p2c'], hosts, seed) for seed in range(30)])
+        self.assertEqual(set(choices), {'a', 'b'})
+        self.assertGreater(choices.count('a'), choices.count('b'))
+        self.assertEqual(self.choose(BALANCERS['p2c'], hosts[2:]), 'c')
+
+
+class EstimateManager(ReportCalculationManager):
+    """Calculation manager that exposes its hosts to train their duration models."""
+    def __init__(self, *args, **kwargs) -> None:
+        self.hosts: dict[str, ModelHost] = {}
+        super().__init__(*args, **kwargs)
+
+    def _build_worker(self, worker_id: str, host: ModelHost, *args) -> Worker:
+        self.hosts[host.url] = host
+        return super()._build_worker(worker_id, host, *args)
+
+
+class CompletionEstimateTest(SimpleTestCase):
+    """Completion of a report is estimated by the duration models of the hosts and its place in the queue."""
+    def setUp(self) -> None:
+        self.now = timezone.now()
+        patcher = mock.patch('report.service.calculation_manager.timezone.now', return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = EstimateManager(['http://a/', 'http://b/'], 2, 1, 60, ModelClientOptions(
+            pool_size=1, connect_timeout=1, read_timeout=5, retries=0, retry_backoff=0, compression=False
+        ))
+
+    def observe(self, url: str, seconds_per_char: float) -> None:
+        for length in (100, 200, 300):
+            self.manager.hosts[url].stats.duration.observe(length, length * seconds_per_char)
+
+    def get_seconds(self, dttm: datetime) -> float:
+        return (dttm - self.now).total_seconds()
+
+    def test_duration_model(self) -> None:
+        model = DurationModel()
+        self.assertEqual((model.observed, model.mean, model.predict(100)), (False, None, None))
+        model.observe(100, 2.0)
+        model.observe(100, 4.0)
+        self.assertAlmostEqual(model.predict(1000), 3.0, places=1)
+        for length in (200, 300, 400):
+            model.observe(length, 0.5 + length / 100)
+        self.assertGreater(model.predict(800), model.predict(400))
+        model = DurationModel(decay=0.1)
+        for length, duration in [(100, 1.0), (200, 2.0)] * 50 + [(100, 3.0), (200, 6.0)] * 50:
+            model.observe(length, duration)
+        self.assertAlmostEqual(model.predict(300), 9.0, places=1)
+        self.assertAlmostEqual(model.predict(0), 0.0, places=1)
+        self.assertAlmostEqual(model.mean, 4.5, delta=0.2)
+
+    def test_no_samples(self) -> None:
+        report = Report(text='A' * 150, status=Report.ReportStatus.WAITING)
+        self.assertEqual(self.manager.estimate_completion(report, 1), CompletionEstimate(None, None))
+
+    def test_waiting(self) -> None:
+        self.observe('http://a/', 0.01)
+        self.observe('http://b/', 0.01)
+        report = Report(text='A' * 150, status=Report.ReportStatus.WAITING)
+        estimate = self.manager.estimate_completion(report, 5)
+        self.assertAlmostEqual(self.get_seconds(estimate.start_dttm), 2, places=1)
+        self.assertAlmostEqual((estimate.end_dttm - estimate.start_dttm).total_seconds(), 1.5)
+        for host in self.manager.hosts.values():
+            host.stats.acquire()
+            host.stats.acquire()
+        self.assertAlmostEqual(self.get_seconds(self.manager.estimate_completion(report, 5).start_dttm), 2.5, places=1)
+
+    def test_in_process(self) -> None:
+        self.observe('http://a/', 0.01)
+        self.observe('http://b/', 0.02)
+        report = Report(text='A' * 150, status=Report.ReportStatus.IN_PROCESS, claim_owner='http://b/#0@instance',
+                        calculation_start_dttm=self.now - timedelta(seconds=1))
+        estimate = self.manager.estimate_completion(report, None)
+        self.assertEqual(estimate.start_dttm, report.calculation_start_dttm)
+        self.assertAlmostEqual(self.get_seconds(estimate.end_dttm), 2)
+        report.calculation_start_dttm = self.now - timedelta(seconds=10)
+        self.assertEqual(self.manager.estimate_completion(report, None).end_dttm, self.now)
+        report.claim_owner = 'http://unknown/#0@instance'
+        self.assertEqual(self.manager.estimate_completion(report, None).end_dttm, self.now)
+
+
+class FastJSONRendererTest(SimpleTestCase):
+    """The fast renderer gives the same JSON as the renderer of DRF, with or without orjson."""
+    dttm = datetime.fromisoformat('2024-01-02T03:04:05.123456+00:00')
+    data = {
+        'dttm': dttm,
+        'naive': datetime(2024, 1, 2, 3, 4, 5, 120000),
+        'local': datetime.fromisoformat('2024-01-02T03:04:05+03:00'),
+        'date': date(2024, 1, 2),
+        'amount': Decimal('1.50'),
+        'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+        'text': 'Отчёт',
+    }
+
+    def test_types(self) -> None:
+        estimate = CompletionEstimate(self.dttm, None)
+        rendered = FastJSONRenderer().render({**self.data, 'estimate': estimate})
+        with mock.patch('common.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render({**self.data, 'estimate': estimate}), rendered)
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertIn('"text":"Отчёт"'.encode(), rendered)
+        self.assertEqual(json.loads(rendered), {
+            'dttm': '2024-01-02T03:04:05.123456Z',
+            'naive': '2024-01-02T03:04:05.120000',
+            'local': '2024-01-02T03:04:05+03:00',
+            'date': '2024-01-02',
+            'amount': 1.5,
+            'uuid': '12345678-1234-5678-1234-567812345678',
+            'text': 'Отчёт',
+            'estimate': {'start_dttm': '2024-01-02T03:04:05.123456Z', 'end_dttm': None},
+        })
+
+    def test_error_envelope(self) -> None:
+        with mock.patch('common.api_utils.timezone.now', return_value=self.dttm):
+            response = json_bad_request('JSON body validation error', [{'loc': ['text'], 'msg': 'field required'}])
+        rendered = FastJSONRenderer().render(response.data)
+        self.assertEqual(rendered, JSONRenderer().render(response.data))
+        self.assertEqual(json.loads(rendered), {
+            'success': False,
+            'message': 'JSON body validation error',
+            'errors': [{'loc': ['text'], 'msg': 'field required'}],
+            'dttm': '2024-01-02T03:04:05.123456Z',
+            'data': None,
+        })
+        indented = FastJSONRenderer().render(response.data, 'application/json; indent=2')
+        self.assertEqual(json.loads(indented), json.loads(rendered))
+
+
+class ReportPageTest(TestCase):
+    """Keyset pages of the report list follow the creation time and the id, a broken cursor is a bad request."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        now = timezone.now()
+        Report.objects.bulk_create([
+            Report(text=f'Report {i}.', user=cls.user, status=Report.ReportStatus.COMPLETED,
+                   create_dttm=now - timedelta(minutes=i // 3))
+            for i in range(8)
+        ])
+        cls.expected = list(Report.objects.order_by('-create_dttm', '-id').values_list('id', flat=True))
+
+    def test_ties(self) -> None:
+        for limit in (1, 2, 4):
+            with self.subTest(limit=limit):
+                ids, cursor = [], None
+                while True:
+                    page = ReportManager.get_page(self.user, cursor, limit)
+                    ids += [item.id for item in page.reports]
+                    if page.next_cursor is None:
+                        break
+                    cursor = page.next_cursor
+                self.assertEqual(ids, self.expected)
+        page = ReportManager.get_page(self.user, limit=4)
+        self.assertEqual(len({item.create_dttm for item in page.reports}), 2)
+        self.assertEqual(decode_cursor(page.next_cursor), (page.reports[-1].create_dttm, page.reports[-1].id))
+
+    @staticmethod
+    def encode(value: bytes) -> str:
+        return base64.urlsafe_b64encode(value).decode()
+
+    def test_invalid_cursor(self) -> None:
+        self.client.force_login(self.user)
+        dttm = timezone.now().isoformat()
+        cursors = [
+            'not a cursor', '!!!', self.encode(b'no separator'), self.encode(f'{dttm}|1|2'.encode()),
+            self.encode(f'{dttm}|id'.encode()), self.encode(b'yesterday|1'), self.encode(b'\xff|1'),
+            encode_cursor(datetime(2024, 1, 2, 3, 4, 5), 1),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidReportCursor):
+                    ReportManager.get_page(self.user, cursor)
+                response = self.client.get(reverse('report:list'), {'cursor': cursor})
+                self.assertEqual((response.status_code, response.json()['errors']), (400, ['InvalidCursor']))
+
+
+class ReportQueryCountTest(TestCase):
+    """Reading reports takes a fixed number of queries whatever the number of reports and recognitions."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.reports = create_reports(cls.user, 60)
+        create_recognitions(cls.reports[0], 40)
+
+    def setUp(self) -> None:
+        caches['reports'].clear()
+
+    def test_report_info(self) -> None:
+        with self.assertNumQueries(2):
+            info = ReportManager.load(self.reports[0].pk, self.user).get_report_info()
+            self.assertEqual(info.user, self.user.pk)
+        self.assertEqual(len(info.recognitions), 40)
+
+    def test_cached_report_info(self) -> None:
+        info = ReportManager.load(self.reports[0].pk, self.user).get_report_info()
+        with self.assertNumQueries(0):
+            self.assertEqual(ReportManager.load(self.reports[0].pk, self.user).get_report_info(), info)
+            part = ReportManager.load(self.reports[0].pk, self.user).get_report_info(since_sentence=9, limit=5)
+        self.assertEqual([r.sentence_number for r in part.recognitions], [10, 11, 12, 13, 14])
+        other = User.objects.create_user('other', password='password')
+        with self.assertRaises(ReportDoesNotExist):
+            ReportManager.load(self.reports[0].pk, other)
+
+    def test_report_info_part(self) -> None:
+        with self.assertNumQueries(2) as context:
+            part = ReportManager.load(self.reports[0].pk, self.user).get_report_info(
+                since_sentence=9, limit=5, omit={'sentence'}
+            )
+        self.assertEqual([r.sentence_number for r in part.recognitions], [10, 11, 12, 13, 14])
+        self.assertIsNone(part.recognitions[0].sentence)
+        self.assertIn('LIMIT 5', context.captured_queries[-1]['sql'])
+        self.assertNotIn('"sentence",', context.captured_queries[-1]['sql'])
+        with self.assertNumQueries(1):
+            ReportManager.load(self.reports[0].pk, self.user)
+
+    def test_report_info_without_recognitions(self) -> None:
+        with self.assertNumQueries(1):
+            ReportManager.load(self.reports[0].pk, self.user).get_report_info(omit={'recognitions'})
+
+    def test_report_page(self) -> None:
+        with self.assertNumQueries(1):
+            page = ReportManager.get_page(self.user, limit=50)
+        self.assertEqual(len(page.reports), 50)
+        with self.assertNumQueries(1):
+            page = ReportManager.get_page(self.user, page.next_cursor, limit=50)
+        self.assertEqual(len(page.reports), 10)
+        self.assertIsNone(page.next_cursor)
+
+    def test_profile(self) -> None:
+        self.client.force_login(self.user)
+        other = User.objects.create_user('other', password='password')
+        create_reports(other, 2)
+        with self.assertNumQueries(3) as full:
+            self.client.get(reverse('web_app:profile'))
+        self.client.force_login(other)
+        with self.assertNumQueries(len(full.captured_queries)):
+            self.client.get(reverse('web_app:profile'))
+
+
+class RecognitionStoreTest(TestCase):
+    """Recognitions saved in the compact form are read back with the report in one query."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.report, cls.other_report = create_reports(cls.user, 2)
+        cls.recognitions = [
+            StoredRecognition(None, 'Report 0.', i % 2 == 0, 0.5 + i / 100, i) for i in range(20)
+        ]
+
+    def setUp(self) -> None:
+        caches['reports'].clear()
+
+    def test_compact(self) -> None:
+        RecognitionStore(compact=True).save([
+            (self.report, self.recognitions),
+            (self.other_report, [StoredRecognition(None, 'Missing sentence.', False, 0.5, 0)]),
+        ])
+        self.assertTrue(ReportResult.objects.filter(report=self.report).exists())
+        self.assertFalse(ReportResult.objects.filter(report=self.other_report).exists())
+        with self.assertNumQueries(1):
+            info = ReportManager.load(self.report.pk, self.user).get_report_info()
+        self.assertEqual([r.sentence for r in info.recognitions], [r.sentence for r in self.recognitions])
+        for recognition, stored in zip(info.recognitions, self.recognitions):
+            self.assertAlmostEqual(recognition.probability, stored.probability, places=6)
+        self.assertEqual(ReportManager.load(self.other_report.pk).get_recognitions()[0].sentence, 'Missing sentence.')
+
+    def test_backfill(self) -> None:
+        RecognitionStore(compact=False).save([(self.report, self.recognitions)])
+        self.assertEqual(RecognitionStore(compact=False).compact([self.report, self.other_report]), 1)
+        self.assertFalse(ReportRecognition.objects.exists())
+        self.assertEqual(len(ReportManager.load(self.report.pk).get_recognitions()), 20)
+
+
+class ReportQueryPlanTest(TestCase):
+    """Queries on the report tables are served by indexes without full scans and sorts."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+        cls.reports = create_reports(cls.user, 20) + create_reports(cls.user, 20, Report.ReportStatus.WAITING)
+        create_recognitions(cls.reports[0], 20)
+
+    def setUp(self) -> None:
+        if connection.vendor not in FULL_SCAN:
+            self.skipTest(f'Query plans of {connection.vendor} are not checked')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertIndexScan(self, queryset: QuerySet, ordered: bool = False) -> None:
+        plan = queryset.explain()
+        self.assertIsNone(FULL_SCAN[connection.vendor].search(plan), plan)
+        if ordered:
+            self.assertIsNone(SORT[connection.vendor].search(plan), plan)
+
+    def test_report_page(self) -> None:
+        report = self.reports[5]
+        self.assertIndexScan(
+            Report.objects
+            .filter(user=self.user, create_dttm__lte=report.create_dttm)
+            .order_by('-create_dttm', '-id')
+            .values('id', 'status', 'create_dttm')[:50],
+            ordered=True,
+        )
+
+    def test_recognitions(self) -> None:
+        self.assertIndexScan(RecognitionStore.select_rows(self.reports[0], 5, 10, with_sentences=False), ordered=True)
+
+    def test_queue_head(self) -> None:
+        self.assertIndexScan(
+            Report.objects
+            .filter(status=Report.ReportStatus.WAITING, duplicate_of__isnull=True)
+            .order_by('-priority', 'queue_number', 'id')[:1],
+            ordered=True,
+        )
+
+    def test_stale_claims(self) -> None:
+        self.assertIndexScan(
+            Report.objects.filter(status=Report.ReportStatus.IN_PROCESS, claim_dttm__lt=timezone.now())
+        )
+
+    def test_model_version(self) -> None:
+        self.assertIndexScan(
+            Report.objects
+            .filter(status=Report.ReportStatus.COMPLETED, calculation_end_dttm__isnull=False)
+            .order_by('-calculation_end_dttm')[:1],
+            ordered=True,
+        )
+        self.assertEqual(get_model_version(), '1')
+
+
+class SentenceMemoTest(TestCase):
+    """Sentences known to the memo are not sent to the model and only model calls count in the host statistics."""
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user('user', password='password')
+
+    def setUp(self) -> None:
+        self.version = '1'
+        self.model_client = mock.Mock(ModelHostClient)
+        self.model_client.recognize_batch.side_effect = self.recognize_batch
+        limit = ConcurrencyLimit(1, minimum=1, maximum=1, latency_target=0)
+        self.host = ModelHost('host', self.model_client, HostStats('host', limit, CircuitBreaker('host', 3, 60)))
+
+    def create_worker(self, max_size: int = 100) -> Worker:
+        memo = SentenceMemo(max_size, ttl=60, version_ttl=60)
+        return Worker('host#0', self.host, ReportQueue(claim_timeout=60), lambda worker_id: None, memo)
+
+    def recognize_batch(self, sentences: list[str]) -> ModelResponse:
+        return ModelResponse(
+            version=self.version,
+            source_text=' '.join(sentences),
+            recognition=[Recognition(sentence=s, is_paraphrase=False, probability=len(s) / 10) for s in sentences],
+            recognition_time='',
+        )
+
+    def get_calls(self) -> list[list[str]]:
+        return [call.args[0] for call in self.model_client.recognize_batch.call_args_list]
+
+    def test_hits(self) -> None:
+        worker = self.create_worker()
+        worker.recognize_on(self.host, 'One. Three.')
+        worker.recognize_on(self.host, 'Three. Eleven.')
+        response = worker.recognize_on(self.host, 'Eleven. One.')
+        self.assertEqual(self.get_calls(), [['One.', 'Three.'], ['Eleven.']])
+        self.assertEqual([(r.sentence, r.probability) for r in response.recognition], [('Eleven.', 0.7), ('One.', 0.4)])
+        self.assertEqual(self.host.stats.requests, 2)
+
+    def test_model_version(self) -> None:
+        worker = self.create_worker()
+        worker.recognize_on(self.host, 'One. Two.')
+        self.version = '2'
+        response = worker.recognize_on(self.host, 'One. Three.')
+        self.assertEqual(self.get_calls(), [['One.', 'Two.'], ['Three.'], ['One.', 'Three.']])
+        self.assertEqual(response.version, '2')
+        worker.recognize_on(self.host, 'Three. One.')
+        self.assertEqual(self.host.stats.requests, 3)
+
+    def test_eviction(self) -> None:
+        worker = self.create_worker(max_size=2)
+        worker.recognize_on(self.host, 'One. Two. Three.')
+        SentenceRecognition.objects.all().delete()
+        worker.recognize_on(self.host, 'Three. One.')
+        worker.recognize_on(self.host, 'Two.')
+        self.assertEqual(self.get_calls(), [['One.', 'Two.', 'Three.'], ['One.'], ['Two.']])
+
+    def test_start(self) -> None:
+        report = enqueue_reports(self.user, 1)[0]
+        worker = self.create_worker()
+        worker.recognize_on(self.host, report.text)
+        report = ReportQueue(claim_timeout=60).claim(worker.id)
+        self.host.stats.acquire()
+        worker.start(report)
+        self.assertEqual(Report.objects.get(pk=report.pk).status, Report.ReportStatus.COMPLETED)
+        self.assertEqual(len(self.get_calls()), 1)
+        self.assertEqual((self.host.stats.requests, self.host.stats.outstanding), (1, 0))
+
+
+class TextChunkerTest(SimpleTestCase):
+    """Long texts are recognized in chunks on the free hosts and merged back in the order of the sentences."""
+    text = ' '.join(f'Sentence number {i}.' for i in range(6))
+
+    def setUp(self) -> None:
+        self.host = self.create_host('own')
+        self.other_hosts = [self.create_host('first'), self.create_host('second')]
+        self.free_hosts = 2
+        self.versions = {}
+        self.failing = set()
+        self.calls = []
+        self.chunker = TextChunker(40, self.get_hosts, threads=2)
+
+    @staticmethod
+    def create_host(url: str) -> ModelHost:
+        limit = ConcurrencyLimit(1, minimum=1, maximum=1, latency_target=0)
+        return ModelHost(url, mock.Mock(ModelHostClient), HostStats(url, limit, CircuitBreaker(url, 3, 60)))
+
+    def get_hosts(self, host: ModelHost, count: int) -> list[ModelHost]:
+        return [other for other in self.other_hosts[:min(count, self.free_hosts)] if other.stats.try_acquire()]
+
+    def recognize(self, host: ModelHost, chunk: str) -> ModelResponse:
+        self.calls.append((host.url, chunk))
+        if host.url in self.failing:
+            raise ConnectionError(host.url)
+        return ModelResponse(
+            version=self.versions.get(host.url, '1'),
+            source_text=chunk,
+            recognition=[Recognition(sentence=s, is_paraphrase=False, probability=0.5) for s in split_sentences(chunk)],
+            recognition_time='',
+        )
+
+    def test_split_chunks(self) -> None:
+        chunks = split_chunks(self.text, 40)
+        self.assertEqual(chunks, ['Sentence number 0. Sentence number 1.', 'Sentence number 2. Sentence number 3.',
+                                  'Sentence number 4. Sentence number 5.'])
+        self.assertEqual(split_chunks('A very long sentence. Short.', 10), ['A very long sentence.', 'Short.'])
+        self.assertEqual(join_chunks(chunks, 2), [chunks[0], ' '.join(chunks[1:])])
+        self.assertEqual(join_chunks(['A long chunk.', 'B.', 'C.'], 3), ['A long chunk.', 'B.', 'C.'])
+        self.assertEqual(join_chunks(chunks, 1), [self.text])
+
+    def test_recognize(self) -> None:
+        response = self.chunker.recognize(self.host, self.text, self.recognize)
+        self.assertEqual(sorted(self.calls), sorted(zip(['first', 'second', 'own'], split_chunks(self.text, 40))))
+        self.assertEqual([r.sentence for r in response.recognition], split_sentences(self.text))
+        self.assertEqual((response.version, response.source_text), ('1', self.text))
+        self.assertEqual([host.stats.outstanding for host in self.other_hosts], [0, 0])
+
+    def test_recognize_async(self) -> None:
+        async def recognize(host: ModelHost, chunk: str) -> ModelResponse:
+            return self.recognize(host, chunk)
+
+        response = asyncio.run(self.chunker.recognize_async(self.host, self.text, recognize))
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual([r.sentence for r in response.recognition], split_sentences(self.text))
+
+    def test_no_free_hosts(self) -> None:
+        self.free_hosts = 0
+        self.assertIsNone(self.chunker.recognize(self.host, self.text, self.recognize))
+        self.assertIsNone(self.chunker.recognize(self.host, 'Short text.', self.recognize))
+        self.assertEqual(self.calls, [])
+
+    def test_fewer_free_hosts(self) -> None:
+        self.free_hosts = 1
+        response = self.chunker.recognize(self.host, self.text, self.recognize)
+        self.assertEqual(sorted(self.calls), [('first', self.text[:37]), ('own', self.text[38:])])
+        self.assertEqual(len(response.recognition), 6)
+
+    def test_failed_chunk(self) -> None:
+        self.failing.add('first')
+        response = self.chunker.recognize(self.host, self.text, self.recognize)
+        self.assertEqual([url for url, _ in self.calls].count('own'), 2)
+        self.assertEqual([r.sentence for r in response.recognition], split_sentences(self.text))
+        self.assertEqual(self.other_hosts[0].stats.outstanding, 0)
+
+    def test_model_versions(self) -> None:
+        self.versions['second'] = '2'
+        self.assertIsNone(self.chunker.recognize(self.host, self.text, self.recognize))
+        responses = [self.recognize(self.host, 'One.'), self.recognize(self.other_hosts[1], 'Two.')]
+        self.assertIsNone(merge_responses('One. Two.', responses))
+
+
+def start_stub_model(test: SimpleTestCase, options: StubModelOptions) -> tuple[StubModelServer, ModelHostClient]:
+    server = StubModelServer('127.0.0.1', 0, options)
+    server.start()
+    test.addCleanup(server.stop)
+    return server, ModelHostClient(server.url, ModelClientOptions(
+        pool_size=2, connect_timeout=1, read_timeout=5, retries=0, retry_backoff=0, compression=True
+    ))
+
+
+class StubModelTest(SimpleTestCase):
+    """The stub model service responds with payloads accepted by the model client."""
+    def start_stub(self, options: StubModelOptions) -> ModelHostClient:
+        return start_stub_model(self, options)[1]
+
+    def test_recognize(self) -> None:
+        client = self.start_stub(StubModelOptions(latency=0, version='test'))
+        response = client.recognize_batch(['First sentence.', 'Second sentence.'])
+        self.assertEqual([r.sentence for r in response.recognition], ['First sentence.', 'Second sentence.'])
+        self.assertEqual(response.version, 'test')
+        self.assertEqual(len(client.recognize('One. Two! Three?').recognition), 3)
+        self.assertTrue(client.check_health('/health'))
+
+    def test_errors(self) -> None:
+        client = self.start_stub(StubModelOptions(latency=0, error_rate=1))
+        with self.assertRaises(requests.HTTPError):
+            client.recognize('Text.')
+
+
+class SentenceBatcherTest(SimpleTestCase):
+    """Sentences of concurrent reports are sent to the model together and the results are split back to them."""
+    def create_batcher(self, max_size: int, max_delay: float, **options) -> SentenceBatcher:
+        self.server, client = start_stub_model(self, StubModelOptions(latency=0, **options))
+        return SentenceBatcher(client, max_size, max_delay)
+
+    @staticmethod
+    def recognize_together(batcher: SentenceBatcher, *texts: list[str]) -> list:
+        with ThreadPoolExecutor(len(texts)) as executor:
+            futures = [executor.submit(batcher.recognize_sentences, sentences) for sentences in texts]
+        return [future.exception() or future.result() for future in futures]
+
+    def test_batch(self) -> None:
+        batcher = self.create_batcher(max_size=4, max_delay=5)
+        first, second = self.recognize_together(batcher, ['One.', 'Two.'], ['Three.', 'Four.'])
+        self.assertEqual([r.sentence for r in first.recognition], ['One.', 'Two.'])
+        self.assertEqual([r.sentence for r in second.recognition], ['Three.', 'Four.'])
+        self.assertEqual((first.version, second.source_text), ('stub', 'Three. Four.'))
+        self.assertEqual((self.server.get_stats().requests, self.server.get_stats().sentences), (1, 4))
+
+    def test_max_size(self) -> None:
+        batcher = self.create_batcher(max_size=2, max_delay=0.05)
+        response = batcher.recognize_sentences(['One.', 'Two.', 'Three.', 'Four.', 'Five.'])
+        self.assertEqual([r.sentence for r in response.recognition], ['One.', 'Two.', 'Three.', 'Four.', 'Five.'])
+        self.assertEqual((self.server.get_stats().requests, self.server.get_stats().sentences), (3, 5))
+
+    def test_max_delay(self) -> None:
+        batcher = self.create_batcher(max_size=10, max_delay=0.1)
+        start = time.monotonic()
+        response = asyncio.run(batcher.recognize_sentences_async(['One.']))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual([r.sentence for r in response.recognition], ['One.'])
+        self.assertEqual(self.server.get_stats().requests, 1)
+
+    def test_error(self) -> None:
+        batcher = self.create_batcher(max_size=3, max_delay=5, error_rate=1)
+        with self.assertLogs('report.service.batching', 'WARNING'):
+            errors = self.recognize_together(batcher, ['One.'], ['Two.', 'Three.'])
+        self.assertEqual([type(error) for error in errors], [requests.HTTPError] * 2)
+        self.assertEqual(self.server.get_stats().requests, 1)
+
+
+class CalculationEngineTest(TransactionTestCase):
+    """The thread and asyncio engines claim, complete and fail reports the same way."""
+    engines = {
+        'thread': (ReportCalculationManager, {}),
+        'asyncio': (AsyncReportCalculationManager, {'db_threads': 2}),
+    }
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user('user', password='password')
+        caches['reports'].clear()
+
+    def calculate(self, engine: str, error_rate: float = 0) -> str:
+        """Calculate the queued reports with the engine, returns the url of the model host."""
+        server, _ = start_stub_model(self, StubModelOptions(latency=0.01, error_rate=error_rate))
+        manager_class, kwargs = self.engines[engine]
+        manager = manager_class([server.url], 2, 0.05, 60, ModelClientOptions(
+            pool_size=2, connect_timeout=1, read_timeout=5, retries=0, retry_backoff=0, compression=True
+        ), failure_threshold=100, max_attempts=2, **kwargs)
+        reports = enqueue_reports(self.user, 5)
+        manager.calculate(reports[0])
+        deadline = time.monotonic() + 10
+        unfinished = [Report.ReportStatus.WAITING, Report.ReportStatus.IN_PROCESS]
+        while Report.objects.filter(status__in=unfinished).exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        manager.stop()
+        return server.url
+
+    def test_completed(self) -> None:
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                url = self.calculate(engine)
+                for report in Report.objects.filter(user=self.user):
+                    self.assertEqual((report.status, report.model_version), (Report.ReportStatus.COMPLETED, 'stub'))
+                    self.assertTrue(report.claim_owner.startswith(f'{url}#'))
+                    self.assertEqual(report.calculation_attempts, 1)
+                    sentences = [r.sentence for r in ReportManager.load(report.pk).get_recognitions()]
+                    self.assertEqual(sentences, [report.text])
+                Report.objects.all().delete()
+
+    def test_error(self) -> None:
+        for engine in self.engines:
+            with self.subTest(engine=engine), mock.patch('threading.excepthook'):
+                with self.assertLogs('report.service', 'WARNING'):
+                    self.calculate(engine, error_rate=1)
+                for report in Report.objects.filter(user=self.user):
+                    self.assertEqual((report.status, report.calculation_attempts), (Report.ReportStatus.ERROR, 2))
+                    self.assertIn('503', ReportLog.objects.get(report=report).error)
+                Report.objects.all().delete()
@@ -8,5 +8,8 @@ app_name = 'report'
 
 urlpatterns = [
     path('', views.ReportList.as_view(), name='list'),
+    path('bulk/', views.ReportBulkList.as_view(), name='bulk'),
     path('<int:report_id>', views.ReportDetail.as_view(), name='detail'),
+    path('<int:report_id>/stream', views.ReportStream.as_view(), name='stream'),
+    path('hosts/', views.ModelHostList.as_view(), name='hosts'),
 ]
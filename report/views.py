@@ -1,6 +1,9 @@
-from dataclasses import asdict
+from datetime import datetime
+from typing import Literal
 
-from django.http import HttpRequest, Http404
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, HttpResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
@@ -8,10 +11,25 @@ from django.db.utils import IntegrityError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
-from pydantic import BaseModel, Field
+from rest_framework.permissions import IsAdminUser
+from pydantic import BaseModel, Field, conlist, constr, validator
 
-from common.api_utils import json_request, json_bad_request, json_404, json_success_response
-from .service.report import ReportManager
+from common.api_utils import (
+    AsyncAPIView,
+    etag_matches,
+    not_modified_response,
+    query_request,
+    json_request,
+    json_bad_request,
+    json_fail_response,
+    json_404,
+    json_success_response,
+    json_too_many_requests,
+)
+from common.renderers import EventStreamRenderer, FastJSONRenderer
+from .service.report import ReportManager, ReportStatus
+from .service.calculation_manager import calculation_manager
+from .service.progress import ReportProgressStream
 from .service import exceptions
 
 
@@ -20,30 +38,148 @@ class ReportCreateData(BaseModel):
     text: str = Field(max_length=10000)
 
 
-class ReportList(APIView):
+class ReportBulkCreateData(BaseModel):
+    """Request body when creating several reports."""
+    texts: conlist(constr(max_length=10000), min_items=1, max_items=1000)
+
+
+class ReportDetailQuery(BaseModel):
+    """
+        Query parameters when getting a report.
+        Recognitions of sentences after since_sentence are returned, at most limit of them.
+        omit is a comma separated list of omitted fields: text, recognitions, sentence (of recognitions).
+    """
+    since_sentence: int = Field(-1, ge=-1)
+    limit: int | None = Field(None, ge=1)
+    omit: set[Literal['text', 'recognitions', 'sentence']] = set()
+
+    @validator('omit', pre=True)
+    def split_omit(cls, value):
+        return [field for field in value.split(',') if field] if isinstance(value, str) else value
+
+    @property
+    def variant(self) -> str:
+        """Canonical form of parameters changing the representation of the report, empty for the defaults."""
+        if self.since_sentence == -1 and self.limit is None and not self.omit:
+            return ''
+        return f'{self.since_sentence}:{self.limit}:{",".join(sorted(self.omit))}'
+
+
+class ReportListQuery(BaseModel):
+    """
+        Query parameters when listing reports.
+        The next page is requested with next_cursor of the previous page.
+    """
+    cursor: str | None = None
+    limit: int = Field(50, ge=1, le=500)
+    status: ReportStatus | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+
+
+class ReportList(AsyncAPIView):
     """
         Methods for interacting with reports set.
-        POST: create report.
+        GET: page of the user reports from the newest.
+        POST: create report, 429 if the calculation queue is overloaded.
     """
+    @query_request(ReportListQuery)
+    async def get(self, request: Request, query: ReportListQuery) -> Response:
+        """Get reports of the user with the beginning of their texts"""
+        try:
+            page = await sync_to_async(ReportManager.get_page)(
+                request.user, query.cursor, query.limit, query.status, query.created_from, query.created_to
+            )
+        except exceptions.InvalidReportCursor as e:
+            return json_bad_request(str(e), ['InvalidCursor'])
+        return json_success_response(page)
+
     @json_request(ReportCreateData)
-    def post(self, request: Request, data: ReportCreateData) -> Response:
+    async def post(self, request: Request, data: ReportCreateData) -> Response:
         """Method to create account"""
-        report_manager = ReportManager.create(data.text, request.user)
+        try:
+            report_manager = await ReportManager.acreate(data.text, request.user)
+        except exceptions.ReportQueueOverloaded as e:
+            return json_too_many_requests(str(e), e.retry_after)
         report_manager.calculate()
-        return json_success_response(asdict(report_manager.get_report_info()), 201)
+        return json_success_response(await report_manager.aget_report_info(), 201)
 
 
-class ReportDetail(APIView):
+class ReportBulkList(APIView):
+    """
+        Methods for interacting with reports set in bulk.
+        POST: create reports for the list of texts, 429 if the calculation queue is overloaded.
+    """
+    @json_request(ReportBulkCreateData)
+    def post(self, request: Request, data: ReportBulkCreateData) -> Response:
+        """Create reports and return their ids, statuses and urls in the order of the texts"""
+        try:
+            report_managers = ReportManager.create_many(data.texts, request.user)
+        except exceptions.ReportQueueOverloaded as e:
+            return json_too_many_requests(str(e), e.retry_after)
+        for report_manager in report_managers:
+            report_manager.calculate()
+        return json_success_response(
+            [report_manager.get_created_info() for report_manager in report_managers], 201
+        )
+
+
+class ReportDetail(AsyncAPIView):
     """
         Methods of a specific report.
-        GET: get report data.
+        GET: get report data, 304 if the report has not changed since the request with the ETag.
     """
     @classmethod
-    def get(cls, request: Request, report_id: int) -> Response:
+    @query_request(ReportDetailQuery)
+    async def get(cls, request: Request, query: ReportDetailQuery, report_id: int) -> Response:
         """Get public account information"""
         try:
-            return json_success_response(
-                asdict(ReportManager.load(report_id, request.user).get_report_info())
-            )
+            report_manager = await ReportManager.aload(report_id, request.user)
         except exceptions.ReportDoesNotExist:
             return json_404(f'Report {report_id} does not exist')
+        progress = await report_manager.aget_progress_info()
+        etag = report_manager.get_etag(progress, query.variant)
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+        response = json_success_response(
+            await report_manager.aget_report_info(progress, query.since_sentence, query.limit, query.omit)
+        )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ReportStream(AsyncAPIView):
+    """
+        Progress of a specific report.
+        GET: stream of server-sent events with the report status, queue place and recognitions.
+        The stream is served only under ASGI, where common.asgi handles it without a thread per stream,
+        under WSGI the response is 501 and the client polls the report.
+    """
+    renderer_classes = [EventStreamRenderer, FastJSONRenderer]
+    long_lived_response = True
+
+    async def get(self, request: Request, report_id: int) -> HttpResponse:
+        if not isinstance(request._request, ASGIRequest):
+            return json_fail_response('Report streams are served only under ASGI', ['StreamUnavailable'], 501)
+        try:
+            await ReportManager.aload(report_id, request.user)
+        except exceptions.ReportDoesNotExist:
+            return json_404(f'Report {report_id} does not exist')
+        response = StreamingHttpResponse(
+            aiter(ReportProgressStream(report_id, request.user)), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class ModelHostList(APIView):
+    """
+        Model service hosts of the process serving the request.
+        GET: get statistics and current concurrency limits of the hosts.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request) -> Response:
+        return json_success_response(calculation_manager.get_hosts_info())
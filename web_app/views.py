@@ -8,8 +8,7 @@ from django.contrib.auth.models import User
 
 from common.api_utils import form_view
 from report.service.report import ReportManager
-from report.service.exceptions import ReportDoesNotExist
-from report.models import Report
+from report.service.exceptions import ReportDoesNotExist, InvalidReportCursor
 
 
 @login_required
@@ -34,15 +33,20 @@ def registration(request: HttpRequest) -> HttpResponse:
 @login_required
 @form_view
 def profile(request: HttpRequest) -> HttpResponse:
+    try:
+        page = ReportManager.get_page(cast(User, request.user), request.GET.get('cursor'))
+    except InvalidReportCursor:
+        return HttpResponseRedirect(reverse('web_app:profile'))
     return render(request, 'user/profile.html', context={
         'reports': [
             {
-                'id': report_data.pk,
-                'text': report_data.text if len(report_data.text) < 100 else f'{report_data.text[:98]}...',
+                'id': report_data.id,
+                'text': report_data.text,
                 'date': report_data.create_dttm,
             }
-            for report_data in Report.objects.filter(user=request.user).order_by('-create_dttm')
-        ]
+            for report_data in page.reports
+        ],
+        'next_cursor': page.next_cursor,
     })
 
 